@@ -0,0 +1,562 @@
+# Placement-search AI.
+#
+# For the current piece it finds every final position the piece can
+# reach with the moves GameState allows (left, right, down and rotation
+# with the game's kicks), scores the board each one leaves behind and
+# returns the actions that lead to the best one.
+#
+# The search works on column bitmasks instead of copying boards:
+# fits[rotation][x] has bit y set when the piece fits with its pivot at
+# (x, y), so a whole column of positions is tested with one AND.
+
+from collections import OrderedDict, deque
+
+import engine
+
+# Weights of the features of a board, higher scores are better
+DEFAULT_WEIGHTS = {
+    'height': -0.510066,     # sum of the column heights
+    'lines': 0.760666,       # rows cleared by the placement
+    'holes': -0.35663,       # empty squares with a block above them
+    'bumpiness': -0.184483,  # sum of height differences of neighbouring columns
+}
+
+
+############################################################
+# BOARD HELPERS
+############################################################
+
+def board_rows(board):
+    """
+    The board_rows function returns one bitmask per row for a Playfield
+    or a BitPlayfield.
+
+    :param board: Playfield or BitPlayfield object
+    :return: A list of row bitmasks, top to bottom
+    """
+    rows = getattr(board, 'rows', None)
+    if rows is not None:
+        return rows
+    rows = [0] * board.height
+    for x, y in board.grid:
+        rows[y] |= 1 << x
+    return rows
+
+
+def column_masks(rows, width):
+    """
+    The column_masks function transposes row bitmasks into column
+    bitmasks: bit y of cols[x] is set when square (x, y) is taken.
+
+    :param rows: A list of row bitmasks
+    :param width: Width of the board
+    :return: A list of column bitmasks, left to right
+    """
+    cols = [0] * width
+    for y, row in enumerate(rows):
+        while row:
+            low = row & -row
+            cols[low.bit_length() - 1] |= 1 << y
+            row ^= low
+    return cols
+
+
+def fill_down(seeds, free, height):
+    """
+    The fill_down function extends every seed bit towards higher rows
+    while it stays inside free (a Kogge-Stone fill, log2(height) steps).
+
+    :param seeds: Bitmask of the starting rows, inside free
+    :param free: Bitmask of the rows the fill may cover
+    :param height: Height of the board
+    :return: Bitmask of every row reached
+    """
+    shift = 1
+    while shift < height:
+        seeds |= free & (seeds << shift)
+        free &= free << shift
+        shift <<= 1
+    return seeds
+
+
+def fit_masks(cols, width, height, kind):
+    """
+    The fit_masks function computes, for every orientation and column of
+    the pivot, the rows where a piece of the given kind fits.
+
+    :param cols: Column bitmasks of the board
+    :param width: Width of the board
+    :param height: Height of the board
+    :param kind: One of engine.SHAPES
+    :return: fits[rotation][x], a bitmask of pivot rows
+    """
+    rows_mask = (1 << height) - 1
+    # squares under the floor count as taken
+    blocked = [col | ~rows_mask for col in cols]
+    fits = []
+    for offsets in engine.ROTATIONS[kind]:
+        per_x = []
+        for x in range(width):
+            fit = rows_mask
+            for dx, dy in offsets:
+                c = x + dx
+                if c < 0 or c >= width:
+                    fit = 0
+                    break
+                if dy >= 0:
+                    fit &= ~(blocked[c] >> dy)
+                else:
+                    # squares above the top count as taken too
+                    fit &= ~((blocked[c] << -dy) | ((1 << -dy) - 1))
+            per_x.append(fit)
+        fits.append(per_x)
+    return fits
+
+
+def kick_candidates(kind, rotation, kicks):
+    """
+    The kick_candidates function returns the offsets GameState tries
+    when rotating out of the given orientation.
+
+    :param kind: One of engine.SHAPES
+    :param rotation: The current orientation
+    :param kicks: Whether kicks are enabled
+    :return: A tuple of (dx, dy)
+    """
+    return engine.KICKS[kind][rotation] if kicks else engine.NO_KICKS
+
+
+############################################################
+# SEARCH
+############################################################
+
+def reachable(fits, piece, width, height, kicks):
+    """
+    The reachable function floods every position the piece can reach
+    from where it is now, one column of rows at a time.
+
+    :param fits: The fit_masks of the piece
+    :param piece: The Piece to move
+    :param width: Width of the board
+    :param height: Height of the board
+    :param kicks: Whether rotations try the kick offsets
+    :return: reach[rotation][x], a bitmask of reachable pivot rows
+    """
+    states = len(fits)
+    reach = [[0] * width for _ in range(states)]
+    start = 1 << piece.y
+    if not fits[piece.rotation][piece.x] & start:
+        return reach
+
+    reach[piece.rotation][piece.x] = start
+    todo = [(piece.rotation, piece.x)]
+    while todo:
+        r, x = todo.pop()
+        current = fill_down(reach[r][x], fits[r][x], height)
+        reach[r][x] = current
+
+        for nx in (x - 1, x + 1):
+            if 0 <= nx < width:
+                new = current & fits[r][nx] & ~reach[r][nx]
+                if new:
+                    reach[r][nx] |= new
+                    todo.append((r, nx))
+
+        if states == 1:
+            continue
+        nr = (r + 1) % states
+        # each row rotates with the first kick that fits it
+        remaining = current
+        for kx, ky in kick_candidates(piece.kind, r, kicks):
+            nx = x + kx
+            if not remaining or nx < 0 or nx >= width:
+                continue
+            moved = (remaining << ky if ky >= 0 else remaining >> -ky) & fits[nr][nx]
+            remaining &= ~(moved >> ky if ky >= 0 else moved << -ky)
+            new = moved & ~reach[nr][nx]
+            if new:
+                reach[nr][nx] |= new
+                todo.append((nr, nx))
+    return reach
+
+
+def placements(fits, reach, width):
+    """
+    The placements function lists the reachable positions where the
+    piece cannot move down any more.
+
+    :param fits: The fit_masks of the piece
+    :param reach: The reachable positions of the piece
+    :param width: Width of the board
+    :return: A list of (rotation, x, y)
+    """
+    found = []
+    for r, per_x in enumerate(reach):
+        for x in range(width):
+            rest = per_x[x] & ~(fits[r][x] >> 1)
+            while rest:
+                low = rest & -rest
+                found.append((r, x, low.bit_length() - 1))
+                rest ^= low
+    return found
+
+
+def rotate_to(fits, kind, r, x, y, kicks, width):
+    # Where a rotation from (r, x, y) ends up, or None
+    states = len(fits)
+    if states == 1:
+        return None
+    nr = (r + 1) % states
+    for kx, ky in kick_candidates(kind, r, kicks):
+        nx = x + kx
+        ny = y + ky
+        if 0 <= nx < width and ny >= 0 and fits[nr][nx] >> ny & 1:
+            return nr, nx, ny
+    return None
+
+
+def direct_path(fits, piece, target, kicks, width, height):
+    """
+    The direct_path function tries the usual way to reach a placement:
+    rotate where the piece is, slide sideways and hard drop.
+
+    :param fits: The fit_masks of the piece
+    :param piece: The Piece to move
+    :param target: The (rotation, x, y) to reach
+    :param kicks: Whether rotations try the kick offsets
+    :param width: Width of the board
+    :param height: Height of the board
+    :return: A list of (action, (rotation, x, y) before it), or None
+    """
+    r, x, y = piece.rotation, piece.x, piece.y
+    tr, tx, ty = target
+    plan = []
+    while r != tr:
+        if len(plan) >= len(fits):
+            return None
+        rotated = rotate_to(fits, piece.kind, r, x, y, kicks, width)
+        if rotated is None:
+            return None
+        plan.append((engine.ROTATE, (r, x, y)))
+        r, x, y = rotated
+
+    step = 1 if tx > x else -1
+    action = engine.RIGHT if step > 0 else engine.LEFT
+    while x != tx:
+        if not fits[r][x + step] >> y & 1:
+            return None
+        plan.append((action, (r, x, y)))
+        x += step
+
+    free = fits[r][x]
+    rest = fill_down(1 << y, free, height) & ~(free >> 1)
+    if rest != 1 << ty:
+        return None
+    plan.append((engine.DROP, (r, x, y)))
+    return plan
+
+
+def search_path(fits, piece, target, kicks, width, height):
+    """
+    The search_path function finds the shortest list of moves to a
+    placement with a breadth first search, for tucks and spins that
+    direct_path cannot do.
+
+    :param fits: The fit_masks of the piece
+    :param piece: The Piece to move
+    :param target: The (rotation, x, y) to reach
+    :param kicks: Whether rotations try the kick offsets
+    :param width: Width of the board
+    :param height: Height of the board
+    :return: A list of (action, (rotation, x, y) before it), or None
+    """
+    start = (piece.rotation, piece.x, piece.y)
+    parents = {start: None}
+    queue = deque([start])
+    while queue:
+        state = queue.popleft()
+        if state == target:
+            plan = [(engine.DROP, state)]
+            while parents[state] is not None:
+                state, action = parents[state]
+                plan.append((action, state))
+            plan.reverse()
+            return plan
+
+        r, x, y = state
+        following = [(engine.ROTATE, rotate_to(fits, piece.kind, r, x, y, kicks, width))]
+        for action, nx, ny in ((engine.LEFT, x - 1, y), (engine.RIGHT, x + 1, y),
+                               (engine.DOWN, x, y + 1)):
+            if 0 <= nx < width and ny < height and fits[r][nx] >> ny & 1:
+                following.append((action, (r, nx, ny)))
+        for action, nxt in following:
+            if nxt is not None and nxt not in parents:
+                parents[nxt] = (state, action)
+                queue.append(nxt)
+    return None
+
+
+############################################################
+# SCORING
+############################################################
+
+def column_features(col, height):
+    """
+    The column_features function measures one column.
+
+    :param col: Column bitmask
+    :param height: Height of the board
+    :return: (height of the column, holes in it)
+    """
+    if not col:
+        return 0, 0
+    h = height - ((col & -col).bit_length() - 1)
+    return h, h - bin(col).count('1')
+
+
+def board_features(cols, height):
+    """
+    The board_features function measures a board.
+
+    :param cols: Column bitmasks of the board
+    :param height: Height of the board
+    :return: (column heights, holes per column)
+    """
+    heights = []
+    holes = []
+    for col in cols:
+        h, hole = column_features(col, height)
+        heights.append(h)
+        holes.append(hole)
+    return heights, holes
+
+
+############################################################
+# TRANSPOSITIONCACHE CLASS
+############################################################
+
+def board_key(board):
+    """
+    The board_key function returns a hashable key that is the same for
+    every board with the same blocks, whatever the backend. It is the
+    board's Zobrist hash, which the board keeps up to date itself.
+
+    :param board: Playfield or BitPlayfield object
+    :return: A 64-bit int
+    """
+    return board.zobrist
+
+
+class TranspositionCache():
+    """
+    TranspositionCache class:
+    Remembers results keyed by board and piece, so positions reached by
+    different piece sequences are only searched once. The least recently
+    used entry is dropped when the cache is full.
+
+    :attr maxsize: type: int - the most entries kept
+    :attr hits: type: int - lookups that found an entry
+    :attr misses: type: int - lookups that did not
+    :attr evictions: type: int - entries dropped to make room
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        The get function looks up a key and marks it as recently used.
+
+        :param key: A hashable key
+        :return: The stored value, or None if there is none
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        The put function stores a value, dropping the least recently
+        used entries if the cache is full.
+
+        :param key: A hashable key
+        :param value: The value to store, not None
+        :return: None
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        The clear function drops every entry and resets the statistics.
+
+        :return: None
+        """
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        The stats function reports how well the cache is doing.
+
+        :return: A dictionary with hits, misses, evictions, size and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+############################################################
+# PLACEMENTAI CLASS
+############################################################
+
+class PlacementAI():
+    """
+    PlacementAI class:
+    Picks the best placement of each piece and plays it one action at a time.
+    An instance is a policy: calling it with a GameState returns the next action.
+
+    :attr weights: type: Dictionary - weight of each feature in DEFAULT_WEIGHTS
+    :attr kicks: type: Boolean - whether the game tries kicks on rotation
+    :attr plan: type: list - the remaining (action, expected position) pairs
+    :attr cache: type: TranspositionCache - best placements already found,
+                 or None; share it only between AIs with the same settings
+    """
+
+    def __init__(self, weights=None, kicks=False, cache=None):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+        self.kicks = kicks
+        self.cache = cache
+        self.plan = []
+        self.plan_piece = None
+
+    def score(self, rows, cols, features, cells, width, height):
+        """
+        The score function rates the board left by locking a piece on cells.
+        Only the columns the piece touched are measured again, unless it
+        clears rows.
+
+        :param rows: Row bitmasks of the board
+        :param cols: Column bitmasks of the board
+        :param features: The board_features of the board
+        :param cells: The squares of the locked piece
+        :param width: Width of the board
+        :param height: Height of the board
+        :return: The weighted score, higher is better
+        """
+        full = (1 << width) - 1
+        changed = {}
+        touched = {}
+        for x, y in cells:
+            changed[x] = changed.get(x, cols[x]) | 1 << y
+            touched[y] = touched.get(y, rows[y]) | 1 << x
+        lines = 0
+        for row in touched.values():
+            if row == full:
+                lines += 1
+
+        if lines:
+            new_rows = list(rows)
+            for y, row in touched.items():
+                new_rows[y] = row
+            kept = [row for row in new_rows if row != full]
+            heights, holes = board_features(column_masks([0] * lines + kept, width), height)
+        else:
+            heights, holes = features
+            heights = list(heights)
+            holes = list(holes)
+            for x, col in changed.items():
+                heights[x], holes[x] = column_features(col, height)
+
+        bumpiness = 0
+        for x in range(width - 1):
+            bumpiness += abs(heights[x] - heights[x + 1])
+        weights = self.weights
+        return (weights['height'] * sum(heights) + weights['lines'] * lines
+                + weights['holes'] * sum(holes) + weights['bumpiness'] * bumpiness)
+
+    def best_placement(self, board, piece):
+        """
+        The best_placement function scores every reachable final position
+        of the piece and returns the best one with the moves to get there.
+
+        :param board: Playfield or BitPlayfield object
+        :param piece: The Piece to place
+        :return: (placement, plan) where placement is (rotation, x, y) and
+                 plan is a list of (action, (rotation, x, y) before it),
+                 or (None, []) if the piece cannot move at all
+        """
+        if self.cache is not None:
+            key = (board_key(board), piece.kind, piece.rotation, piece.x, piece.y)
+            found = self.cache.get(key)
+            if found is not None:
+                return found[0], list(found[1])
+
+        width = board.width
+        height = board.height
+        rows = board_rows(board)
+        cols = column_masks(rows, width)
+        fits = fit_masks(cols, width, height, piece.kind)
+        reach = reachable(fits, piece, width, height, self.kicks)
+        features = board_features(cols, height)
+
+        best = None
+        best_score = None
+        offsets = engine.ROTATIONS[piece.kind]
+        for r, x, y in placements(fits, reach, width):
+            cells = [(x + dx, y + dy) for dx, dy in offsets[r]]
+            score = self.score(rows, cols, features, cells, width, height)
+            if best_score is None or score > best_score:
+                best = (r, x, y)
+                best_score = score
+        if best is None:
+            if self.cache is not None:
+                self.cache.put(key, (None, ()))
+            return None, []
+
+        plan = direct_path(fits, piece, best, self.kicks, width, height)
+        if plan is None:
+            plan = search_path(fits, piece, best, self.kicks, width, height)
+        if self.cache is not None:
+            self.cache.put(key, (best, tuple(plan)))
+        return best, plan
+
+    def __call__(self, state):
+        """
+        Returns the next action for the game. The plan is made again
+        whenever the piece is not where the plan expects it, e.g. after
+        gravity moved it.
+
+        :param state: GameState object
+        :return: One of engine.ACTIONS
+        """
+        if state.over:
+            return engine.NOOP
+        piece = state.piece
+        position = (piece.rotation, piece.x, piece.y)
+        if (self.plan_piece is not piece or not self.plan
+                or self.plan[0][1] != position):
+            self.plan = self.best_placement(state.board, piece)[1]
+            self.plan_piece = piece
+            if not self.plan:
+                return engine.DROP
+        return self.plan.pop(0)[0]
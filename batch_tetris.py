@@ -0,0 +1,271 @@
+# Many Tetris games stepped together with NumPy.
+#
+# BatchTetris follows the rules of engine.GameState (and so of
+# Tetris.do_move, do_rotate and the space-bar hard drop) but keeps every
+# game in the same arrays, so one call to step() moves, rotates, drops,
+# locks and clears lines for all of them with array operations.
+
+import numpy as np
+
+import engine
+
+############################################################
+# TABLES
+############################################################
+
+# Every shape is padded to 4 orientations by cycling its own states,
+# so OFFSETS[kind, rotation % NUM_ROTATIONS[kind]] is always valid.
+NUM_ROTATIONS = np.array([len(engine.ROTATIONS[kind]) for kind in engine.SHAPES])
+
+# OFFSETS[kind, rotation, block] - (dx, dy) of the block from the pivot
+OFFSETS = np.array([[engine.ROTATIONS[kind][r % len(engine.ROTATIONS[kind])]
+                     for r in range(4)]
+                    for kind in engine.SHAPES], dtype=np.int64)
+
+# PIVOTS[kind] - (dx, dy) of the pivot from the spawn center
+PIVOTS = np.array([engine.SHAPE_CELLS[kind][1] for kind in engine.SHAPES], dtype=np.int64)
+
+
+def kick_table(kicks):
+    """
+    The kick_table function packs the engine KICKS into an array. Shapes
+    with fewer candidates repeat their last one, which can never fit
+    when the same offset did not fit the first time.
+
+    :param kicks: Whether rotations try the KICKS offsets
+    :return: An array KICK_OFFSETS[kind, rotation, candidate] of (dx, dy)
+    """
+    if not kicks:
+        return np.zeros((len(engine.SHAPES), 4, 1, 2), dtype=np.int64)
+
+    longest = max(len(c) for kind in engine.SHAPES for c in engine.KICKS[kind])
+    table = []
+    for kind in engine.SHAPES:
+        states = engine.KICKS[kind]
+        rows = []
+        for r in range(4):
+            candidates = list(states[r % len(states)])
+            candidates += [candidates[-1]] * (longest - len(candidates))
+            rows.append(candidates)
+        table.append(rows)
+    return np.array(table, dtype=np.int64)
+
+
+# Translation of each action, indexed by action number
+ACTION_DX = np.zeros(len(engine.ACTIONS), dtype=np.int64)
+ACTION_DY = np.zeros(len(engine.ACTIONS), dtype=np.int64)
+for action, (dx, dy) in engine.MOVES.items():
+    ACTION_DX[action] = dx
+    ACTION_DY[action] = dy
+
+
+############################################################
+# BATCHTETRIS CLASS
+############################################################
+
+class BatchTetris():
+    """
+    BatchTetris class:
+    N independent games held in arrays
+
+    :attr width: type: int - width of every board in squares
+    :attr height: type: int - height of every board in squares
+    :attr boards: type: ndarray - (N, height, width) bool, the locked blocks
+    :attr kind: type: ndarray - (N,) index in engine.SHAPES of each current piece
+    :attr rotation: type: ndarray - (N,) orientation of each current piece
+    :attr x: type: ndarray - (N,) column of each pivot block
+    :attr y: type: ndarray - (N,) row of each pivot block
+    :attr lines: type: ndarray - (N,) total rows cleared by each game
+    :attr pieces: type: ndarray - (N,) pieces spawned by each game
+    :attr over: type: ndarray - (N,) whether each game is over
+    :attr rng: type: Generator - picks the new pieces
+    :attr randomizers: type: list - one engine Randomizer per game picking
+                       its pieces instead of rng, or None
+    """
+
+    def __init__(self, n, width=10, height=20, seed=None, kicks=False, rng=None,
+                 randomizers=None):
+        self.n = n
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed) if rng is None else rng
+        if randomizers is not None and len(randomizers) != n:
+            raise ValueError("%d randomizers for %d games" % (len(randomizers), n))
+        self.randomizers = randomizers
+        self.kicks = kick_table(kicks)
+
+        self.boards = np.zeros((n, height, width), dtype=bool)
+        self.kind = np.zeros(n, dtype=np.int64)
+        self.rotation = np.zeros(n, dtype=np.int64)
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+        self.lines = np.zeros(n, dtype=np.int64)
+        self.pieces = np.zeros(n, dtype=np.int64)
+        self.over = np.zeros(n, dtype=bool)
+        self.reset()
+
+    def reset(self, games=None):
+        """
+        The reset function empties the boards of the given games and
+        spawns their first piece.
+
+        :param games: Indices or a bool mask of the games, all of them if None
+        :return: None
+        """
+        games = self._indices(games)
+        self.boards[games] = False
+        self.lines[games] = 0
+        self.pieces[games] = 0
+        self.over[games] = False
+        self._spawn(games)
+
+    def cells(self, games=None):
+        """
+        The cells function returns the squares covered by the current pieces.
+
+        :param games: Indices or a bool mask of the games, all of them if None
+        :return: An (M, 4, 2) array of (x, y)
+        """
+        games = self._indices(games)
+        return self._cells(games, self.kind[games], self.rotation[games],
+                           self.x[games], self.y[games])
+
+    def step(self, actions):
+        """
+        The step function applies one engine action to every game.
+        Games that are over ignore their action.
+
+        :param actions: An (N,) array of engine.ACTIONS
+        :return: (moved, cleared) - (N,) arrays telling whether each piece
+                 moved or rotated and how many rows each game cleared
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        live = ~self.over
+        moved = np.zeros(self.n, dtype=bool)
+        lock = np.zeros(self.n, dtype=bool)
+
+        # Left, right and down
+        dx = ACTION_DX[actions]
+        dy = ACTION_DY[actions]
+        games = np.flatnonzero(live & ((dx != 0) | (dy != 0)))
+        if games.size:
+            ok = self._fits(games, self.kind[games], self.rotation[games],
+                            self.x[games] + dx[games], self.y[games] + dy[games])
+            done = games[ok]
+            self.x[done] += dx[done]
+            self.y[done] += dy[done]
+            moved[done] = True
+            # a piece that cannot move down is locked
+            lock[games[~ok & (dy[games] == 1)]] = True
+
+        # Rotation, trying each kick in order
+        games = np.flatnonzero(live & (actions == engine.ROTATE) & (NUM_ROTATIONS[self.kind] > 1))
+        if games.size:
+            kind = self.kind[games]
+            rotation = self.rotation[games]
+            target = (rotation + 1) % NUM_ROTATIONS[kind]
+            pending = np.ones(games.size, dtype=bool)
+            for k in range(self.kicks.shape[2]):
+                kx = self.x[games] + self.kicks[kind, rotation, k, 0]
+                ky = self.y[games] + self.kicks[kind, rotation, k, 1]
+                ok = pending & self._fits(games, kind, target, kx, ky)
+                done = games[ok]
+                self.rotation[done] = target[ok]
+                self.x[done] = kx[ok]
+                self.y[done] = ky[ok]
+                moved[done] = True
+                pending &= ~ok
+
+        # Hard drop: fall the whole distance at once, then lock
+        games = np.flatnonzero(live & (actions == engine.DROP))
+        if games.size:
+            distance = self._drop_distance(games)
+            self.y[games] += distance
+            moved[games] = distance > 0
+            lock[games] = True
+
+        cleared = np.zeros(self.n, dtype=np.int64)
+        games = np.flatnonzero(lock)
+        if games.size:
+            cleared[games] = self._lock(games)
+        return moved, cleared
+
+    def _indices(self, games):
+        # Turns None, a bool mask or indices into an index array
+        if games is None:
+            return np.arange(self.n)
+        games = np.asarray(games)
+        if games.dtype == bool:
+            return np.flatnonzero(games)
+        return games
+
+    def _cells(self, games, kind, rotation, x, y):
+        # (M, 4, 2) squares of pieces with their pivot at x, y
+        cells = OFFSETS[kind, rotation].copy()
+        cells[..., 0] += x[:, None]
+        cells[..., 1] += y[:, None]
+        return cells
+
+    def _fits(self, games, kind, rotation, x, y):
+        # Whether each piece is inside its board and over free squares
+        cells = self._cells(games, kind, rotation, x, y)
+        cx = cells[..., 0]
+        cy = cells[..., 1]
+        inside = (cx >= 0) & (cx < self.width) & (cy >= 0) & (cy < self.height)
+        taken = self.boards[games[:, None],
+                            np.clip(cy, 0, self.height - 1),
+                            np.clip(cx, 0, self.width - 1)]
+        return (inside & ~taken).all(axis=1)
+
+    def _drop_distance(self, games):
+        # Rows each piece can fall: for every block, the distance to the
+        # first taken square below it in its column, then the smallest one
+        cells = self.cells(games)
+        cx = cells[..., 0]
+        cy = cells[..., 1]
+        rows = np.arange(self.height)
+        columns = self.boards[games[:, None, None], rows[None, None, :], cx[:, :, None]]
+        below = columns & (rows[None, None, :] > cy[:, :, None])
+        first = np.where(below.any(axis=2), below.argmax(axis=2), self.height)
+        return (first - cy - 1).min(axis=1)
+
+    def _lock(self, games):
+        # Adds the pieces to their boards, clears the full rows and
+        # spawns the next pieces. Returns the rows cleared by each game.
+        cells = self.cells(games)
+        self.boards[games[:, None], cells[..., 1], cells[..., 0]] = True
+
+        full = self.boards[games].all(axis=2)
+        count = full.sum(axis=1)
+        clearing = count > 0
+        if clearing.any():
+            target = games[clearing]
+            # a stable sort puts the full rows on top, keeping the order of
+            # the others, and those top rows are then emptied
+            order = np.argsort(~full[clearing], axis=1, kind='stable')
+            boards = np.take_along_axis(self.boards[target], order[:, :, None], axis=1)
+            boards[np.arange(self.height)[None, :] < count[clearing][:, None]] = False
+            self.boards[target] = boards
+
+        self.lines[games] += count
+        self._spawn(games)
+        return count
+
+    def _spawn(self, games):
+        # New random pieces centered at the top; a game is over when its
+        # piece overlaps the locked blocks
+        if not len(games):
+            return
+        if self.randomizers is None:
+            kind = self.rng.integers(0, len(engine.SHAPES), size=len(games))
+        else:
+            # the same pieces as a GameState with the same randomizer
+            randomizers = self.randomizers
+            kind = np.array([next(randomizers[game]) for game in games], dtype=np.int64)
+        self.kind[games] = kind
+        self.rotation[games] = 0
+        self.x[games] = self.width // 2 + PIVOTS[kind, 0]
+        self.y[games] = PIVOTS[kind, 1]
+        self.pieces[games] += 1
+        self.over[games] = ~self._fits(games, kind, self.rotation[games],
+                                       self.x[games], self.y[games])
@@ -0,0 +1,632 @@
+# Benchmarks of the hot paths of the game.
+#
+#     python bench.py                      run everything, print a table
+#     python bench.py -o results.json      also save the results
+#     python bench.py --compare old.json   show the speed change per case
+#     python bench.py -k drop --quick      only the cases named *drop*, fewer runs
+#
+# Every workload is built from a fixed seed, so two runs on two commits
+# time the same boards and the same moves. A case reports its speed in
+# ops/sec (best of several repeats) and, from one more run under
+# tracemalloc, the most memory a single op allocated at once and the
+# net number of memory blocks each op left allocated once garbage and
+# free lists are collected (negative when it frees more than it keeps,
+# e.g. when rows are cleared).
+#
+# The view cases (Shape, Board, Tetris) draw on the off-screen canvas of
+# graphics.OffscreenWindow, so they run without a display and time our
+# code rather than Tk's. The render cases drive the real Tetris class one
+# frame per op, so their ops/sec is the frame rate the game could reach,
+# and also report how many canvas calls a frame makes. With --tk the
+# view cases use a real, hidden window instead (and are skipped when
+# there is no display). The input cases poll a scripted
+# joydev.FakeJoystick the way the joystick thread does.
+
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import engine
+
+SEED = 20230705
+
+
+############################################################
+# HARNESS
+############################################################
+
+CASES = []
+
+
+def case(group, **params):
+    """
+    The case function registers a benchmark. The decorated function gets
+    a random.Random and the params and returns (op, setup) or (op, setup,
+    report): op is timed, setup, if not None, is called before every op,
+    untimed, and its result is passed to op. report is called after the
+    ops and returns a dictionary of more results.
+
+    :param group: Name of the group of the case
+    :param params: Parameters of the workload, also saved in the results
+    :return: The decorator
+    """
+    def register(build):
+        name = build.__name__
+        if params:
+            name += '[' + ','.join('%s=%s' % item for item in sorted(params.items())) + ']'
+        CASES.append((name, group, build, params))
+        return build
+    return register
+
+
+class Skip(Exception):
+    """Raised by a case that cannot run here, with the reason"""
+    pass
+
+
+def run_ops(op, setup, count):
+    # Runs count ops and returns the seconds spent in them
+    if setup is None:
+        start = time.perf_counter()
+        for _ in range(count):
+            op()
+        return time.perf_counter() - start
+    elapsed = 0.0
+    for _ in range(count):
+        arg = setup()
+        start = time.perf_counter()
+        op(arg)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def run_memory(op, setup, count):
+    # Runs count ops under tracemalloc and returns the peak bytes of the
+    # worst op and the blocks left allocated per op; setups are not counted
+    tracemalloc.start()
+    peak = 0
+    blocks = 0
+    for _ in range(count):
+        arg = setup() if setup is not None else None
+        # full collections also empty the free lists, whose blocks would
+        # otherwise count as kept, e.g. the tuples freed by a row clear
+        gc.collect()
+        before = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        size = tracemalloc.get_traced_memory()[0]
+        if setup is None:
+            op()
+        else:
+            op(arg)
+        traced = tracemalloc.get_traced_memory()
+        gc.collect()
+        blocks += sys.getallocatedblocks() - before
+        peak = max(peak, traced[1] - size)
+    tracemalloc.stop()
+    return peak, blocks / count
+
+
+def measure(build, params, number, repeat):
+    """
+    The measure function times one case.
+
+    :param build: The function registered with case
+    :param params: Its parameters
+    :param number: Ops per repeat
+    :param repeat: Number of repeats, the best one is kept
+    :return: A dictionary with the results
+    """
+    op, setup = build(random.Random(SEED), **params)[:2]
+    run_ops(op, setup, max(1, number // 10))    # warm up
+
+    best = min(run_ops(op, setup, number) for _ in range(repeat))
+
+    built = build(random.Random(SEED), **params)
+    op, setup = built[:2]
+    peak, blocks = run_memory(op, setup, number)
+
+    result = {'ops': number, 'seconds': best, 'ops_per_sec': number / best,
+              'peak_bytes': peak, 'blocks_per_op': blocks}
+    if len(built) > 2:
+        result.update(built[2]())
+    return result
+
+
+def git_commit():
+    # The commit benchmarked, None outside a git checkout
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(pattern=None, number=2000, repeat=5):
+    """
+    The run function runs the cases whose name contains pattern.
+
+    :param pattern: Substring of the names to run, all of them if None
+    :param number: Ops per repeat
+    :param repeat: Number of repeats
+    :return: A dictionary ready to be saved as JSON
+    """
+    results = []
+    for name, group, build, params in CASES:
+        if pattern and pattern not in name:
+            continue
+        result = {'name': name, 'group': group, 'params': params}
+        try:
+            result.update(measure(build, params, number, repeat))
+        except Skip as error:
+            result['skipped'] = str(error)
+        results.append(result)
+        print(format_result(result), flush=True)
+    return {'commit': git_commit(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'seed': SEED, 'time': time.time(),
+            'results': results}
+
+
+def format_result(result, base=None):
+    # One line of the table printed while running
+    if 'skipped' in result:
+        return '%-56s skipped: %s' % (result['name'], result['skipped'])
+    line = '%-56s %12.0f ops/s %8d B peak %7.2f blocks/op' % (
+        result['name'], result['ops_per_sec'], result['peak_bytes'],
+        result['blocks_per_op'])
+    if 'calls_per_frame' in result:
+        line += ' %7.1f calls/frame' % result['calls_per_frame']
+    if base is not None:
+        line += '   %+6.1f%%' % (100.0 * (result['ops_per_sec'] / base['ops_per_sec'] - 1))
+    return line
+
+
+def compare(results, path):
+    """
+    The compare function prints the speed of each case against a saved run.
+
+    :param results: The dictionary returned by run
+    :param path: JSON file of an earlier run
+    :return: None
+    """
+    with open(path) as stream:
+        old = json.load(stream)
+    base = {r['name']: r for r in old['results'] if 'skipped' not in r}
+    print('\ncompared with %s (commit %s)' % (path, old.get('commit')))
+    for result in results['results']:
+        if 'skipped' not in result and result['name'] in base:
+            print(format_result(result, base[result['name']]))
+
+
+############################################################
+# WORKLOADS
+############################################################
+
+def fill_stack(field, rows, rng, kind='I'):
+    """
+    The fill_stack function locks rows of rubble at the bottom of a
+    field, each with one hole so that none is cleared.
+
+    :param field: Playfield or BitPlayfield
+    :param rows: Number of rows
+    :param rng: random.Random
+    :param kind: Kind recorded for the blocks
+    :return: None
+    """
+    for y in range(field.height - rows, field.height):
+        hole = rng.randrange(field.width)
+        field.lock([(x, y) for x in range(field.width) if x != hole], kind)
+
+
+def open_rows(field, count, rng, stack=8):
+    """
+    The open_rows function locks rows of rubble at the bottom of an
+    empty field with column 0 left open. The lowest count rows are full
+    but for that column, so a vertical I dropped in it clears them.
+
+    :param field: Playfield or BitPlayfield
+    :param count: Number of rows to clear, 0 to 4
+    :param rng: random.Random
+    :param stack: Number of rows of rubble
+    :return: None
+    """
+    for y in range(field.height - stack, field.height):
+        full = y >= field.height - count
+        hole = rng.randrange(1, field.width)
+        field.lock([(x, y) for x in range(1, field.width) if full or x != hole], 'I')
+
+
+def vertical_i(column, bottom):
+    # A vertical I piece in column whose lowest block is on row bottom
+    piece = engine.Piece('I', column)
+    piece.rotation = 1
+    piece.x = column
+    piece.y = bottom - 1
+    return piece
+
+
+def random_pieces(rng, field, count):
+    # count pieces at random free positions of field
+    pieces = []
+    while len(pieces) < count:
+        kind = rng.choice(engine.SHAPES)
+        piece = engine.Piece(kind, rng.randrange(field.width))
+        piece.rotation = rng.randrange(len(engine.ROTATIONS[kind]))
+        piece.y = rng.randrange(field.height)
+        if field.fits_piece(kind, piece.rotation, piece.x, piece.y):
+            pieces.append(piece)
+    return pieces
+
+
+FIELDS = {'list': engine.Playfield, 'bits': engine.BitPlayfield}
+
+
+############################################################
+# ENGINE CASES
+############################################################
+
+for _field in FIELDS:
+    for _width, _height, _stack in ((10, 20, 10), (10, 200, 190), (40, 20, 10)):
+
+        @case('engine', field=_field, width=_width, height=_height, stack=_stack)
+        def fits_piece(rng, field, width, height, stack):
+            board = FIELDS[field](width, height)
+            fill_stack(board, stack, rng)
+            pieces = random_pieces(rng, board, 256)
+            moves = [(p.kind, p.rotation, p.x + dx, p.y + dy)
+                     for p in pieces for dx, dy in ((-1, 0), (1, 0), (0, 1))]
+            index = [0]
+
+            def op():
+                i = index[0] = (index[0] + 1) % len(moves)
+                board.fits_piece(*moves[i])
+            return op, None
+
+        @case('engine', field=_field, width=_width, height=_height, stack=_stack)
+        def find_rotation(rng, field, width, height, stack):
+            board = FIELDS[field](width, height)
+            fill_stack(board, stack, rng)
+            pieces = random_pieces(rng, board, 256)
+            index = [0]
+
+            def op():
+                i = index[0] = (index[0] + 1) % len(pieces)
+                engine.find_rotation(board, pieces[i], True)
+            return op, None
+
+    for _rows in range(5):
+
+        @case('engine', field=_field, rows=_rows)
+        def lock_and_clear(rng, field, rows):
+            piece = vertical_i(0, 19)
+
+            def setup():
+                board = FIELDS[field](10, 20)
+                open_rows(board, rows, random.Random(SEED))
+                return board
+
+            def op(board):
+                board.lock(piece.cells, 'I')
+            return op, setup
+
+    @case('engine', field=_field)
+    def game_step(rng, field):
+        actions = [rng.choice(engine.ACTIONS) for _ in range(4096)]
+        state = engine.GameState(randomizer=engine.BagRandomizer(SEED),
+                                 field_class=FIELDS[field], kicks=True)
+        index = [0, state]
+
+        def op():
+            i = index[0] = (index[0] + 1) % len(actions)
+            if index[1].over:
+                index[1] = engine.GameState(randomizer=engine.BagRandomizer(i),
+                                            field_class=FIELDS[field], kicks=True)
+            index[1].step(actions[i])
+        return op, None
+
+
+############################################################
+# VIEW CASES
+############################################################
+
+# Draw the view cases off-screen, False for a real Tk window (--tk)
+OFFSCREEN = True
+
+
+def view_game(**settings):
+    """
+    The view_game function starts a real Tetris game in a new window,
+    an off-screen one unless OFFSCREEN is False.
+    Raises Skip when there is no display or the view cannot be imported.
+
+    :param settings: Class attributes of Tetris to override
+    :return: The Tetris object
+    """
+    try:
+        import tetris
+        if OFFSCREEN:
+            win = tetris.OffscreenWindow("bench")
+        else:
+            win = tetris.Window("bench")
+    except Exception as error:
+        raise Skip("no Tetris view: %s" % error)
+    win.withdraw()
+    settings.setdefault('SEED', SEED)
+    game_class = type('BenchTetris', (tetris.Tetris,), settings)
+    return game_class(win)
+
+
+class Key():
+    """A key event for Tetris.key_pressed and key_released"""
+    def __init__(self, keysym):
+        self.keysym = keysym
+
+
+def close_game(game):
+    # Destroys the window of a game built by view_game
+    game.win.destroy()
+
+
+def clearing_game(rows, pooled):
+    # A game whose falling piece is a vertical I that clears rows when dropped
+    game = view_game(POOLED_RENDER=pooled, FIELD_CLASS=engine.Playfield)
+    state = game.state
+    open_rows(state.board, rows, random.Random(SEED))
+    state.piece = vertical_i(0, 3)
+    if pooled:
+        renderer = game.renderer
+        # keys of its own, as in a game: sharing the board's tuples made
+        # the first clear look like it kept a block per moved square
+        renderer.locked = {(x, y): game.SHAPES[engine.SHAPES.index(kind)].COLOR
+                           for (x, y), kind in state.board.grid.items()}
+        renderer.show_piece(state.piece, game.SHAPES[0].COLOR)
+    else:
+        import tetris
+        for (x, y), kind in state.board.grid.items():
+            block = tetris.Block(tetris.Point(x, y), 'gray')
+            block.draw(game.board.canvas)
+            game.board.grid[(x, y)] = block
+        for block in game.current_shape.blocks:
+            block.undraw()
+        game.current_shape = game.create_new_shape()
+        game.board.draw_shape(game.current_shape)
+    game.render()
+    return game
+
+
+for _width, _height, _stack in ((10, 20, 10), (20, 40, 30)):
+
+    @case('view', width=_width, height=_height, stack=_stack)
+    def shape_can_move(rng, width, height, stack):
+        game = view_game(BOARD_WIDTH=width, BOARD_HEIGHT=height)
+        fill_stack(game.state.board, stack, rng)
+        shape = game.current_shape or game.create_new_shape()
+        moves = ((-1, 0), (1, 0), (0, 1))
+        index = [0]
+
+        def op():
+            i = index[0] = (index[0] + 1) % 3
+            shape.can_move(game.board, *moves[i])
+        return op, None
+
+    @case('view', width=_width, height=_height, stack=_stack)
+    def shape_can_rotate(rng, width, height, stack):
+        game = view_game(BOARD_WIDTH=width, BOARD_HEIGHT=height)
+        fill_stack(game.state.board, stack, rng)
+        shapes = [game.SHAPES[engine.SHAPES.index(p.kind)](p)
+                  for p in random_pieces(rng, game.state.board, 64)]
+        index = [0]
+
+        def op():
+            i = index[0] = (index[0] + 1) % len(shapes)
+            shapes[i].can_rotate(game.board, True)
+        return op, None
+
+for _rows in range(5):
+
+    @case('view', rows=_rows)
+    def board_add_shape(rng, rows):
+        # Board.add_shape and the remove_complete_rows it calls
+        games = []
+
+        def setup():
+            if games:
+                close_game(games.pop())
+            game = clearing_game(rows, False)
+            games.append(game)
+            game.state.drop()
+            game.current_shape.sync()
+            return game
+
+        def op(game):
+            game.board.add_shape(game.current_shape, game.state.last_cleared)
+        return op, setup
+
+    @case('view', rows=_rows)
+    def board_remove_complete_rows(rng, rows):
+        games = []
+
+        def setup():
+            if games:
+                close_game(games.pop())
+            game = clearing_game(rows, False)
+            games.append(game)
+            game.state.drop()
+            game.current_shape.sync()
+            for block in game.current_shape.get_blocks():
+                game.board.grid[(block.x, block.y)] = block
+            return game
+
+        def op(game):
+            game.board.remove_complete_rows(game.state.last_cleared)
+        return op, setup
+
+for _pooled in (False, True):
+
+    @case('view', pooled=_pooled)
+    def tetris_do_move(rng, pooled):
+        game = view_game(POOLED_RENDER=pooled)
+        moves = [engine.MOVES[rng.choice((engine.LEFT, engine.RIGHT))] for _ in range(1024)]
+        index = [0]
+
+        def op():
+            i = index[0] = (index[0] + 1) % len(moves)
+            game.do_move(moves[i])
+        return op, None
+
+    for _rows in (0, 4):
+
+        @case('view', pooled=_pooled, rows=_rows)
+        def tetris_hard_drop(rng, pooled, rows):
+            # key_pressed('space') down to the flush of the frame
+            games = []
+            space = Key('space')
+
+            def setup():
+                if games:
+                    close_game(games.pop())
+                game = clearing_game(rows, pooled)
+                games.append(game)
+                return game
+
+            def op(game):
+                game.key_pressed(space)
+                game.render()
+            return op, setup
+
+
+############################################################
+# RENDER CASES
+############################################################
+
+def canvas_calls(game):
+    # Calls made so far to the canvas of a game, None on a Tk canvas
+    canvas = game.board.canvas.canvas
+    if hasattr(canvas, 'callCount'):
+        return canvas.callCount()
+    return None
+
+
+def frame_report(frames):
+    # The report of a render case: canvas calls per frame of the games
+    # in frames, a list of [game, calls at start, frames drawn]
+    calls = 0
+    count = 0
+    for game, start, drawn in frames:
+        end = canvas_calls(game)
+        if end is None:
+            return {}
+        calls += end - start
+        count += drawn
+    return {'calls_per_frame': calls / max(1, count)}
+
+
+for _pooled in (False, True):
+
+    @case('render', pooled=_pooled)
+    def frame_move(rng, pooled):
+        # One frame: a key tapped, the piece moves sideways and is drawn
+        game = view_game(POOLED_RENDER=pooled)
+        keys = [Key(rng.choice(('Left', 'Right'))) for _ in range(1024)]
+        frames = [[game, canvas_calls(game), 0]]
+        index = [0]
+
+        def op():
+            i = index[0] = (index[0] + 1) % len(keys)
+            game.key_pressed(keys[i])
+            game.render()
+            game.key_released(keys[i])
+            frames[0][2] += 1
+        return op, None, lambda: frame_report(frames)
+
+    @case('render', pooled=_pooled)
+    def frame_play(rng, pooled):
+        # One frame of play: a random key, a hard drop one time in six,
+        # and the frame drawn; a new game starts, untimed, when one is over
+        keys = [Key(rng.choice(('Left', 'Right', 'Up', 'Down', 'Left', 'space')))
+                for _ in range(4096)]
+        frames = []
+        index = [0]
+
+        def setup():
+            if not frames or frames[-1][0].state.over:
+                game = view_game(POOLED_RENDER=pooled)
+                frames.append([game, canvas_calls(game), 0])
+            return frames[-1]
+
+        def op(frame):
+            i = index[0] = (index[0] + 1) % len(keys)
+            game = frame[0]
+            game.key_pressed(keys[i])
+            game.render()
+            game.key_released(keys[i])
+            frame[2] += 1
+        return op, setup, lambda: frame_report(frames)
+
+
+############################################################
+# INPUT CASES
+############################################################
+
+for _busy in (False, True):
+
+    @case('input', busy=_busy)
+    def joystick_poll(rng, busy):
+        # One poll of the joystick thread: a joydev.FakeJoystick read into
+        # the queue of a JoystickPoller, which the game drains once every
+        # five polls (500 Hz polls, 100 Hz ticks). A busy pad changes at
+        # every poll, an idle one never does.
+        try:
+            import joydev
+            import joypoll
+        except ImportError as error:
+            raise Skip("no joystick backends: %s" % error)
+        pad = joydev.FakeJoystick()
+        poller = joypoll.JoystickPoller(pad)
+        script = []
+        for _ in range(1024):
+            if not busy:
+                script.append(())
+            elif rng.random() < 0.2:
+                script.append((('l_thumb_x', rng.randint(-32768, 32767)),))
+            else:
+                # the buttons of Tetris.JOY_ACTIONS
+                button = rng.choice((3, 4, 2, 15, 13))
+                script.append(((rng.choice(('press', 'release')), button),))
+        polls = [0]
+
+        def op():
+            if not pad.script:
+                pad.script.extend(script)
+            pad.dispatch_events()
+            polls[0] += 1
+            if polls[0] % 5 == 0:
+                poller.drain(lambda time, kind, code, value: None)
+        return op, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of the game.")
+    parser.add_argument('-o', '--output', help="save the results to this JSON file")
+    parser.add_argument('-k', '--pattern', help="only run the cases whose name contains this")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare with")
+    parser.add_argument('--quick', action='store_true', help="fewer ops and repeats")
+    parser.add_argument('--tk', action='store_true',
+                        help="draw the view cases in a real Tk window")
+    args = parser.parse_args()
+
+    OFFSCREEN = not args.tk
+
+    number, repeat = (200, 2) if args.quick else (2000, 5)
+    results = run(args.pattern, number, repeat)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=1)
+    if args.compare:
+        compare(results, args.compare)
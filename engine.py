@@ -0,0 +1,1089 @@
+# Tetris game rules without any graphics.
+#
+# The Tetris, Board and Shape classes in tetris.py draw what this module
+# decides. Nothing in here touches Tk or allocates graphics Points, so a
+# GameState can be stepped on a headless machine.
+
+import random
+from array import array
+
+############################################################
+# ACTIONS
+############################################################
+
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+DOWN = 3
+ROTATE = 4
+DROP = 5
+
+ACTIONS = (NOOP, LEFT, RIGHT, DOWN, ROTATE, DROP)
+
+# (dx, dy) for the actions that translate the current piece
+MOVES = {LEFT: (-1, 0), RIGHT: (1, 0), DOWN: (0, 1)}
+
+# The action of each (dx, dy) in MOVES
+MOVE_ACTIONS = {move: action for action, move in MOVES.items()}
+
+############################################################
+# SHAPES
+############################################################
+
+# Order matches Tetris.SHAPES so an index picks the same tetromino
+# in the engine and in the renderer.
+SHAPES = ('I', 'J', 'L', 'O', 'S', 'T', 'Z')
+
+# Block offsets from the spawn center. Block 1 is the rotation pivot.
+SHAPE_CELLS = {
+    'I': ((-2, 0), (-1, 0), (0, 0), (1, 0)),
+    'J': ((-1, 0), (0, 0), (1, 0), (1, 1)),
+    'L': ((-1, 0), (0, 0), (1, 0), (-1, 1)),
+    'O': ((0, 0), (-1, 0), (0, 1), (-1, 1)),
+    'S': ((0, 0), (0, 1), (1, 0), (-1, 1)),
+    'T': ((-1, 0), (0, 0), (1, 0), (0, 1)),
+    'Z': ((-1, 0), (0, 0), (0, 1), (1, 1)),
+}
+
+# Initial rotation direction; pieces not listed start at 1
+ROTATION_DIR = {'S': -1, 'Z': -1}
+
+# Pieces that flip their rotation direction after each rotation,
+# so they toggle between two orientations only
+SHIFT_ROTATION_DIR = frozenset(('I', 'S', 'Z'))
+
+# Pieces that never rotate
+NO_ROTATION = frozenset(('O',))
+
+# Offsets tried, in order, when a rotation does not fit where it is.
+# The first one that fits wins.
+NO_KICKS = ((0, 0),)
+
+
+def rotation_states(kind):
+    """
+    The rotation_states function computes every orientation a shape goes
+    through when rotated around its pivot block, starting at the spawn one.
+    Offsets are relative to the pivot and keep the block order.
+
+    :param kind: One of SHAPES
+    :return: A tuple with the block offsets of each orientation
+    """
+    px, py = SHAPE_CELLS[kind][1]
+    state = tuple((x - px, y - py) for x, y in SHAPE_CELLS[kind])
+    states = [state]
+    if kind in NO_ROTATION:
+        return tuple(states)
+
+    dir = ROTATION_DIR.get(kind, 1)
+    while True:
+        state = tuple((dir*y, -dir*x) for x, y in state)
+        if kind in SHIFT_ROTATION_DIR:
+            dir *= -1
+        if state == states[0]:
+            return tuple(states)
+        states.append(state)
+
+
+def row_masks(offsets):
+    """
+    The row_masks function packs the blocks of an orientation into one
+    bitmask per row, to test it against a BitPlayfield with a few ANDs.
+
+    :param offsets: The block offsets of an orientation
+    :return: (min_x, max_x, min_y, max_y, ((dy, mask), ...)) where bit 0
+             of each mask is column min_x
+    """
+    xs = [x for x, y in offsets]
+    ys = [y for x, y in offsets]
+    masks = {}
+    for x, y in offsets:
+        masks[y] = masks.get(y, 0) | 1 << (x - min(xs))
+    return min(xs), max(xs), min(ys), max(ys), tuple(sorted(masks.items()))
+
+
+# ROTATIONS[kind][rotation] - block offsets from the pivot
+ROTATIONS = {kind: rotation_states(kind) for kind in SHAPES}
+
+# PIECE_MASKS[kind][rotation] - row_masks of that orientation
+PIECE_MASKS = {kind: tuple(map(row_masks, ROTATIONS[kind])) for kind in SHAPES}
+
+def wall_kicks(states, rotation):
+    """
+    The wall_kicks function lists the sideways offsets worth trying when
+    rotating out of an orientation: the rotated piece is pushed back by
+    as many columns as it sticks out of the columns it had, on either
+    side, the nearest first and to the left before the right.
+
+    :param states: The orientations of a shape, see rotation_states
+    :param rotation: The orientation rotated out of
+    :return: A tuple of (dx, dy), (0, 0) first
+    """
+    old = [x for x, y in states[rotation]]
+    new = [x for x, y in states[(rotation + 1) % len(states)]]
+    left = max(0, min(old) - min(new))
+    right = max(0, max(new) - max(old))
+    kicks = [(0, 0)]
+    for dx in range(1, max(left, right) + 1):
+        if dx <= right:
+            kicks.append((-dx, 0))
+        if dx <= left:
+            kicks.append((dx, 0))
+    return tuple(kicks)
+
+
+# KICKS[kind][rotation] - offsets tried when rotating out of that orientation
+KICKS = {kind: tuple(wall_kicks(ROTATIONS[kind], r) for r in range(len(ROTATIONS[kind])))
+         for kind in SHAPES}
+
+
+############################################################
+# PIECE CLASS
+############################################################
+
+class Piece():
+    """
+    Piece class:
+    The falling tetromino: its orientation and where its pivot is
+
+    :attr kind: type: str - one of SHAPES
+    :attr rotation: type: int - index of the orientation in ROTATIONS[kind]
+    :attr x: type: int - column of the pivot block
+    :attr y: type: int - row of the pivot block
+    """
+
+    def __init__(self, kind, x, y=0):
+        px, py = SHAPE_CELLS[kind][1]
+        self.kind = kind
+        self.rotation = 0
+        self.x = x + px
+        self.y = y + py
+
+    @property
+    def cells(self):
+        """
+        The (x, y) square of each block
+
+        :return: A list of (x, y) tuples
+        """
+        x = self.x
+        y = self.y
+        return [(x + dx, y + dy) for dx, dy in ROTATIONS[self.kind][self.rotation]]
+
+
+def find_rotation(board, piece, kicks=True):
+    """
+    The find_rotation function looks up the next orientation of the piece
+    and the first kick offset where it fits on the board.
+
+    :param board: Playfield or BitPlayfield object
+    :param piece: Piece object
+    :param kicks: Whether to try the KICKS table or only rotate in place
+    :return: (rotation, x, y) for the rotated piece, or None if it cannot rotate
+    """
+    states = ROTATIONS[piece.kind]
+    if len(states) == 1:
+        return None
+    rotation = (piece.rotation + 1) % len(states)
+    candidates = KICKS[piece.kind][piece.rotation] if kicks else NO_KICKS
+    for dx, dy in candidates:
+        x = piece.x + dx
+        y = piece.y + dy
+        if board.fits_piece(piece.kind, rotation, x, y):
+            return rotation, x, y
+    return None
+
+
+############################################################
+# ZOBRIST HASHING
+############################################################
+
+# Every square (x, y) of a board has its own random 64-bit key, at index
+# y * width + x of the key list, and a board hashes to the XOR of the keys
+# of its blocks. The row key of a row is the XOR of the keys of its blocks
+# alone, so a cleared row leaves the hash with one XOR; a row that moves
+# down is rehashed from its blocks at the row it lands on. The keys are
+# drawn from a fixed seed, so hashes match between runs and processes,
+# and the list grows as taller boards need more of them.
+ZOBRIST_SEED = 20230705
+
+_zobrist_random = random.Random(ZOBRIST_SEED)
+_zobrist_keys = []
+
+
+def zobrist_keys(width, height):
+    """
+    The zobrist_keys function returns the 64-bit key of each square of a
+    board, square (x, y) at index y * width + x. The list is shared by
+    every board and only grows, so the first keys never change.
+
+    :param width: Width of the board
+    :param height: Height of the board
+    :return: A list of ints
+    """
+    missing = width * height - len(_zobrist_keys)
+    if missing > 0:
+        _zobrist_keys.extend(_zobrist_random.getrandbits(64) for _ in range(missing))
+    return _zobrist_keys
+
+
+def row_key(keys, mask, y, width):
+    """
+    The row_key function hashes the blocks of one row.
+
+    :param keys: The zobrist_keys of the board
+    :param mask: The occupied columns of the row, bit x for column x
+    :param y: The row the blocks are on
+    :param width: Width of the board
+    :return: A 64-bit int
+    """
+    value = 0
+    base = y * width
+    while mask:
+        low = mask & -mask
+        value ^= keys[base + low.bit_length() - 1]
+        mask ^= low
+    return value
+
+
+def zobrist_hash(cells, width, height):
+    """
+    The zobrist_hash function hashes a set of squares from scratch; the
+    playfields keep the same value up to date as blocks come and go.
+
+    :param cells: An iterable of occupied (x, y) squares
+    :param width: Width of the board
+    :param height: Height of the board
+    :return: A 64-bit int
+    """
+    keys = zobrist_keys(width, height)
+    value = 0
+    for x, y in cells:
+        value ^= keys[y * width + x]
+    return value
+
+
+def shift_row_keys(row_keys, masks, drops, cleared, keys, width):
+    """
+    The shift_row_keys function moves the row keys of a board down the
+    way drop_distances moves its rows. Only the cleared rows and the rows
+    above the lowest of them are visited, the others keep their place.
+
+    :param row_keys: The row key of each row, top to bottom
+    :param masks: The occupied columns of each row before the clear
+    :param drops: The drop_distances of the clear
+    :param cleared: The cleared rows, top to bottom
+    :param keys: The zobrist_keys of the board
+    :param width: Width of the board
+    :return: (change of the hash, new row keys)
+    """
+    change = 0
+    row_keys = list(row_keys)
+    # from the bottom up, so a row lands where the rows below already left
+    for y in range(cleared[-1], -1, -1):
+        key = row_keys[y]
+        row_keys[y] = 0
+        if not key:
+            continue
+        change ^= key
+        if drops[y] is not None:
+            key = row_key(keys, masks[y], y + drops[y], width)
+            row_keys[y + drops[y]] = key
+            change ^= key
+    return change, row_keys
+
+
+############################################################
+# PLAYFIELD CLASS
+############################################################
+
+def drop_distances(cleared, height):
+    """
+    The drop_distances function computes how many squares each row falls
+    once the cleared rows are removed, i.e. the number of cleared rows
+    below it. Cleared rows map to None.
+
+    :param cleared: The cleared rows
+    :param height: The height of the board
+    :return: A list with the drop of each row, top to bottom
+    """
+    drops = [0] * height
+    below = 0
+    cleared = set(cleared)
+    for y in range(height - 1, -1, -1):
+        if y in cleared:
+            drops[y] = None
+            below += 1
+        else:
+            drops[y] = below
+    return drops
+
+
+class Playfield():
+    """
+    Playfield class:
+    The locked blocks of the board
+
+    :attr width: type: int - width of the board in squares
+    :attr height: type: int - height of the board in squares
+    :attr grid: type: Dictionary - maps each occupied (x, y) to the kind
+                of the piece it came from
+    :attr row_keys: type: list - the Zobrist row key of each row
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.grid = {}
+        self.keys = zobrist_keys(width, height)
+        self.row_keys = [0] * height
+        self._zobrist = 0
+
+    @property
+    def zobrist(self):
+        """
+        The 64-bit Zobrist hash of the locked blocks, kept up to date by
+        lock and remove_complete_rows
+
+        :return: A 64-bit int
+        """
+        return self._zobrist
+
+    def is_free(self, x, y):
+        """
+        The is_free function checks that square x,y is inside the board
+        and not occupied.
+
+        :param x: x position
+        :param y: y position
+        :return: Bool
+        """
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return False
+        return (x, y) not in self.grid
+
+    def fits(self, cells):
+        """
+        The fits function checks that every square in cells is free.
+
+        :param cells: An iterable of (x, y) tuples
+        :return: Bool
+        """
+        for x, y in cells:
+            if not self.is_free(x, y):
+                return False
+        return True
+
+    def fits_piece(self, kind, rotation, x, y):
+        """
+        The fits_piece function checks that a piece of the given kind and
+        orientation fits with its pivot at square x,y.
+
+        :param kind: One of SHAPES
+        :param rotation: The orientation of the piece
+        :param x: x position of the pivot
+        :param y: y position of the pivot
+        :return: Bool
+        """
+        return self.fits([(x + dx, y + dy) for dx, dy in ROTATIONS[kind][rotation]])
+
+    def is_row_complete(self, y):
+        """
+        The is_row_complete function checks that every square of row y is occupied.
+
+        :param y: The number of the row to be checked
+        :return: Bool
+        """
+        for x in range(self.width):
+            if (x, y) not in self.grid:
+                return False
+        return True
+
+    def lock(self, cells, kind):
+        """
+        The lock function adds the cells of a piece to the board and
+        removes every row it completes.
+
+        :param cells: The (x, y) squares of the piece
+        :param kind: The kind of the piece
+        :return: The list of cleared rows, top to bottom
+        """
+        keys = self.keys
+        width = self.width
+        for x, y in cells:
+            self.grid[(x, y)] = kind
+            key = keys[y * width + x]
+            self.row_keys[y] ^= key
+            self._zobrist ^= key
+        # only the rows the piece touched can have been completed
+        return self.remove_complete_rows(sorted({y for x, y in cells}))
+
+    def remove_complete_rows(self, rows=None):
+        """
+        The remove_complete_rows function removes all the complete rows
+        in one pass: it finds every full row first and then moves each
+        remaining block straight to its final square.
+
+        :param rows: The rows to check, all of them if None
+        :return: The list of cleared rows, top to bottom
+        """
+        if rows is None:
+            rows = range(self.height)
+        cleared = [y for y in rows if self.is_row_complete(y)]
+        if cleared:
+            drops = drop_distances(cleared, self.height)
+            grid = {}
+            masks = [0] * self.height
+            for (x, y), kind in self.grid.items():
+                if drops[y] is not None:
+                    grid[(x, y + drops[y])] = kind
+                    masks[y] |= 1 << x
+            self.grid = grid
+            change, self.row_keys = shift_row_keys(self.row_keys, masks, drops, cleared,
+                                                   self.keys, self.width)
+            self._zobrist ^= change
+        return cleared
+
+
+############################################################
+# BITPLAYFIELD CLASS
+############################################################
+
+class BitPlayfield():
+    """
+    BitPlayfield class:
+    The locked blocks of the board, one integer bitmask per row.
+    Bit x of rows[y] is set when square (x, y) is occupied. It has the
+    same methods as Playfield, but a full row is a single compare.
+
+    :attr width: type: int - width of the board in squares
+    :attr height: type: int - height of the board in squares
+    :attr rows: type: list - the bitmask of each row, top to bottom
+    :attr full: type: int - the bitmask of a complete row
+    :attr row_keys: type: list - the Zobrist row key of each row
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rows = [0] * height
+        self.full = (1 << width) - 1
+        self.keys = zobrist_keys(width, height)
+        self.row_keys = [0] * height
+        self._zobrist = 0
+
+    @property
+    def zobrist(self):
+        """
+        The 64-bit Zobrist hash of the locked blocks, kept up to date by
+        lock and remove_complete_rows
+
+        :return: A 64-bit int
+        """
+        return self._zobrist
+
+    def is_free(self, x, y):
+        """
+        The is_free function checks that square x,y is inside the board
+        and not occupied.
+
+        :param x: x position
+        :param y: y position
+        :return: Bool
+        """
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return False
+        return not self.rows[y] & (1 << x)
+
+    def fits(self, cells):
+        """
+        The fits function checks that every square in cells is free.
+
+        :param cells: An iterable of (x, y) tuples
+        :return: Bool
+        """
+        rows = self.rows
+        width = self.width
+        height = self.height
+        for x, y in cells:
+            if x < 0 or y < 0 or x >= width or y >= height or rows[y] & (1 << x):
+                return False
+        return True
+
+    def fits_piece(self, kind, rotation, x, y):
+        """
+        The fits_piece function checks that a piece of the given kind and
+        orientation fits with its pivot at square x,y, with one mask AND
+        per row of the piece.
+
+        :param kind: One of SHAPES
+        :param rotation: The orientation of the piece
+        :param x: x position of the pivot
+        :param y: y position of the pivot
+        :return: Bool
+        """
+        min_x, max_x, min_y, max_y, masks = PIECE_MASKS[kind][rotation]
+        left = x + min_x
+        if left < 0 or y + min_y < 0 or x + max_x >= self.width or y + max_y >= self.height:
+            return False
+        rows = self.rows
+        for dy, mask in masks:
+            if rows[y + dy] & (mask << left):
+                return False
+        return True
+
+    def is_row_complete(self, y):
+        """
+        The is_row_complete function checks that every square of row y is occupied.
+
+        :param y: The number of the row to be checked
+        :return: Bool
+        """
+        return self.rows[y] == self.full
+
+    def lock(self, cells, kind=None):
+        """
+        The lock function adds the cells of a piece to the board and
+        removes every row it completes.
+
+        :param cells: The (x, y) squares of the piece
+        :param kind: Unused, rows only remember which squares are taken
+        :return: The list of cleared rows, top to bottom
+        """
+        rows = self.rows
+        keys = self.keys
+        width = self.width
+        for x, y in cells:
+            rows[y] |= 1 << x
+            key = keys[y * width + x]
+            self.row_keys[y] ^= key
+            self._zobrist ^= key
+        return self.remove_complete_rows()
+
+    def remove_complete_rows(self, rows=None):
+        """
+        The remove_complete_rows function removes all the complete rows
+        in one pass, keeping the other rows in order.
+
+        :param rows: Unused, checking every row is a compare each
+        :return: The list of cleared rows, top to bottom
+        """
+        full = self.full
+        cleared = [y for y, row in enumerate(self.rows) if row == full]
+        if cleared:
+            drops = drop_distances(cleared, self.height)
+            change, self.row_keys = shift_row_keys(self.row_keys, self.rows, drops, cleared,
+                                                   self.keys, self.width)
+            self._zobrist ^= change
+            kept = [row for row in self.rows if row != full]
+            self.rows = [0] * len(cleared) + kept
+        return cleared
+
+
+############################################################
+# LEVELS
+############################################################
+
+# Gravity is counted in 1/SUBCELLS of a square per frame of 1/FRAME_RATE
+# seconds, so slow levels fall exactly and fast ones move several squares
+# in one frame. MAX_GRAVITY is 20G: the piece reaches the floor at once,
+# on the first gravity step however short it is, see apply_gravity.
+FRAME_RATE = 60
+SUBCELLS = 65536
+MAX_GRAVITY = 20 * SUBCELLS
+LINES_PER_LEVEL = 10
+
+
+def gravity_curve(levels=20):
+    """
+    The gravity_curve function builds the gravity of each level from the
+    usual curve of (0.8 - (level - 1) * 0.007) ** (level - 1) seconds per
+    row: a second at level 1, 0.79 at level 2, 20G from level 19.
+
+    :param levels: Number of levels in the table
+    :return: A tuple with the gravity of levels 1 .. levels in SUBCELLS per frame
+    """
+    table = []
+    for level in range(1, levels + 1):
+        seconds = (0.8 - (level - 1) * 0.007) ** (level - 1)
+        gravity = round(SUBCELLS / (seconds * FRAME_RATE))
+        table.append(min(MAX_GRAVITY, max(1, gravity)))
+    return tuple(table)
+
+
+# GRAVITY[level - 1] - SUBCELLS fallen per frame; higher levels use the last
+GRAVITY = gravity_curve()
+
+
+def level_for_lines(lines, start=1):
+    """
+    The level_for_lines function gives the level reached after clearing
+    some rows: one level up every LINES_PER_LEVEL rows, counted from the
+    level the game started at.
+
+    :param lines: Total number of rows cleared
+    :param start: Level the game started at
+    :return: The level
+    """
+    return start + lines // LINES_PER_LEVEL
+
+
+def gravity_for_level(level):
+    """
+    The gravity_for_level function looks a level up in GRAVITY.
+
+    :param level: A level, 1 or more
+    :return: SUBCELLS fallen per frame
+    """
+    return GRAVITY[min(level, len(GRAVITY)) - 1]
+
+
+############################################################
+# RANDOMIZERS
+############################################################
+
+class Randomizer():
+    """
+    Randomizer class:
+    Picks the pieces of one game. It owns its random generator, so games
+    with the same seed get the same pieces whatever else is running.
+    Iterating it gives indices in SHAPES; subclasses define __next__.
+
+    :attr seed: type: int - the seed of rng, None for a random one
+    :attr rng: type: Random - the generator of this game
+    """
+
+    def __init__(self, seed=None, rng=None):
+        self.seed = seed
+        self.rng = random.Random(seed) if rng is None else rng
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Returns the index in SHAPES of the next piece"""
+        pass # must override in subclass
+
+    def getstate(self):
+        """
+        The getstate function captures where the randomizer is, so that
+        setstate can bring it back without drawing the pieces again.
+
+        :return: (state of rng, tuple of ints the subclass keeps)
+        """
+        return self.rng.getstate(), ()
+
+    def setstate(self, state):
+        """
+        The setstate function restores a state given by getstate.
+
+        :param state: (state of rng, tuple of ints the subclass keeps)
+        :return: None
+        """
+        self.rng.setstate(state[0])
+
+    def fill(self, count):
+        """
+        The fill function generates the next pieces in bulk, the same
+        ones that many calls to next() would give.
+
+        :param count: Number of pieces
+        :return: An array('B') of indices in SHAPES
+        """
+        pick = self.__next__
+        return array('B', [pick() for _ in range(count)])
+
+
+class UniformRandomizer(Randomizer):
+    """
+    UniformRandomizer class:
+    Every piece is any of the 7 shapes with the same chance
+    """
+
+    def __next__(self):
+        return self.rng.randint(0, 6)
+
+    def fill(self, count):
+        randint = self.rng.randint
+        return array('B', [randint(0, 6) for _ in range(count)])
+
+
+class BagRandomizer(Randomizer):
+    """
+    BagRandomizer class:
+    Deals the 7 shapes in a shuffled bag, then the next bag, so a shape
+    never waits more than 12 pieces
+
+    :attr bag: type: list - the pieces left in the current bag, last one first out
+    """
+
+    def __init__(self, seed=None, rng=None):
+        Randomizer.__init__(self, seed, rng)
+        self.bag = []
+
+    def __next__(self):
+        if not self.bag:
+            self.bag = list(range(len(SHAPES)))
+            self.rng.shuffle(self.bag)
+        return self.bag.pop()
+
+    def getstate(self):
+        return self.rng.getstate(), tuple(self.bag)
+
+    def setstate(self, state):
+        self.rng.setstate(state[0])
+        self.bag = list(state[1])
+
+    def fill(self, count):
+        if count <= 0:
+            return array('B')
+        pieces = array('B', reversed(self.bag[-count:]))
+        del self.bag[-count:]
+        shuffle = self.rng.shuffle
+        while len(pieces) < count:
+            bag = list(range(len(SHAPES)))
+            shuffle(bag)
+            needed = count - len(pieces)
+            pieces.extend(reversed(bag[-needed:]))
+            self.bag = bag[:-needed]
+        return pieces
+
+
+class HistoryRandomizer(Randomizer):
+    """
+    HistoryRandomizer class:
+    The TGM randomizer: a shape found in the last few pieces is drawn
+    again, up to some tries, so repeats are rare but still possible.
+    The first piece is never S, Z or O.
+
+    :attr tries: type: int - draws made before keeping a repeated shape
+    :attr history: type: list - indices of the most recent pieces, oldest first
+    """
+
+    FIRST = tuple(SHAPES.index(kind) for kind in 'IJLT')
+
+    def __init__(self, seed=None, rng=None, tries=6, history='ZSSZ'):
+        Randomizer.__init__(self, seed, rng)
+        self.tries = tries
+        self.history = [SHAPES.index(kind) for kind in history]
+        self.first = True
+
+    def __next__(self):
+        rng = self.rng
+        if self.first:
+            self.first = False
+            piece = rng.choice(self.FIRST)
+        else:
+            history = self.history
+            for _ in range(self.tries):
+                piece = rng.randint(0, 6)
+                if piece not in history:
+                    break
+        self.history.pop(0)
+        self.history.append(piece)
+        return piece
+
+    def getstate(self):
+        # the history, then whether the first piece is still to come
+        return self.rng.getstate(), tuple(self.history) + (int(self.first),)
+
+    def setstate(self, state):
+        self.rng.setstate(state[0])
+        self.history = list(state[1][:-1])
+        self.first = bool(state[1][-1])
+
+
+# Randomizers by name, for command lines and configuration
+RANDOMIZERS = {'uniform': UniformRandomizer, 'bag': BagRandomizer,
+               'history': HistoryRandomizer}
+
+
+############################################################
+# AUTO REPEAT
+############################################################
+
+# A held direction moves once when pressed, again after DAS frames (the
+# delayed auto shift) and then every ARR frames (the auto repeat rate);
+# a held DOWN, the soft drop, moves every SOFT_DROP frames from the start.
+# Time is counted in SUBCELLS of a frame like gravity, so a fixed tick
+# adds the same whole step every time and the repeats land on the same
+# ticks whatever the loop, the device or the OS key repeat do.
+DAS = 10        # frames, 167 ms
+ARR = 2         # frames, 33 ms: 30 moves a second
+SOFT_DROP = 2   # frames
+
+# Actions that repeat while held, the others act once per press
+REPEATED = (LEFT, RIGHT, DOWN)
+
+
+class AutoRepeat():
+    """
+    AutoRepeat class:
+    Turns the press and release state of the inputs into actions. Every
+    action acts once when pressed; held, LEFT, RIGHT and DOWN repeat.
+    Of LEFT and RIGHT only the last one pressed repeats, the other one
+    waits until it is released, then starts over with the delay.
+
+    :attr das: type: int - frames before a held direction repeats
+    :attr arr: type: int - frames between repeats, 0 to move as far as
+               possible every tick
+    :attr soft_drop: type: int - frames between the moves of a held DOWN
+    :attr held: type: dict - action: [time held, time of the next repeat]
+                in SUBCELLS, of every action held; None for the actions
+                that do not repeat
+    :attr shift: type: int - LEFT or RIGHT, the direction that repeats,
+                 None if neither is held
+    """
+
+    def __init__(self, das=DAS, arr=ARR, soft_drop=SOFT_DROP):
+        self.das = das
+        self.arr = arr
+        self.soft_drop = soft_drop
+        self.held = {}
+        self.shift = None
+
+    def press(self, action):
+        """
+        The press function marks an action as held.
+
+        :param action: One of ACTIONS
+        :return: True if the action is to be applied now, False if it was
+                 already held (a repeat sent by the OS or the device)
+        """
+        if action in self.held:
+            return False
+        if action == DOWN:
+            self.held[action] = [0, self.soft_drop * SUBCELLS]
+        elif action in REPEATED:
+            self.held[action] = [0, self.das * SUBCELLS]
+            self.shift = action
+        else:
+            self.held[action] = None
+        return True
+
+    def release(self, action):
+        """
+        The release function marks an action as no longer held.
+
+        :param action: One of ACTIONS
+        :return: None
+        """
+        if self.held.pop(action, False) is False:
+            return
+        if action == self.shift:
+            other = RIGHT if action == LEFT else LEFT
+            self.shift = None
+            if other in self.held:
+                # the other direction takes over, after the delay again
+                self.held[other] = [0, self.das * SUBCELLS]
+                self.shift = other
+
+    def release_all(self):
+        """
+        The release_all function forgets every held action, e.g. when the
+        window loses the focus and the releases would not be seen.
+
+        :return: None
+        """
+        self.held.clear()
+        self.shift = None
+
+    def update(self, frames, apply):
+        """
+        The update function lets the held actions repeat for some frames.
+
+        :param frames: Number of frames elapsed, may be fractional
+        :param apply: Function called with each action due; returns
+                      whether the action did something
+        :return: The number of repeats applied
+        """
+        if not self.held:
+            return 0
+        step = int(round(frames * SUBCELLS))
+        count = 0
+        for action in REPEATED:
+            timer = self.held.get(action)
+            if timer is None or action == (RIGHT if self.shift == LEFT else LEFT):
+                continue
+            timer[0] += step
+            period = (self.soft_drop if action == DOWN else self.arr) * SUBCELLS
+            while timer[0] >= timer[1]:
+                if not period:
+                    # ARR 0: as far as it goes, and again next tick
+                    while apply(action):
+                        count += 1
+                    timer[1] = timer[0] + 1
+                    break
+                apply(action)
+                count += 1
+                timer[1] += period
+        return count
+
+
+############################################################
+# GAMESTATE CLASS
+############################################################
+
+class GameState():
+    """
+    GameState class:
+    A whole game: the playfield, the falling piece and the score
+
+    :attr board: type: Playfield or BitPlayfield - the locked blocks
+    :attr randomizer: type: Randomizer - picks the pieces of this game
+    :attr piece: type: Piece - the current falling piece
+    :attr lines: type: int - total number of rows cleared
+    :attr pieces: type: int - number of pieces spawned
+    :attr last_cleared: type: list - rows cleared by the most recent lock
+    :attr over: type: Boolean - whether a new piece could not be placed
+    :attr kicks: type: Boolean - whether rotations try the KICKS offsets
+    :attr start_level: type: int - level the game started at
+    :attr level: type: int - current level, raised by the rows cleared
+    :attr fall: type: float - SUBCELLS fallen by the piece since its last row
+    """
+
+    def __init__(self, width=10, height=20, rng=None, field_class=Playfield, kicks=False,
+                 level=1, randomizer=None):
+        self.board = field_class(width, height)
+        if randomizer is None:
+            # uniform pieces from rng, the module random by default
+            randomizer = UniformRandomizer(rng=random if rng is None else rng)
+        self.randomizer = randomizer
+        self.rng = randomizer.rng
+        self.kicks = kicks
+        self.start_level = level
+        self.level = level
+        self.fall = 0
+        self.lines = 0
+        self.pieces = 0
+        self.last_cleared = []
+        self.over = False
+        self.piece = None
+        self.spawn()
+
+    def spawn(self):
+        """
+        The spawn function places the next piece of the randomizer centered
+        at the top of the board. The game is over if it overlaps the locked
+        blocks.
+
+        :return: None
+        """
+        kind = SHAPES[next(self.randomizer)]
+        self.piece = Piece(kind, self.board.width // 2)
+        self.pieces += 1
+        self.fall = 0
+        if not self.board.fits_piece(kind, 0, self.piece.x, self.piece.y):
+            self.over = True
+
+    def move(self, dx, dy):
+        """
+        The move function moves the current piece if it can. If the piece
+        cannot move down it is locked into the board and a new piece spawns.
+
+        :param dx: Move the piece dx squares in the x direction
+        :param dy: Move the piece dy squares in the y direction
+        :return: True if the piece moved, False otherwise
+        """
+        if self.over:
+            return False
+        piece = self.piece
+        if self.board.fits_piece(piece.kind, piece.rotation, piece.x + dx, piece.y + dy):
+            piece.x += dx
+            piece.y += dy
+            if dy:
+                # a row moved by hand restarts the gravity count
+                self.fall = 0
+            return True
+        if dy == 1:
+            self.lock()
+        return False
+
+    def rotate(self):
+        """
+        The rotate function rotates the current piece if it can,
+        kicking it sideways when kicks are enabled.
+
+        :return: True if the piece rotated, False otherwise
+        """
+        if self.over:
+            return False
+        target = find_rotation(self.board, self.piece, self.kicks)
+        if target is None:
+            return False
+        self.piece.rotation, self.piece.x, self.piece.y = target
+        return True
+
+    def apply_gravity(self, frames=1):
+        """
+        The apply_gravity function lets the current piece fall for some
+        frames at the gravity of the level. Fractions of a row add up over
+        the calls and all the rows due fall in one go, however many they
+        are. At MAX_GRAVITY the piece falls to the floor at once. A piece
+        that is due to fall but rests on something is locked.
+
+        :param frames: Number of frames elapsed, may be fractional
+        :return: The number of rows the piece fell
+        """
+        if self.over:
+            return 0
+        gravity = gravity_for_level(self.level)
+        if gravity >= MAX_GRAVITY:
+            # 20G: as far as it goes, even when a step is less than a frame
+            rows = self.board.height
+        else:
+            self.fall += gravity * frames
+            rows = int(self.fall // SUBCELLS)
+            if not rows:
+                return 0
+            self.fall -= rows * SUBCELLS
+
+        piece = self.piece
+        fits_piece = self.board.fits_piece
+        fallen = 0
+        while fallen < rows and fits_piece(piece.kind, piece.rotation,
+                                           piece.x, piece.y + fallen + 1):
+            fallen += 1
+        if not fallen:
+            self.lock()
+            return 0
+        piece.y += fallen
+        return fallen
+
+    def drop(self):
+        """
+        The drop function moves the current piece down until it locks.
+
+        :return: The number of rows the piece fell
+        """
+        rows = 0
+        while self.move(0, 1):
+            rows += 1
+        return rows
+
+    def lock(self):
+        """
+        The lock function adds the current piece to the board, clears the
+        completed rows and spawns the next piece.
+
+        :return: None
+        """
+        self.last_cleared = self.board.lock(self.piece.cells, self.piece.kind)
+        self.lines += len(self.last_cleared)
+        self.level = level_for_lines(self.lines, self.start_level)
+        self.spawn()
+
+    def step(self, action):
+        """
+        The step function applies one action to the game.
+
+        :param action: One of ACTIONS
+        :return: True if the piece moved or rotated, False otherwise
+        """
+        if action in MOVES:
+            return self.move(*MOVES[action])
+        elif action == ROTATE:
+            return self.rotate()
+        elif action == DROP:
+            return self.drop() > 0
+        return False
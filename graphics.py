@@ -156,12 +156,22 @@ class CanvasFrame(tk.Frame):
 
     """A CanvasFrame is a frame for displaying graphics."""
 
+    def __new__(cls, *args, **kw):
+        # A CanvasFrame in an OffscreenWindow draws off-screen
+        if args and isinstance(args[0], OffscreenWindow):
+            cls = OffscreenCanvasFrame
+        return tk.Frame.__new__(cls)
+
     def __init__(self, parent, width=200, height=200):
         
         tk.Frame.__init__(self, parent)
+        self._setup(parent, tk.Canvas(parent, width = width, height = height),
+                    width, height)
 
+    def _setup(self, parent, canvas, width, height):
+        # Internal method setting up the frame around its canvas
         self.parent = parent
-        self.canvas = tk.Canvas(parent, width = width, height = height)
+        self.canvas = canvas
         self.canvas.pack()
         parent.resizable(0,0)
         self.foreground = "black"
@@ -175,6 +185,13 @@ class CanvasFrame(tk.Frame):
         self._keyboardCallback = None
         self.trans = None
         self.closed = False
+        self.pool = None
+        self.deferred = False
+        self.pendingConfig = {}
+        self.pendingMoves = {}
+        self.pendingCoords = {}
+        self.pendingRaises = {}
+        self.pendingDeletes = []
         parent.lift()
 
     def __checkOpen(self):
@@ -202,7 +219,131 @@ class CanvasFrame(tk.Frame):
 
     def isClosed(self):
         return self.closed    
+
+    def setPooling(self, on=True):
+        """Recycle the canvas items of undrawn objects that support it
+        (see ItemPool) instead of deleting and creating them again"""
+        self.__checkOpen()
+        if on and self.pool is None:
+            self.pool = ItemPool(self)
+        elif not on:
+            self.pool = None
     
+    def setDeferred(self, on=True):
+        """In deferred mode every change Tk would paint is queued and sent
+        to Tk together by commit: option changes, moves, new items (made
+        hidden and shown on commit), recycled items and deleted ones, so
+        the window never shows half a frame. Turning it off commits what
+        is still queued."""
+        self.__checkOpen()
+        if not on:
+            self.commit()
+        self.deferred = on
+
+    def commit(self):
+        """Apply the changes queued in deferred mode, one itemconfig and
+        one move per item however many times it changed since the last
+        commit. Returns the number of Tk calls made."""
+        if self.closed:
+            self._clearPending()
+            return 0
+        canvas = self.canvas
+        calls = 0
+        for id in self.pendingDeletes:
+            canvas.delete(id)
+            calls = calls + 1
+        for id, coords in self.pendingCoords.items():
+            canvas.coords(id, *coords)
+            calls = calls + 1
+        for id, options in self.pendingConfig.items():
+            canvas.itemconfig(id, options)
+            calls = calls + 1
+        for id, (x, y) in self.pendingMoves.items():
+            if x or y:
+                canvas.move(id, x, y)
+                calls = calls + 1
+        for id in self.pendingRaises:
+            canvas.tag_raise(id)
+            calls = calls + 1
+        self._clearPending()
+        return calls
+
+    def _clearPending(self):
+        # Internal method emptying the queues of deferred mode
+        self.pendingConfig = {}
+        self.pendingMoves = {}
+        self.pendingCoords = {}
+        self.pendingRaises = {}
+        self.pendingDeletes = []
+
+    def _itemconfig(self, id, options):
+        # Internal method for itemconfig, queued in deferred mode
+        if self.deferred:
+            pending = self.pendingConfig.get(id)
+            if pending is None:
+                self.pendingConfig[id] = dict(options)
+            else:
+                pending.update(options)
+        else:
+            self.canvas.itemconfig(id, options)
+
+    def _itemmove(self, id, x, y):
+        # Internal method for move, queued in deferred mode
+        if self.deferred:
+            dx, dy = self.pendingMoves.get(id, (0, 0))
+            self.pendingMoves[id] = (dx + x, dy + y)
+        else:
+            self.canvas.move(id, x, y)
+
+    def _itemcoords(self, id, coords):
+        # Internal method for coords, queued in deferred mode; the moves
+        #    queued before are replaced by the new coordinates
+        if self.deferred:
+            self.pendingMoves.pop(id, None)
+            self.pendingCoords[id] = coords
+        else:
+            self.canvas.coords(id, *coords)
+
+    def _itemraise(self, id):
+        # Internal method for tag_raise, queued in deferred mode
+        if self.deferred:
+            # the last raise decides the stacking order
+            self.pendingRaises.pop(id, None)
+            self.pendingRaises[id] = True
+        else:
+            self.canvas.tag_raise(id)
+
+    def _itemdelete(self, id):
+        # Internal method for delete, queued in deferred mode
+        if self.deferred:
+            self.pendingDeletes.append(id)
+        else:
+            self.canvas.delete(id)
+
+    def _itemcreate(self, kind, coords, options):
+        # Internal method for the create_ methods of the canvas; in
+        #    deferred mode the item is made hidden and shown by commit
+        create = getattr(self.canvas, "create_" + kind)
+        if not self.deferred:
+            return create(*coords, options)
+        id = create(*coords, dict(options, state="hidden"))
+        self.pendingConfig[id] = {"state": "normal"}
+        return id
+
+    def _itemhide(self, id):
+        # Internal method hiding an item made by a _draw method until
+        #    the next commit, when it is made in deferred mode
+        if self.deferred:
+            self.canvas.itemconfig(id, state="hidden")
+            self._itemconfig(id, {"state": "normal"})
+
+    def _discard(self, id):
+        # Internal method dropping the queued changes of an undrawn item
+        self.pendingConfig.pop(id, None)
+        self.pendingMoves.pop(id, None)
+        self.pendingCoords.pop(id, None)
+        self.pendingRaises.pop(id, None)
+
     def plot(self, x, y, color="black"):
         """Set pixel (x,y) to the given color"""
         self.__checkOpen()
@@ -280,6 +421,261 @@ class CanvasFrame(tk.Frame):
             self._mouseCallback(Point(e.x, e.y))
 
 
+class ItemPool:
+
+    """An ItemPool keeps the canvas items of undrawn objects hidden so
+    the next object of the same type reuses one of them, moved and
+    reconfigured, instead of creating a new item. The canvas then stops
+    growing over a long session and item ids stay bounded. Its changes
+    go through the CanvasFrame, so deferred mode queues them too."""
+
+    def __init__(self, canvas_frame):
+        self.canvas_frame = canvas_frame
+        self.free = {}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, kind, coords, options):
+        """Return the id of a visible item of the given kind (e.g.
+        "rectangle") at coords with options, recycled when possible"""
+        free = self.free.get(kind)
+        if free:
+            id = free.pop()
+            self.reused = self.reused + 1
+            canvas_frame = self.canvas_frame
+            canvas_frame._itemcoords(id, coords)
+            canvas_frame._itemconfig(id, dict(options, state="normal"))
+            # a new item would be on top of the others
+            canvas_frame._itemraise(id)
+            return id
+        self.created = self.created + 1
+        return self.canvas_frame._itemcreate(kind, coords, options)
+
+    def release(self, kind, id):
+        """Hide the item so acquire can hand it out again"""
+        self.canvas_frame._itemconfig(id, {"state": "hidden"})
+        self.free.setdefault(kind, []).append(id)
+
+    def __len__(self):
+        return sum(len(free) for free in self.free.values())
+
+
+class OffscreenCanvas:
+
+    """An OffscreenCanvas stands in for a tk.Canvas without a display.
+    It keeps the items with their coordinates and options, counts the
+    calls made to it, and can rasterize the rectangles into colors."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.options = {"bg": "white"}
+        self.items = {}
+        self.nextId = 1
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def callCount(self):
+        """Return the number of canvas calls made so far"""
+        return sum(self.calls.values())
+
+    def _create(self, kind, args, kw):
+        # Internal method for the create_ methods: numbers are the
+        #    coordinates, a trailing dictionary holds options
+        self._count("create_" + kind)
+        args = list(args)
+        options = dict(args.pop()) if args and isinstance(args[-1], dict) else {}
+        options.update(kw)
+        id = self.nextId
+        self.nextId = id + 1
+        self.items[id] = [kind, [float(c) for c in args], options]
+        return id
+
+    def create_rectangle(self, *args, **kw):
+        return self._create("rectangle", args, kw)
+
+    def create_oval(self, *args, **kw):
+        return self._create("oval", args, kw)
+
+    def create_line(self, *args, **kw):
+        return self._create("line", args, kw)
+
+    def create_polygon(self, *args, **kw):
+        return self._create("polygon", args, kw)
+
+    def create_text(self, *args, **kw):
+        return self._create("text", args, kw)
+
+    def create_image(self, *args, **kw):
+        return self._create("image", args, kw)
+
+    def create_window(self, *args, **kw):
+        return self._create("window", args, kw)
+
+    def coords(self, id, *coords):
+        self._count("coords")
+        if coords:
+            self.items[id][1] = [float(c) for c in coords]
+        return list(self.items[id][1])
+
+    def move(self, id, dx, dy):
+        self._count("move")
+        coords = self.items[id][1]
+        for i in range(0, len(coords) - 1, 2):
+            coords[i] = coords[i] + dx
+            coords[i+1] = coords[i+1] + dy
+
+    def itemconfig(self, id, cnf=None, **kw):
+        self._count("itemconfig")
+        options = self.items[id][2]
+        if cnf:
+            options.update(cnf)
+        options.update(kw)
+
+    itemconfigure = itemconfig
+
+    def itemcget(self, id, option):
+        return self.items[id][2].get(option)
+
+    def delete(self, id):
+        self._count("delete")
+        self.items.pop(id, None)
+
+    def tag_raise(self, id):
+        self._count("tag_raise")
+        # items are drawn in the order of the dictionary
+        self.items[id] = self.items.pop(id)
+
+    def find_all(self):
+        return list(self.items)
+
+    def config(self, cnf=None, **kw):
+        if cnf:
+            self.options.update(cnf)
+        self.options.update(kw)
+
+    configure = config
+
+    def pack(self, *args, **kw):
+        pass
+
+    def bind(self, *args, **kw):
+        pass
+
+    def raster(self, step=1):
+        """Return the canvas as rows of fill colors, one every step
+        pixels, painting the visible rectangles in stacking order"""
+        rows = [[self.options["bg"]] * (self.width // step)
+                for _ in range(self.height // step)]
+        for kind, coords, options in self.items.values():
+            if kind != "rectangle" or options.get("state") == "hidden":
+                continue
+            fill = options.get("fill")
+            if not fill:
+                continue
+            x1, y1, x2, y2 = coords
+            for y in range(max(0, int(y1)) // step, min(len(rows), int(y2) // step)):
+                row = rows[y]
+                for x in range(max(0, int(x1)) // step, min(len(row), int(x2) // step)):
+                    row[x] = fill
+        return rows
+
+
+class OffscreenCanvasFrame(CanvasFrame):
+
+    """A CanvasFrame drawing into an OffscreenCanvas, made by CanvasFrame
+    itself when its parent is an OffscreenWindow"""
+
+    def __init__(self, parent, width=200, height=200):
+        self._setup(parent, OffscreenCanvas(width, height), width, height)
+
+    def update(self):
+        pass
+
+    def update_idletasks(self):
+        pass
+
+
+class OffscreenWindow:
+
+    """An OffscreenWindow stands in for Window on a machine without a
+    display. Callbacks given to after are kept and run by runPending,
+    key handlers given to bind_all are called by press and release, and
+    the handlers given to protocol are kept in protocols."""
+
+    def __init__(self, title=""):
+        self.name = title
+        self.bindings = {}
+        self.protocols = {}
+        self.pending = []
+        self.closed = False
+
+    def title(self, title=None):
+        if title is not None:
+            self.name = title
+        return self.name
+
+    def config(self, cnf=None, **kw):
+        pass
+
+    configure = config
+
+    def protocol(self, name, func):
+        self.protocols[name] = func
+
+    def resizable(self, *args):
+        pass
+
+    def lift(self):
+        pass
+
+    def withdraw(self):
+        pass
+
+    def bind_all(self, sequence, func):
+        self.bindings[sequence] = func
+
+    def after(self, ms, func, *args):
+        self.pending.append((func, args))
+        return len(self.pending)
+
+    def runPending(self):
+        """Run the callbacks scheduled so far, not the ones they schedule"""
+        pending = self.pending
+        self.pending = []
+        for func, args in pending:
+            func(*args)
+        return len(pending)
+
+    def press(self, keysym):
+        """Send a key press to the handler bound to <Key>"""
+        event = tk.Event()
+        event.keysym = keysym
+        self.bindings["<Key>"](event)
+
+    def release(self, keysym):
+        """Send a key release to the handler bound to <KeyRelease>"""
+        event = tk.Event()
+        event.keysym = keysym
+        self.bindings["<KeyRelease>"](event)
+
+    def update(self):
+        pass
+
+    def update_idletasks(self):
+        pass
+
+    def mainloop(self):
+        # there are no events to wait for, the caller drives runPending
+        pass
+
+    def destroy(self):
+        self.closed = True
+        self.pending = []
+
+
 class Transform:
 
     """Internal class for 2-D coordinate transformations"""
@@ -323,6 +719,10 @@ class GraphicsObject:
     """Generic base class for all of the drawable objects"""
     # A subclass of GraphicsObject should override _draw and
     #   and _move methods.
+    # A subclass whose _draw gets its item from _create may set
+    #   _poolKind to the Tk item type to be recycled by an ItemPool.
+
+    _poolKind = None
     
     def __init__(self, options):
         # options is a list of strings indicating which options are
@@ -352,6 +752,16 @@ class GraphicsObject:
         """Set line weight to width"""
         self._reconfig("width", width)
 
+    def configure(self, **options):
+        """Set several options at once, e.g. configure(fill="red",
+        outline="black"), with a single update of the drawn item"""
+        for option in options:
+            if not option in self.config:
+                raise GraphicsError
+        self.config.update(options)
+        if self.canvas_frame and not self.canvas_frame.isClosed():
+            self.canvas_frame._itemconfig(self.id, self.config)
+
     def draw(self, canvas_frame):
 
         """Draw the object in CanvasFrame, which should be a CanvasFrame
@@ -363,6 +773,8 @@ class GraphicsObject:
         if canvas_frame.isClosed(): raise GraphicsError
         self.canvas_frame = canvas_frame
         self.id = self._draw(canvas_frame, self.config)
+        if self._poolKind is None:
+            canvas_frame._itemhide(self.id)
 
     def undraw(self):
 
@@ -371,7 +783,12 @@ class GraphicsObject:
         
         if not self.canvas_frame: return
         if not self.canvas_frame.isClosed():
-            self.canvas_frame.canvas.delete(self.id)
+            self.canvas_frame._discard(self.id)
+            pool = self.canvas_frame.pool
+            if pool is not None and self._poolKind:
+                pool.release(self._poolKind, self.id)
+            else:
+                self.canvas_frame._itemdelete(self.id)
         self.canvas_frame = None
         self.id = None
 
@@ -390,7 +807,7 @@ class GraphicsObject:
             else:
                 x = dx
                 y = dy
-            self.canvas_frame.canvas.move(self.id, x, y)
+            self.canvas_frame._itemmove(self.id, x, y)
            
     def _reconfig(self, option, setting):
         # Internal method for changing configuration of the object
@@ -401,13 +818,21 @@ class GraphicsObject:
         options = self.config
         options[option] = setting
         if self.canvas_frame and not self.canvas_frame.isClosed():
-            self.canvas_frame.canvas.itemconfig(self.id, options)
+            self.canvas_frame._itemconfig(self.id, options)
 
     def _draw(self, canvas_frame, options):
         """draws appropriate figure on canvas with options provided
         Returns Tk id of item drawn"""
         pass # must override in subclass
 
+    def _create(self, canvas_frame, coords, options):
+        # Internal method creating the item of type _poolKind, taken
+        #    from the pool of the CanvasFrame when it has one
+        pool = canvas_frame.pool
+        if pool is not None:
+            return pool.acquire(self._poolKind, coords, options)
+        return canvas_frame._itemcreate(self._poolKind, coords, options)
+
     def _move(self, dx, dy):
         """updates internal state of object to move it dx,dy units"""
         pass # must override in subclass
@@ -460,6 +885,8 @@ class _BBox(GraphicsObject):
         return Point((p1.x+p2.x)/2.0, (p1.y+p2.y)/2.0)
     
 class Rectangle(_BBox):
+
+    _poolKind = "rectangle"
     
     def __init__(self, p1, p2):
         _BBox.__init__(self, p1, p2)
@@ -469,7 +896,7 @@ class Rectangle(_BBox):
         p2 = self.p2
         x1,y1 = canvas_frame.toScreen(p1.x,p1.y)
         x2,y2 = canvas_frame.toScreen(p2.x,p2.y)
-        return canvas_frame.canvas.create_rectangle(x1,y1,x2,y2,options)
+        return self._create(canvas_frame, (x1,y1,x2,y2), options)
         
     def clone(self):
         other = Rectangle(self.p1, self.p2)
@@ -0,0 +1,258 @@
+# Joystick input backends.
+#
+# Every backend is an xbox_joystick.Gamepad: it produces XINPUT_STATE
+# structures and the Gamepad compares them to dispatch on_button and
+# on_axis events, so the game sees the same button numbers, axis names and
+# values whatever the device is read with:
+#
+#     XInputJoystick  Windows, the XInput DLL (xbox_joystick)
+#     LinuxJoystick   Linux, the joystick API of /dev/input/js*, read with
+#                     non-blocking reads after select; no evdev or SDL
+#     FakeJoystick    a scripted device for tests and benchmarks
+#
+# enumerate_devices() returns the connected devices of the platform.
+
+import errno
+import glob
+import os
+import select
+import struct
+import sys
+from collections import deque
+
+from xbox_joystick import Gamepad, XInputJoystick, XINPUT_STATE
+
+
+# XInput button bits, button n of the events is bit n - 1
+DPAD_UP = 0x0001
+DPAD_DOWN = 0x0002
+DPAD_LEFT = 0x0004
+DPAD_RIGHT = 0x0008
+START = 0x0010
+BACK = 0x0020
+LEFT_THUMB = 0x0040
+RIGHT_THUMB = 0x0080
+LEFT_SHOULDER = 0x0100
+RIGHT_SHOULDER = 0x0200
+GUIDE = 0x0400
+A = 0x1000
+B = 0x2000
+X = 0x4000
+Y = 0x8000
+
+
+def enumerate_devices():
+    """
+    The enumerate_devices function returns the joysticks connected, read
+    with the backend of the platform.
+
+    :return: List of Gamepad objects, empty if there is none
+    """
+    if sys.platform == 'win32':
+        return XInputJoystick.enumerate_devices()
+    if sys.platform.startswith('linux'):
+        return LinuxJoystick.enumerate_devices()
+    return []
+
+
+############################################################
+# LINUX JOYSTICK
+############################################################
+
+# struct js_event of linux/joystick.h: time in ms, value, type, number
+JS_EVENT = struct.Struct('IhBB')
+JS_EVENT_BUTTON = 0x01
+JS_EVENT_AXIS = 0x02
+JS_EVENT_INIT = 0x80        # the state of the device when it was opened
+
+# The numbering of the xpad driver for XBox 360 controllers
+XPAD_BUTTONS = {0: A, 1: B, 2: X, 3: Y, 4: LEFT_SHOULDER, 5: RIGHT_SHOULDER,
+                6: BACK, 7: START, 8: GUIDE, 9: LEFT_THUMB, 10: RIGHT_THUMB,
+                # when the driver reports the pad as buttons (dpad_to_buttons)
+                11: DPAD_LEFT, 12: DPAD_RIGHT, 13: DPAD_UP, 14: DPAD_DOWN}
+# axis: (field, sign); the Linux y axes point down, XInput ones up
+XPAD_STICKS = {0: ('l_thumb_x', 1), 1: ('l_thumb_y', -1),
+               3: ('r_thumb_x', 1), 4: ('r_thumb_y', -1)}
+XPAD_TRIGGERS = {2: 'left_trigger', 5: 'right_trigger'}
+# axis: (button when negative, button when positive), the pad as a hat
+XPAD_HATS = {6: (DPAD_LEFT, DPAD_RIGHT), 7: (DPAD_UP, DPAD_DOWN)}
+
+
+class LinuxJoystick(Gamepad):
+    """
+    LinuxJoystick class:
+    A joystick read through the Linux joystick API. The kernel queues an
+    event for every change, so each one is dispatched on its own and no
+    press is lost between two polls, however short.
+
+    :attr path: type: str - the device file
+    :attr fd: type: int - the open device, None if it is not connected
+    """
+
+    max_devices = 16
+
+    def __init__(self, device_number, normalize_axes=True, path=None):
+        self.path = path or '/dev/input/js%d' % device_number
+        try:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            self.fd = None
+        super(LinuxJoystick, self).__init__(device_number, normalize_axes)
+        if self.fd is not None:
+            # read the state the driver reports on opening
+            self.dispatch_events()
+
+    @staticmethod
+    def enumerate_devices():
+        "Returns the devices that are connected"
+        numbers = sorted(int(path[len('/dev/input/js'):])
+                         for path in glob.glob('/dev/input/js[0-9]*'))
+        devices = [LinuxJoystick(n) for n in numbers[:LinuxJoystick.max_devices]]
+        return [d for d in devices if d.is_connected()]
+
+    def get_state(self):
+        "The state of the controller so far, None if it is not connected"
+        if self.fd is None:
+            return None
+        return getattr(self, '_last_state', None) or XINPUT_STATE()
+
+    def is_connected(self):
+        return self.fd is not None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def dispatch_events(self):
+        "Read and dispatch the events queued by the kernel, without waiting"
+        if self.fd is None:
+            raise RuntimeError(
+                "Joystick %d is not connected" % self.device_number)
+        size = JS_EVENT.size
+        while select.select([self.fd], [], [], 0)[0]:
+            try:
+                data = os.read(self.fd, size * 64)
+            except BlockingIOError:
+                break
+            except OSError as error:
+                # ENODEV: unplugged
+                self.close()
+                raise RuntimeError("Joystick %d is not connected (%s)" % (
+                    self.device_number, errno.errorcode.get(error.errno, error)))
+            if not data:
+                break
+            for offset in range(0, len(data) - size + 1, size):
+                self.handle_js_event(*JS_EVENT.unpack_from(data, offset))
+
+    def handle_js_event(self, time, value, type, number):
+        """
+        The handle_js_event function applies one event of the kernel to a
+        copy of the last state and dispatches what changed.
+
+        :param time: Time of the event in ms
+        :param value: Button state 0/1, or axis value in -32767..32767
+        :param type: JS_EVENT_BUTTON or JS_EVENT_AXIS, with JS_EVENT_INIT
+        :param number: Number of the button or axis
+        :return: None
+        """
+        state = XINPUT_STATE.from_buffer_copy(self._last_state)
+        gamepad = state.gamepad
+        kind = type & ~JS_EVENT_INIT
+        if kind == JS_EVENT_BUTTON:
+            bit = XPAD_BUTTONS.get(number)
+            if bit is None:
+                return
+            if value:
+                gamepad.buttons |= bit
+            else:
+                gamepad.buttons &= ~bit
+        elif kind == JS_EVENT_AXIS:
+            if number in XPAD_STICKS:
+                axis, sign = XPAD_STICKS[number]
+                setattr(gamepad, axis, max(-32768, min(32767, sign * value)))
+            elif number in XPAD_TRIGGERS:
+                # from -32767..32767 at rest..pressed to 0..255
+                setattr(gamepad, XPAD_TRIGGERS[number], (value + 32767) * 255 // 65534)
+            elif number in XPAD_HATS:
+                negative, positive = XPAD_HATS[number]
+                gamepad.buttons &= ~(negative | positive)
+                if value < 0:
+                    gamepad.buttons |= negative
+                elif value > 0:
+                    gamepad.buttons |= positive
+            else:
+                return
+        else:
+            return
+
+        state.packet_number = self._last_state.packet_number + 1
+        if not type & JS_EVENT_INIT:
+            self.received_packets += 1
+            self.handle_changed_state(state)
+        self._last_state = state
+
+
+############################################################
+# FAKE JOYSTICK
+############################################################
+
+class FakeJoystick(Gamepad):
+    """
+    FakeJoystick class:
+    A device playing a script, one step per call of dispatch_events, for
+    tests and benchmarks. A step is a list of changes made in one packet:
+    ('press', button), ('release', button) or (axis, raw value); an empty
+    step is a poll where nothing changed. Steps may be added while it is
+    being polled, from another thread.
+
+        pad = FakeJoystick()
+        pad.tap(13)                 # A down on the next poll, up on the one after
+        pad.move('l_thumb_x', -32768)
+
+    :attr script: type: deque - the steps not played yet
+    :attr state: type: XINPUT_STATE - the state after the last step
+    """
+
+    def __init__(self, script=(), device_number=0, normalize_axes=True):
+        self.script = deque()
+        self.state = XINPUT_STATE()
+        super(FakeJoystick, self).__init__(device_number, normalize_axes)
+        self.script.extend(script)
+
+    def get_state(self):
+        "Play the next step of the script and return the state"
+        if self.script:
+            step = self.script.popleft()
+            if step:
+                state = XINPUT_STATE.from_buffer_copy(self.state)
+                gamepad = state.gamepad
+                for name, value in step:
+                    if name == 'press':
+                        gamepad.buttons |= 1 << (value - 1)
+                    elif name == 'release':
+                        gamepad.buttons &= ~(1 << (value - 1))
+                    else:
+                        setattr(gamepad, name, value)
+                state.packet_number += 1
+                self.state = state
+        return self.state
+
+    def press(self, button):
+        self.script.append((('press', button),))
+
+    def release(self, button):
+        self.script.append((('release', button),))
+
+    def tap(self, button, polls=1):
+        "Press button and release it polls polls later"
+        self.press(button)
+        self.idle(polls - 1)
+        self.release(button)
+
+    def move(self, axis, value):
+        self.script.append(((axis, value),))
+
+    def idle(self, polls=1):
+        for _ in range(polls):
+            self.script.append(())
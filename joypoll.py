@@ -0,0 +1,169 @@
+# Background polling of a joystick.
+#
+# XInput only reports the current state of a controller: a press and
+# release that both happen between two polls are never seen, and the
+# packet numbers show how many states were missed. Polling once per game
+# tick (100 Hz) loses presses, so a thread polls the joystick at its own,
+# higher rate (200-2000 Hz is what determine_optimal_sample_rate in
+# xbox_joystick finds) and stamps every event with the time it was read.
+#
+# The thread only appends to a deque and the game loop only pops from it,
+# once per tick. deque.append and deque.popleft are atomic, so with one
+# producer and one consumer no lock is needed. The queue is bounded: when
+# the game stops draining it, new presses and axis events are counted as
+# dropped instead of growing it forever. Releases are never dropped, a
+# lost one would leave its button held, so they may take the queue past
+# its size by at most one per button; the release of a dropped press is
+# dropped with it.
+
+import threading
+import time
+from collections import deque
+
+
+BUTTON = 'button'
+AXIS = 'axis'
+
+
+############################################################
+# JOYSTICKPOLLER CLASS
+############################################################
+
+class JoystickPoller():
+    """
+    JoystickPoller class:
+    Polls a joystick from a background thread and queues its events
+
+    :attr joystick: type: XInputJoystick - the polled joystick, any pyglet
+                    EventDispatcher with dispatch_events() will do
+    :attr rate: type: float - polls per second
+    :attr clock: type: function - returns the time in seconds of an event;
+                 perf_counter, as monotonic ticks every 15 ms on Windows
+    :attr events: type: deque - (time, BUTTON, button, pressed) and
+                  (time, AXIS, axis, value) tuples, oldest first
+    :attr maxsize: type: int - most events kept in the queue
+    :attr dropped: type: int - events lost because the queue was full
+    :attr unseen: type: set - buttons whose press was dropped, their
+                  release is dropped too
+    :attr polls: type: int - number of polls made
+    :attr error: type: Exception - what stopped the thread (e.g. the
+                 joystick was disconnected), None while it runs
+    """
+
+    def __init__(self, joystick, rate=500, maxsize=256, clock=time.perf_counter):
+        self.joystick = joystick
+        self.rate = rate
+        self.clock = clock
+        self.events = deque()
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.unseen = set()
+        self.polls = 0
+        self.error = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        joystick.push_handlers(on_button=self.on_button, on_axis=self.on_axis)
+
+    def on_button(self, button, pressed):
+        # Runs in the polling thread
+        self.put((self.clock(), BUTTON, button, pressed))
+
+    def on_axis(self, axis, value):
+        # Runs in the polling thread
+        self.put((self.clock(), AXIS, axis, value))
+
+    def put(self, event):
+        """
+        The put function queues an event, or counts it as dropped when
+        the queue is full and it is not a release. Only the polling
+        thread calls it.
+
+        :param event: An event tuple
+        :return: None
+        """
+        when, kind, code, value = event
+        if kind == BUTTON and not value:
+            if code in self.unseen:
+                # the game never saw it pressed
+                self.unseen.discard(code)
+                self.dropped += 1
+            else:
+                self.events.append(event)
+            return
+        # only the consumer shortens the queue, so a full check that
+        # passes stays true until the append
+        if len(self.events) < self.maxsize:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+            if kind == BUTTON:
+                self.unseen.add(code)
+
+    def start(self):
+        """
+        The start function starts the polling thread.
+
+        :return: None
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='joystick-poller',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        The stop function stops the polling thread and waits for it.
+
+        :return: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        """
+        The run function is the body of the polling thread. Polls are
+        scheduled on a fixed grid, so a slow poll does not delay the
+        next ones; when it falls behind by more than a poll, it skips
+        ahead instead of polling in a burst.
+
+        :return: None
+        """
+        period = 1.0 / self.rate
+        deadline = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                self.joystick.dispatch_events()
+                self.polls += 1
+                deadline += period
+                wait = deadline - time.perf_counter()
+                if wait > 0:
+                    self._stop.wait(wait)
+                elif wait < -period:
+                    deadline = time.perf_counter()
+        except Exception as error:
+            self.error = error
+
+    def drain(self, handler):
+        """
+        The drain function hands every queued event to handler, oldest
+        first. The game loop calls it once per tick.
+
+        :param handler: Function called as handler(time, kind, code, value)
+                        where kind is BUTTON or AXIS
+        :return: The number of events handled
+        """
+        # only the events queued so far, so that a busy joystick cannot
+        # keep the game loop here
+        events = self.events
+        count = len(events)
+        for _ in range(count):
+            handler(*events.popleft())
+        return count
@@ -0,0 +1,166 @@
+# Input latency tracing.
+#
+# An input is stamped three times: when it arrives (the time of the Tk
+# <Key> event, or the time the joystick poller read it), when the game
+# applies it (do_move, do_rotate, do_drop) and when the frame showing it
+# is flushed to the canvas. The three latencies between them are kept
+# per input and reported as percentiles:
+#
+#     arrive-apply   waiting in the Tk event queue for a key, waiting for
+#                    the next tick of the loop for a joystick button
+#     apply-flush    waiting for the next frame
+#     arrive-flush   the whole lag added by the game before Tk paints
+#
+# Tk stamps its events in milliseconds of the X server clock, which
+# event_time converts to the clock of the tracer.
+#
+# Tetris only makes a LatencyTracer when LATENCY_TRACE is set, and each
+# hook is behind an "is not None" test, so tracing costs nothing when off.
+
+import time
+from array import array
+
+
+STAGES = ('arrive-apply', 'apply-flush', 'arrive-flush')
+
+# seconds behind the fastest Tk event past which its clock is taken to
+# have jumped rather than the event to have waited
+EVENT_CLOCK_JUMP = 60.0
+
+
+def percentile(ordered, fraction):
+    """
+    The percentile function returns the value below which the given
+    fraction of the samples fall (nearest rank).
+
+    :param ordered: Sorted sequence of samples
+    :param fraction: 0 to 1, e.g. 0.95
+    :return: The sample, None if there is none
+    """
+    if not ordered:
+        return None
+    rank = max(1, int(fraction * len(ordered) + 0.999999))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+############################################################
+# LATENCYTRACER CLASS
+############################################################
+
+class LatencyTracer():
+    """
+    LatencyTracer class:
+    Follows each input from its arrival to the frame that shows it
+
+    :attr clock: type: function - the time in seconds, the clock of the
+                 joystick poller so that their stamps compare
+    :attr arrival: type: float - arrival of the input not applied yet
+    :attr applied: type: list - (arrival, applied) of the inputs applied
+                   since the last flush
+    :attr samples: type: dict - stage name: array('d') of latencies in
+                   seconds
+    :attr ignored: type: int - inputs that arrived but did nothing
+    :attr event_offset: type: float - clock minus the time of the Tk event
+                        delivered the fastest, None before the first one
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.arrival = None
+        self.applied = []
+        self.samples = dict((stage, array('d')) for stage in STAGES)
+        self.ignored = 0
+        self.event_offset = None
+
+    def event_time(self, ms):
+        """
+        The event_time function converts the time of a Tk event to the
+        clock of the tracer. The two clocks are aligned on the event that
+        reached the game the fastest, so the other events arrive late by
+        the time they waited more than it in the Tk queue.
+
+        :param ms: The time attribute of the event, in ms
+        :return: The arrival in seconds of the clock
+        """
+        seconds = ms / 1000.0
+        offset = self.clock() - seconds
+        # realigned too when the ms wrap around, every 49.7 days
+        if (self.event_offset is None or offset < self.event_offset
+                or offset - self.event_offset > EVENT_CLOCK_JUMP):
+            self.event_offset = offset
+        return seconds + self.event_offset
+
+    def arrive(self, when=None):
+        """
+        The arrive function stamps an input as it arrives. An input that
+        arrived before it and was not applied is counted as ignored.
+
+        :param when: Time the input was read, now if None
+        :return: None
+        """
+        if self.arrival is not None:
+            self.ignored += 1
+        self.arrival = self.clock() if when is None else when
+
+    def apply(self):
+        """
+        The apply function stamps the input that arrived last as applied.
+        Actions without an arrival (gravity, the AI, held buttons) are
+        not traced.
+
+        :return: None
+        """
+        if self.arrival is not None:
+            self.applied.append((self.arrival, self.clock()))
+            self.arrival = None
+
+    def flush(self):
+        """
+        The flush function stamps the inputs applied since the last frame
+        as shown, right after the canvas was updated.
+
+        :return: None
+        """
+        if not self.applied:
+            return
+        now = self.clock()
+        arrive_apply, apply_flush, arrive_flush = (self.samples[stage] for stage in STAGES)
+        for arrival, applied in self.applied:
+            arrive_apply.append(applied - arrival)
+            apply_flush.append(now - applied)
+            arrive_flush.append(now - arrival)
+        self.applied = []
+
+    def report(self):
+        """
+        The report function sums up the latencies traced so far.
+
+        :return: A dictionary of stage name: dictionary with count and
+                 p50, p95, p99 and max in milliseconds
+        """
+        report = {}
+        for stage in STAGES:
+            ordered = sorted(self.samples[stage])
+            stats = {'count': len(ordered)}
+            for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)):
+                value = percentile(ordered, fraction)
+                stats[name] = None if value is None else value * 1000.0
+            report[stage] = stats
+        return report
+
+    def format_report(self):
+        """
+        The format_report function returns the report as a table.
+
+        :return: str
+        """
+        lines = ['%-14s %7s %8s %8s %8s %8s' % ('input latency', 'count', 'p50 ms',
+                                                'p95 ms', 'p99 ms', 'max ms')]
+        for stage, stats in self.report().items():
+            if not stats['count']:
+                lines.append('%-14s %7d' % (stage, 0))
+                continue
+            lines.append('%-14s %7d %8.2f %8.2f %8.2f %8.2f' % (
+                stage, stats['count'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+        lines.append('%d inputs did nothing' % self.ignored)
+        return '\n'.join(lines)
@@ -0,0 +1,121 @@
+# Fixed-timestep game loop driven by a monotonic clock.
+#
+# The game logic runs in logical ticks of a fixed length. Every call to
+# advance() measures the real time that passed, adds it to an accumulator
+# and runs as many whole ticks as fit in it, so timing does not depend on
+# how late Tk calls us back or how long the handlers took. Each task runs
+# every so many ticks (input polling every tick, gravity every N ticks)
+# and rendering has its own rate, at most once per advance().
+
+import time
+
+
+############################################################
+# FIXEDTIMESTEP CLASS
+############################################################
+
+class FixedTimestep():
+    """
+    FixedTimestep class:
+    Runs tasks at fixed logical tick rates and a render callback at its
+    own frame rate
+
+    :attr tick_rate: type: int - logical ticks per second
+    :attr dt: type: float - length of a tick in seconds
+    :attr tick: type: int - number of ticks run so far
+    :attr max_steps: type: int - most ticks run by one advance(); the
+                     time beyond it is dropped instead of caught up
+    :attr clock: type: function - returns the time in seconds, monotonic
+    :attr accumulator: type: float - real time not yet run as ticks
+    """
+
+    def __init__(self, tick_rate=100, frame_rate=60, max_steps=10,
+                 clock=time.monotonic):
+        self.tick_rate = tick_rate
+        self.dt = 1.0 / tick_rate
+        self.frame_time = 1.0 / frame_rate
+        self.max_steps = max_steps
+        self.clock = clock
+
+        self.tasks = []
+        self.render = None
+        self.tick = 0
+        self.accumulator = 0.0
+        self.last = None
+        self.last_render = None
+
+    def every(self, ticks, callback):
+        """
+        The every function runs callback once every given number of ticks.
+
+        :param ticks: Period of the task in ticks
+        :param callback: Function called without arguments
+        :return: The task, a list [ticks, callback] whose period may be changed
+        """
+        task = [max(1, int(ticks)), callback]
+        self.tasks.append(task)
+        return task
+
+    def ticks(self, seconds):
+        """
+        The ticks function converts a duration into whole ticks.
+
+        :param seconds: A duration in seconds
+        :return: The number of ticks, at least 1
+        """
+        return max(1, int(round(seconds * self.tick_rate)))
+
+    def on_render(self, callback):
+        """
+        The on_render function sets the function drawing a frame.
+
+        :param callback: Function called without arguments
+        :return: None
+        """
+        self.render = callback
+
+    def advance(self):
+        """
+        The advance function runs the ticks due since the last call, then
+        renders a frame if one is due.
+
+        :return: The number of ticks run
+        """
+        now = self.clock()
+        if self.last is None:
+            self.last = now
+            self.last_render = now - self.frame_time
+        self.accumulator += now - self.last
+        self.last = now
+
+        steps = int(self.accumulator / self.dt)
+        if steps > self.max_steps:
+            # too far behind: run what we may and forget the rest, rather
+            # than spending ever longer catching up
+            steps = self.max_steps
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= steps * self.dt
+
+        for _ in range(steps):
+            self.tick += 1
+            tick = self.tick
+            for period, callback in self.tasks:
+                if tick % period == 0:
+                    callback()
+
+        if self.render is not None and now - self.last_render >= self.frame_time:
+            self.last_render = now
+            self.render()
+        return steps
+
+    def delay(self):
+        """
+        The delay function tells how long to wait for the next tick.
+
+        :return: Milliseconds, at least 1
+        """
+        wait = self.dt - self.accumulator
+        if self.last is not None:
+            wait -= self.clock() - self.last
+        return max(1, int(wait * 1000))
@@ -0,0 +1,741 @@
+# Compact binary replays of engine games.
+#
+# Only what cannot be recomputed is stored: the settings and seed of the
+# game, then every action of the player with the gravity tick it was
+# applied on. Playing the same actions on the same ticks of a GameState
+# built from the same settings gives back the same game, so no board is
+# ever written. Recorder appends records as the game goes and Player
+# reads them back a chunk at a time, so neither holds a whole session.
+#
+# Layout, every number an unsigned LEB128 varint:
+#     MAGIC, VERSION
+#     seed, width, height, level, randomizer, kicks, tick_rate
+#     records, each one (ticks since the previous record) << ACTION_BITS | action
+# A record with the END action closes the replay. Most records take a
+# single byte.
+#
+# An archive packs many replays into one file read through mmap. After
+# each replay come keyframes, snapshots of the game every
+# keyframe_interval ticks, and at the end of the file an index of fixed
+# size entries, so any game and any tick is reached by decoding one
+# snapshot and at most keyframe_interval ticks of records:
+#     ARCHIVE_MAGIC, ARCHIVE_VERSION, keyframe_interval
+#     for each game: replay, snapshots, keyframe directory (GAME_OFFSET each)
+#     index (GAME_ENTRY each), footer (FOOTER)
+
+import mmap
+import struct
+
+import engine
+
+MAGIC = b'TTRP'
+VERSION = 1
+
+ACTION_BITS = 3
+ACTION_MASK = (1 << ACTION_BITS) - 1
+END = ACTION_MASK
+
+# Randomizers in the order of their number in the header
+RANDOMIZER_NAMES = ('uniform', 'bag', 'history')
+
+
+def write_varint(buffer, value):
+    """
+    The write_varint function appends an unsigned LEB128 varint: 7 bits
+    per byte, lowest first, the top bit set on every byte but the last.
+
+    :param buffer: A bytearray
+    :param value: An int, 0 or more
+    :return: None
+    """
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(buffer, pos):
+    """
+    The read_varint function decodes the varint at a position of a buffer.
+
+    :param buffer: bytes, bytearray or mmap
+    :param pos: Index of its first byte
+    :return: (value, index of the next byte)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def zigzag(value):
+    # Maps 0, -1, 1, -2 ... to 0, 1, 2, 3 ... for varints
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def read_varints(stream, chunk_size=65536):
+    """
+    The read_varints function decodes the varints of a binary stream,
+    reading it chunk_size bytes at a time.
+
+    :param stream: A binary file object
+    :param chunk_size: Bytes read at once
+    :return: A generator of ints
+    """
+    value = 0
+    shift = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        for byte in chunk:
+            if byte & 0x80:
+                value |= (byte & 0x7f) << shift
+                shift += 7
+            else:
+                yield value | (byte << shift)
+                value = 0
+                shift = 0
+    if shift:
+        raise ValueError("replay ends inside a number")
+
+
+############################################################
+# REPLAYHEADER CLASS
+############################################################
+
+class ReplayHeader():
+    """
+    ReplayHeader class:
+    The settings needed to start the recorded game again
+
+    :attr seed: type: int - seed of the randomizer
+    :attr width: type: int - width of the board
+    :attr height: type: int - height of the board
+    :attr level: type: int - start level
+    :attr randomizer: type: str - name of the randomizer in engine.RANDOMIZERS
+    :attr kicks: type: Boolean - whether rotations kick
+    :attr tick_rate: type: int - gravity ticks per second
+    """
+
+    FIELDS = ('seed', 'width', 'height', 'level', 'randomizer', 'kicks', 'tick_rate')
+
+    def __init__(self, seed, width=10, height=20, level=1, randomizer='uniform',
+                 kicks=False, tick_rate=100):
+        if randomizer not in RANDOMIZER_NAMES:
+            raise ValueError("randomizer %r cannot be recorded" % (randomizer,))
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.level = level
+        self.randomizer = randomizer
+        self.kicks = kicks
+        self.tick_rate = tick_rate
+
+    def encode(self):
+        """
+        The encode function packs the header.
+
+        :return: bytes starting with MAGIC
+        """
+        buffer = bytearray(MAGIC)
+        write_varint(buffer, VERSION)
+        for value in (self.seed, self.width, self.height, self.level,
+                      RANDOMIZER_NAMES.index(self.randomizer), int(self.kicks),
+                      self.tick_rate):
+            write_varint(buffer, value)
+        return bytes(buffer)
+
+    @classmethod
+    def decode_from(cls, buffer, pos):
+        """
+        The decode_from function reads the header fields after MAGIC in
+        a buffer.
+
+        :param buffer: bytes or mmap
+        :param pos: Index of the first byte after MAGIC
+        :return: (ReplayHeader, index of the first record)
+        """
+        values = []
+        for _ in range(len(cls.FIELDS) + 1):
+            value, pos = read_varint(buffer, pos)
+            values.append(value)
+        return cls.decode(iter(values)), pos
+
+    @classmethod
+    def decode(cls, numbers):
+        """
+        The decode function reads the header fields after MAGIC.
+
+        :param numbers: Iterator of the varints of the replay
+        :return: A ReplayHeader
+        """
+        try:
+            version = next(numbers)
+            if version != VERSION:
+                raise ValueError("replay version %d is not supported" % version)
+            values = [next(numbers) for _ in cls.FIELDS]
+        except StopIteration:
+            raise ValueError("replay header is truncated")
+        seed, width, height, level, randomizer, kicks, tick_rate = values
+        return cls(seed, width, height, level, RANDOMIZER_NAMES[randomizer],
+                   bool(kicks), tick_rate)
+
+    def new_game(self, field_class=engine.BitPlayfield):
+        """
+        The new_game function starts the recorded game.
+
+        :param field_class: Engine backend for the board
+        :return: A GameState
+        """
+        randomizer = engine.RANDOMIZERS[self.randomizer](self.seed)
+        return engine.GameState(self.width, self.height, field_class=field_class,
+                                kicks=self.kicks, level=self.level,
+                                randomizer=randomizer)
+
+    def frames_per_tick(self):
+        """
+        The frames_per_tick function gives the gravity applied every tick.
+
+        :return: Frames of engine.FRAME_RATE in one tick
+        """
+        return engine.FRAME_RATE / self.tick_rate
+
+
+def randomizer_name(randomizer_class):
+    """
+    The randomizer_name function finds the name of a randomizer class.
+
+    :param randomizer_class: A class in engine.RANDOMIZERS
+    :return: Its name
+    """
+    for name, cls in engine.RANDOMIZERS.items():
+        if cls is randomizer_class:
+            return name
+    raise ValueError("%s cannot be recorded" % randomizer_class.__name__)
+
+
+############################################################
+# RECORDER CLASS
+############################################################
+
+class Recorder():
+    """
+    Recorder class:
+    Writes a replay while the game is played. Records are buffered and
+    written every buffer_size bytes.
+
+    :attr stream: type: file - the binary file written
+    :attr header: type: ReplayHeader - the settings of the game
+    :attr tick: type: int - gravity ticks applied so far, advanced by the game
+    """
+
+    def __init__(self, stream, header, buffer_size=4096):
+        self.stream = stream
+        self.header = header
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(header.encode())
+        self.tick = 0
+        self.last = 0
+        self.closed = False
+
+    def action(self, action):
+        """
+        The action function records an action applied at the current tick.
+
+        :param action: One of engine.ACTIONS
+        :return: None
+        """
+        if self.closed:
+            return
+        write_varint(self.buffer, (self.tick - self.last) << ACTION_BITS | action)
+        self.last = self.tick
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        The flush function writes the buffered records.
+
+        :return: None
+        """
+        self.stream.write(self.buffer)
+        self.stream.flush()
+        del self.buffer[:]
+
+    def close(self):
+        """
+        The close function ends the replay at the current tick and closes
+        the stream.
+
+        :return: None
+        """
+        if self.closed:
+            return
+        self.action(END)
+        self.flush()
+        self.closed = True
+        self.stream.close()
+
+
+############################################################
+# PLAYER CLASS
+############################################################
+
+class Player():
+    """
+    Player class:
+    Reads a replay back. Iterating it gives the (tick, action) records
+    up to the END one, read from the stream as they are needed; a replay
+    cut short before its END record raises ValueError.
+
+    :attr stream: type: file - the binary file read
+    :attr header: type: ReplayHeader - the settings of the game
+    :attr end: type: int - tick of the END record, None until it is read
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a replay")
+        self.numbers = read_varints(stream, chunk_size)
+        self.header = ReplayHeader.decode(self.numbers)
+        self.end = None
+
+    def __iter__(self):
+        tick = 0
+        for number in self.numbers:
+            tick += number >> ACTION_BITS
+            action = number & ACTION_MASK
+            if action == END:
+                self.end = tick
+                return
+            yield tick, action
+        raise ValueError("replay has no END record")
+
+    def simulate(self, field_class=engine.BitPlayfield):
+        """
+        The simulate function plays the whole replay headless, as fast as
+        it can.
+
+        :param field_class: Engine backend for the board
+        :return: The GameState at the end of the replay
+        """
+        state = self.header.new_game(field_class)
+        frames = self.header.frames_per_tick()
+        done = 0
+        for tick, action in self:
+            while done < tick:
+                state.apply_gravity(frames)
+                done += 1
+            state.step(action)
+        while done < self.end:
+            state.apply_gravity(frames)
+            done += 1
+        return state
+
+    def close(self):
+        """
+        The close function closes the stream.
+
+        :return: None
+        """
+        self.stream.close()
+
+
+############################################################
+# SNAPSHOTS
+############################################################
+
+FALL = struct.Struct('<d')
+
+
+def encode_snapshot(state, pos, last):
+    """
+    The encode_snapshot function packs a game at a tick: the counters,
+    the falling piece, the state of the randomizer and the locked blocks
+    with their kinds.
+
+    :param state: GameState on a Playfield, which knows the kinds
+    :param pos: Position in the replay of the first record not applied
+    :param last: Tick of the record before it, the base of its delta
+    :return: bytes
+    """
+    buffer = bytearray()
+    piece = state.piece
+    for value in (pos, last, state.lines, state.pieces, state.level, int(state.over),
+                  engine.SHAPES.index(piece.kind), piece.rotation):
+        write_varint(buffer, value)
+    write_varint(buffer, zigzag(piece.x))
+    write_varint(buffer, zigzag(piece.y))
+    buffer += FALL.pack(state.fall)
+    encode_randomizer(buffer, state.randomizer)
+
+    grid = state.board.grid
+    width = state.board.width
+    for y in range(state.board.height):
+        kinds = [grid.get((x, y)) for x in range(width)]
+        mask = 0
+        for x, kind in enumerate(kinds):
+            if kind is not None:
+                mask |= 1 << x
+        write_varint(buffer, mask)
+        for kind in kinds:
+            if kind is not None:
+                buffer.append(engine.SHAPES.index(kind))
+    return bytes(buffer)
+
+
+def encode_randomizer(buffer, randomizer):
+    """
+    The encode_randomizer function appends the state of a randomizer:
+    the version, words and gaussian of its Random, then the ints its
+    class keeps.
+
+    :param buffer: A bytearray
+    :param randomizer: An engine.Randomizer
+    :return: None
+    """
+    (version, words, gauss), values = randomizer.getstate()
+    write_varint(buffer, version)
+    write_varint(buffer, len(words))
+    for word in words:
+        write_varint(buffer, word)
+    if gauss is None:
+        buffer.append(0)
+    else:
+        buffer.append(1)
+        buffer += FALL.pack(gauss)
+    write_varint(buffer, len(values))
+    for value in values:
+        write_varint(buffer, value)
+
+
+def decode_randomizer(buffer, pos, randomizer):
+    """
+    The decode_randomizer function restores the state packed by
+    encode_randomizer into a randomizer of the same class.
+
+    :param buffer: bytes or mmap holding the state
+    :param pos: Index of its first byte
+    :param randomizer: The engine.Randomizer to restore
+    :return: Index of the next byte
+    """
+    version, pos = read_varint(buffer, pos)
+    count, pos = read_varint(buffer, pos)
+    words = []
+    for _ in range(count):
+        word, pos = read_varint(buffer, pos)
+        words.append(word)
+    gauss = None
+    pos += 1
+    if buffer[pos - 1]:
+        gauss, = FALL.unpack_from(buffer, pos)
+        pos += FALL.size
+    count, pos = read_varint(buffer, pos)
+    values = []
+    for _ in range(count):
+        value, pos = read_varint(buffer, pos)
+        values.append(value)
+    randomizer.setstate(((version, tuple(words), gauss), tuple(values)))
+    return pos
+
+
+def decode_snapshot(header, buffer, pos, field_class=engine.Playfield):
+    """
+    The decode_snapshot function rebuilds the game packed by encode_snapshot.
+
+    :param header: ReplayHeader of the game
+    :param buffer: bytes or mmap holding the snapshot
+    :param pos: Index of its first byte
+    :param field_class: Engine backend for the board
+    :return: (state, record position, tick of the record before it)
+    """
+    values = []
+    for _ in range(10):
+        value, pos = read_varint(buffer, pos)
+        values.append(value)
+    record, last, lines, pieces, level, over, kind, rotation, x, y = values
+    fall, = FALL.unpack_from(buffer, pos)
+    pos += FALL.size
+
+    # the new game draws a piece of its own, the saved state then replaces it
+    state = header.new_game(field_class)
+    pos = decode_randomizer(buffer, pos, state.randomizer)
+    for row in range(header.height):
+        mask, pos = read_varint(buffer, pos)
+        for column in range(header.width):
+            if mask >> column & 1:
+                state.board.lock([(column, row)], engine.SHAPES[buffer[pos]])
+                pos += 1
+
+    piece = state.piece
+    piece.kind = engine.SHAPES[kind]
+    piece.rotation = rotation
+    piece.x = unzigzag(x)
+    piece.y = unzigzag(y)
+    state.fall = fall
+    state.lines = lines
+    state.pieces = pieces
+    state.level = level
+    state.over = bool(over)
+    return state, record, last
+
+
+############################################################
+# ARCHIVE CLASSES
+############################################################
+
+ARCHIVE_MAGIC = b'TTRA'
+# 2: keyframes hold the state of the randomizer
+ARCHIVE_VERSION = 2
+KEYFRAME_INTERVAL = 1000
+
+# offset of each snapshot of a game
+GAME_OFFSET = struct.Struct('<Q')
+# replay offset, replay size, keyframe directory offset, keyframes, end tick
+GAME_ENTRY = struct.Struct('<QQQQQ')
+# index offset, number of games, ARCHIVE_MAGIC
+FOOTER = struct.Struct('<QQ4s')
+
+
+def replay_records(buffer, pos, last=0, end=None):
+    """
+    The replay_records function decodes records from a position of a
+    replay held in a buffer, up to the END one. A replay cut short just
+    stops at the end of its data, without an END record.
+
+    :param buffer: bytes or mmap
+    :param pos: Position of the first record
+    :param last: Tick of the record before it
+    :param end: Position after the last byte of the replay, None for the end of buffer
+    :return: A generator of (position, tick, action), END included
+    """
+    if end is None:
+        end = len(buffer)
+    tick = last
+    while pos < end:
+        start = pos
+        try:
+            number, pos = read_varint(buffer, pos)
+        except IndexError:
+            pos = end + 1
+        if pos > end:
+            raise ValueError("replay ends inside a number")
+        tick += number >> ACTION_BITS
+        action = number & ACTION_MASK
+        yield start, tick, action
+        if action == END:
+            return
+
+
+class ArchiveWriter():
+    """
+    ArchiveWriter class:
+    Builds an archive, one replay at a time. Every replay is re-simulated
+    once to take its keyframes.
+
+    :attr stream: type: file - the archive written
+    :attr keyframe_interval: type: int - ticks between two keyframes
+    :attr entries: type: list - the GAME_ENTRY values of the games so far
+    """
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL):
+        self.stream = open(path, 'wb')
+        self.keyframe_interval = keyframe_interval
+        self.entries = []
+        head = bytearray(ARCHIVE_MAGIC)
+        write_varint(head, ARCHIVE_VERSION)
+        write_varint(head, keyframe_interval)
+        self.stream.write(head)
+        self.offset = len(head)
+
+    def add(self, data):
+        """
+        The add function appends a whole replay, with its END record.
+
+        :param data: bytes of the replay
+        :return: Index of the game in the archive
+        """
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a replay")
+        header, pos = ReplayHeader.decode_from(data, len(MAGIC))
+        frames = header.frames_per_tick()
+        interval = self.keyframe_interval
+        state = header.new_game(engine.Playfield)
+
+        snapshots = []
+        done = 0
+        last = 0
+        for pos, tick, action in replay_records(data, pos):
+            # keyframes due before this record are taken on the way
+            while len(snapshots) * interval <= tick:
+                while done < len(snapshots) * interval:
+                    state.apply_gravity(frames)
+                    done += 1
+                snapshots.append(encode_snapshot(state, pos, last))
+            if action == END:
+                break
+            while done < tick:
+                state.apply_gravity(frames)
+                done += 1
+            state.step(action)
+            last = tick
+        else:
+            raise ValueError("replay has no END record")
+
+        game_offset = self.offset
+        self.stream.write(data)
+        self.offset += len(data)
+        directory = bytearray()
+        for snapshot in snapshots:
+            directory += GAME_OFFSET.pack(self.offset)
+            self.stream.write(snapshot)
+            self.offset += len(snapshot)
+        self.stream.write(directory)
+        self.entries.append((game_offset, len(data), self.offset, len(snapshots), tick))
+        self.offset += len(directory)
+        return len(self.entries) - 1
+
+    def add_file(self, path):
+        """
+        The add_file function appends the replay saved in a file.
+
+        :param path: Path of the replay
+        :return: Index of the game in the archive
+        """
+        with open(path, 'rb') as stream:
+            return self.add(stream.read())
+
+    def close(self):
+        """
+        The close function writes the index and closes the archive.
+
+        :return: None
+        """
+        index = bytearray()
+        for entry in self.entries:
+            index += GAME_ENTRY.pack(*entry)
+        index += FOOTER.pack(self.offset, len(self.entries), ARCHIVE_MAGIC)
+        self.stream.write(index)
+        self.stream.close()
+
+
+class Archive():
+    """
+    Archive class:
+    Reads an archive through mmap: only the index entry, one keyframe and
+    the records after it are decoded to reach a game at a tick.
+
+    :attr games: type: int - number of games
+    :attr keyframe_interval: type: int - ticks between two keyframes
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            raise ValueError("not a replay archive")
+        version, pos = read_varint(self.map, len(ARCHIVE_MAGIC))
+        if version != ARCHIVE_VERSION:
+            raise ValueError("archive version %d is not supported" % version)
+        self.keyframe_interval, pos = read_varint(self.map, pos)
+        self.index, self.games, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("replay archive is truncated")
+
+    def __len__(self):
+        return self.games
+
+    def entry(self, game):
+        """
+        The entry function reads the index entry of a game.
+
+        :param game: Index of the game
+        :return: (replay offset, replay size, directory offset, keyframes, end tick)
+        """
+        if not 0 <= game < self.games:
+            raise IndexError("game %d is not in the archive" % game)
+        return GAME_ENTRY.unpack_from(self.map, self.index + game * GAME_ENTRY.size)
+
+    def header(self, game):
+        """
+        The header function reads the settings of a game.
+
+        :param game: Index of the game
+        :return: A ReplayHeader
+        """
+        offset = self.entry(game)[0]
+        return ReplayHeader.decode_from(self.map, offset + len(MAGIC))[0]
+
+    def replay(self, game):
+        """
+        The replay function gives the replay of a game, as written by Recorder.
+
+        :param game: Index of the game
+        :return: bytes
+        """
+        offset, size = self.entry(game)[:2]
+        return self.map[offset:offset + size]
+
+    def end(self, game):
+        """
+        The end function gives the tick of the END record of a game.
+
+        :param game: Index of the game
+        :return: A tick
+        """
+        return self.entry(game)[4]
+
+    def state_at(self, game, tick, field_class=engine.Playfield):
+        """
+        The state_at function rebuilds a game after some gravity ticks,
+        before the actions of that tick, from the keyframe before it.
+        At the end tick or past it, the actions of the end tick are
+        applied too, so the result is the state the game ended in.
+
+        :param game: Index of the game
+        :param tick: A tick, past the end means the end
+        :param field_class: Engine backend for the board
+        :return: A GameState
+        """
+        offset, size, directory, keyframes, end = self.entry(game)
+        header = self.header(game)
+        tick = max(0, min(tick, end))
+        # the last tick with its actions, e.g. the drop that ended the game
+        last_tick = tick + 1 if tick == end else tick
+        key = min(tick // self.keyframe_interval, keyframes - 1)
+        snapshot, = GAME_OFFSET.unpack_from(self.map, directory + key * GAME_OFFSET.size)
+        state, pos, last = decode_snapshot(header, self.map, snapshot, field_class)
+
+        frames = header.frames_per_tick()
+        done = key * self.keyframe_interval
+        for pos, record, action in replay_records(self.map, offset + pos, last, offset + size):
+            if record >= last_tick or action == END:
+                break
+            while done < record:
+                state.apply_gravity(frames)
+                done += 1
+            state.step(action)
+        while done < tick:
+            state.apply_gravity(frames)
+            done += 1
+        return state
+
+    def close(self):
+        """
+        The close function releases the mapping and the file.
+
+        :return: None
+        """
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,177 @@
+# Self-play farm: headless games spread over a pool of processes.
+#
+# Every worker plays its share of the games with engine.GameState and a
+# pluggable policy. Final boards and results go straight into one
+# multiprocessing.shared_memory block, so nothing is pickled back per
+# step; the parent only waits for the workers to finish.
+#
+# A policy is any picklable callable taking the GameState and returning
+# one of engine.ACTIONS, e.g. a module level function.
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import engine
+
+# Columns of the results table
+LINES = 0
+PIECES = 1
+STEPS = 2
+DONE = 3
+RESULT_FIELDS = 4
+
+
+def random_policy(state):
+    """
+    The random_policy function picks any move, rotation or drop.
+
+    :param state: GameState object
+    :return: One of engine.ACTIONS
+    """
+    return random.choice(engine.ACTIONS)
+
+
+############################################################
+# SHAREDRESULTS CLASS
+############################################################
+
+class SharedResults():
+    """
+    SharedResults class:
+    The shared memory block of a farm, seen as NumPy arrays. The block
+    holds the results table first, games rows of RESULT_FIELDS int64
+    (LINES, PIECES, STEPS, DONE), then the boards, games * height * width
+    bytes, game by game and row by row; a square is 1 when taken. Workers
+    open the same layout by name with the same games, width and height.
+
+    :attr shm: type: SharedMemory - the block
+    :attr results: type: ndarray - (games, RESULT_FIELDS) int64, one row per game
+    :attr boards: type: ndarray - (games, height, width) uint8, final board of each game
+    :attr games: type: int - number of games
+    :attr width: type: int - width of the boards
+    :attr height: type: int - height of the boards
+    """
+
+    def __init__(self, games, width, height, name=None):
+        self.games = games
+        self.width = width
+        self.height = height
+        results_size = games * RESULT_FIELDS * 8
+        size = results_size + games * height * width
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.results = np.ndarray((games, RESULT_FIELDS), dtype=np.int64,
+                                  buffer=self.shm.buf)
+        self.boards = np.ndarray((games, height, width), dtype=np.uint8,
+                                 buffer=self.shm.buf, offset=results_size)
+        if name is None:
+            self.results[:] = 0
+            self.boards[:] = 0
+
+    def close(self):
+        """
+        The close function releases this process' view of the block.
+
+        :return: None
+        """
+        # the arrays point into the buffer and must go first
+        del self.results
+        del self.boards
+        self.shm.close()
+
+
+def play_games(name, games, width, height, first, count, policy, seed, max_steps,
+               randomizer=engine.UniformRandomizer):
+    """
+    The play_games function is the body of a worker: it plays games
+    first .. first+count-1 and writes each result into the shared block.
+    Game g always uses seed + g, so results do not depend on how the
+    games were split between workers.
+
+    :param name: Name of the shared memory block
+    :param games: Total number of games in the block
+    :param width: Width of the boards
+    :param height: Height of the boards
+    :param first: Index of the first game of this worker
+    :param count: Number of games to play
+    :param policy: Callable choosing an action from a GameState
+    :param seed: Base seed of the piece generators
+    :param max_steps: Steps after which a game is stopped, None for no limit
+    :param randomizer: engine Randomizer class picking the pieces
+    :return: None
+    """
+    shared = SharedResults(games, width, height, name)
+    columns = np.arange(width)
+    try:
+        for game in range(first, first + count):
+            # seeds the module random too, for policies such as random_policy
+            random.seed(seed + game)
+            state = engine.GameState(width, height, field_class=engine.BitPlayfield,
+                                     randomizer=randomizer(seed + game))
+            steps = 0
+            while not state.over and (max_steps is None or steps < max_steps):
+                state.step(policy(state))
+                steps += 1
+
+            rows = np.array(state.board.rows, dtype=np.int64)
+            shared.boards[game] = (rows[:, None] >> columns) & 1
+            shared.results[game, LINES] = state.lines
+            shared.results[game, PIECES] = state.pieces
+            shared.results[game, STEPS] = steps
+            shared.results[game, DONE] = 1
+    finally:
+        shared.close()
+
+
+def run_farm(policy=random_policy, workers=None, games_per_worker=1,
+             width=10, height=20, seed=0, max_steps=None,
+             randomizer=engine.UniformRandomizer):
+    """
+    The run_farm function plays workers * games_per_worker games on a
+    process pool and collects their results from shared memory.
+
+    :param policy: Picklable callable choosing an action from a GameState
+    :param workers: Number of processes, all the cores if None
+    :param games_per_worker: Games played by each process
+    :param width: Width of the boards
+    :param height: Height of the boards
+    :param seed: Base seed; game g uses seed + g
+    :param max_steps: Steps after which a game is stopped, None for no limit
+    :param randomizer: engine Randomizer class picking the pieces
+    :return: (results, boards) - copies of the shared arrays
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    games = workers * games_per_worker
+    shared = SharedResults(games, width, height)
+    try:
+        jobs = [(shared.shm.name, games, width, height, w * games_per_worker,
+                 games_per_worker, policy, seed, max_steps, randomizer)
+                for w in range(workers)]
+        with multiprocessing.Pool(workers) as pool:
+            pool.starmap(play_games, jobs)
+        results = shared.results.copy()
+        boards = shared.boards.copy()
+    finally:
+        shared.close()
+        shared.shm.unlink()
+    return results, boards
+
+
+if __name__ == "__main__":
+    games_per_worker = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    randomizer = engine.RANDOMIZERS[sys.argv[2] if len(sys.argv) > 2 else 'uniform']
+    start = time.perf_counter()
+    results, boards = run_farm(games_per_worker=games_per_worker, randomizer=randomizer)
+    elapsed = time.perf_counter() - start
+    print("%d games, %d steps in %.2f s (%.0f steps/s), %d lines"
+          % (len(results), results[:, STEPS].sum(), elapsed,
+             results[:, STEPS].sum() / elapsed, results[:, LINES].sum()))
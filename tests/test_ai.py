@@ -0,0 +1,133 @@
+# Tests of the placement search against moves played with the engine.
+
+import random
+from collections import deque
+
+import pytest
+
+import ai
+import engine
+
+
+def random_board(seed, width=10, height=20):
+    # ragged stacks with holes and overhangs in the bottom half, no full row
+    rng = random.Random(seed)
+    board = engine.Playfield(width, height)
+    for y in range(height // 2, height):
+        cells = [(x, y) for x in range(width) if rng.random() < 0.45]
+        board.lock(cells[:width - 1], 'O')
+    return board
+
+
+def engine_placements(board, kind, kicks):
+    # every position where the piece lands, found with the engine's own moves
+    start = engine.Piece(kind, board.width // 2)
+    start = (start.rotation, start.x, start.y)
+    seen = {start}
+    todo = deque([start])
+    landed = set()
+    while todo:
+        r, x, y = todo.popleft()
+        following = [(r, x - 1, y), (r, x + 1, y), (r, x, y + 1)]
+        piece = engine.Piece(kind, 0)
+        piece.rotation, piece.x, piece.y = r, x, y
+        rotated = engine.find_rotation(board, piece, kicks)
+        if rotated is not None:
+            following.append(rotated)
+        for position in following:
+            if position not in seen and board.fits_piece(kind, *position):
+                seen.add(position)
+                todo.append(position)
+        if not board.fits_piece(kind, r, x, y + 1):
+            landed.add((r, x, y))
+    return landed
+
+
+def play(board, kind, plan, kicks):
+    # plays the plan with GameState.step and returns where the piece lands
+    state = engine.GameState(board.width, board.height, kicks=kicks,
+                             randomizer=engine.UniformRandomizer(0))
+    state.board = board
+    state.piece = piece = engine.Piece(kind, board.width // 2)
+    for action, expected in plan[:-1]:
+        assert (piece.rotation, piece.x, piece.y) == expected
+        assert state.step(action)
+    assert plan[-1][0] == engine.DROP
+    while board.fits_piece(kind, piece.rotation, piece.x, piece.y + 1):
+        piece.y += 1
+    return piece.rotation, piece.x, piece.y
+
+
+@pytest.mark.parametrize('kicks', [False, True])
+def test_placements_are_the_reachable_ones(kicks):
+    for seed in range(8):
+        board = random_board(seed)
+        rows = ai.board_rows(board)
+        cols = ai.column_masks(rows, board.width)
+        for kind in engine.SHAPES:
+            piece = engine.Piece(kind, board.width // 2)
+            fits = ai.fit_masks(cols, board.width, board.height, kind)
+            reach = ai.reachable(fits, piece, board.width, board.height, kicks)
+            found = ai.placements(fits, reach, board.width)
+            assert sorted(found) == sorted(engine_placements(board, kind, kicks))
+
+
+@pytest.mark.parametrize('kicks', [False, True])
+def test_plans_reach_their_placement(kicks):
+    for seed in range(8):
+        for kind in engine.SHAPES:
+            board = random_board(seed)
+            rows = ai.board_rows(board)
+            cols = ai.column_masks(rows, board.width)
+            piece = engine.Piece(kind, board.width // 2)
+            fits = ai.fit_masks(cols, board.width, board.height, kind)
+            reach = ai.reachable(fits, piece, board.width, board.height, kicks)
+            for target in ai.placements(fits, reach, board.width):
+                plan = ai.direct_path(fits, piece, target, kicks, board.width, board.height)
+                if plan is None:
+                    plan = ai.search_path(fits, piece, target, kicks,
+                                          board.width, board.height)
+                assert plan is not None
+                assert play(random_board(seed), kind, plan, kicks) == target
+
+
+def test_cache_counts_hits_misses_and_evicts_the_least_recent():
+    cache = ai.TranspositionCache(maxsize=2)
+    assert cache.get('a') is None
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 2, 'evictions': 1, 'size': 2,
+                             'hit_rate': 3 / 5}
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['hits'] == 0
+
+
+def play_with(bot, seed, pieces=60):
+    # the placements the bot picks for the first pieces of a seeded game
+    state = engine.GameState(randomizer=engine.UniformRandomizer(seed), kicks=bot.kicks)
+    decisions = []
+    while not state.over and state.pieces <= pieces:
+        piece = state.piece
+        decisions.append(bot.best_placement(state.board, piece))
+        while state.piece is piece and not state.over:
+            state.step(bot(state))
+    return decisions
+
+
+@pytest.mark.parametrize('kicks', [False, True])
+def test_cached_plans_are_the_uncached_ones(kicks):
+    cache = ai.TranspositionCache()
+    cached = ai.PlacementAI(kicks=kicks, cache=cache)
+    uncached = ai.PlacementAI(kicks=kicks)
+    for seed in range(3):
+        first = play_with(cached, seed)
+        assert first == play_with(uncached, seed)
+        # the same game again is found in the cache
+        hits = cache.hits
+        assert play_with(cached, seed) == first
+        assert cache.hits - hits >= len(first)
@@ -0,0 +1,62 @@
+# Tests of the NumPy batch simulator against engine.GameState. They need
+# numpy and are skipped without it.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import engine
+from batch_tetris import BatchTetris
+
+
+class NextKind(engine.Randomizer):
+    """Gives the piece the batch spawned, set before each step"""
+    kind = 0
+
+    def __next__(self):
+        return self.kind
+
+
+@pytest.mark.parametrize('kicks', [False, True])
+def test_batch_matches_game_state(kicks):
+    # a narrow board, so that random moves clear rows
+    n = 32
+    width, height = 5, 12
+    batch = BatchTetris(n, width, height, seed=5, kicks=kicks)
+    randomizers = [NextKind() for _ in range(n)]
+
+    def new_game(i):
+        randomizers[i].kind = batch.kind[i]
+        return engine.GameState(width, height, randomizer=randomizers[i], kicks=kicks)
+    games = [new_game(i) for i in range(n)]
+    restarts = 0
+    total = 0
+    rng = np.random.default_rng(6)
+    weights = [0.1, 0.25, 0.25, 0.2, 0.17, 0.03]
+    for _ in range(800):
+        if batch.over.any():
+            ended = np.flatnonzero(batch.over)
+            batch.reset(ended)
+            for i in ended:
+                games[i] = new_game(i)
+            restarts += len(ended)
+        actions = rng.choice(len(engine.ACTIONS), size=n, p=weights)
+        moved, cleared = batch.step(actions)
+        total += cleared.sum()
+        for i, game in enumerate(games):
+            if game.over:
+                continue
+            randomizers[i].kind = batch.kind[i]
+            pieces = game.pieces
+            assert game.step(int(actions[i])) == moved[i]
+            assert (len(game.last_cleared) if game.pieces != pieces else 0) == cleared[i]
+            assert game.over == batch.over[i]
+            if game.over:
+                continue
+            piece = game.piece
+            assert (engine.SHAPES.index(piece.kind), piece.rotation, piece.x, piece.y) == \
+                (batch.kind[i], batch.rotation[i], batch.x[i], batch.y[i])
+            assert game.lines == batch.lines[i]
+            assert sorted(game.board.grid) == sorted(zip(*np.nonzero(batch.boards[i].T)))
+    assert total > 0
+    assert restarts > 0
@@ -0,0 +1,55 @@
+# Tests of the benchmark runner, on a fast engine case.
+
+import json
+import os
+import subprocess
+import sys
+
+import bench
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench.py')
+CASE = 'fits_piece[field=bits,height=20,stack=10,width=10]'
+
+
+def run_bench(*args):
+    # Runs bench.py as the command line does and returns what it printed
+    out = subprocess.run([sys.executable, BENCH, '-k', CASE, '--quick'] + list(args),
+                         capture_output=True, text=True, check=True)
+    return out.stdout
+
+
+def test_quick_run_saves_one_case(tmp_path):
+    path = str(tmp_path / 'new.json')
+    printed = run_bench('-o', path)
+    assert CASE in printed and 'ops/s' in printed
+    with open(path) as stream:
+        results = json.load(stream)
+    result, = results['results']
+    assert result['name'] == CASE and result['ops'] == 200
+    assert result['ops_per_sec'] > 0 and result['peak_bytes'] > 0
+    # a lookup keeps nothing once the free lists are collected
+    assert abs(result['blocks_per_op']) < 0.5
+    assert results['seed'] == bench.SEED
+
+
+def test_compare_prints_the_change_per_case(tmp_path):
+    old = str(tmp_path / 'old.json')
+    run_bench('-o', old)
+    with open(old) as stream:
+        results = json.load(stream)
+    # an old run twice as fast, with a case the new run does not have
+    for result in results['results']:
+        result['ops_per_sec'] *= 2
+    results['results'].append({'name': 'gone[]', 'group': 'engine', 'params': {},
+                               'skipped': "no such case"})
+    with open(old, 'w') as stream:
+        json.dump(results, stream)
+
+    printed = run_bench('--compare', old)
+    compared = printed.split('compared with')[1].splitlines()
+    assert old in compared[0]
+    line, = compared[1:]
+    assert line.startswith(CASE)
+    # about half the speed of the old run, whatever the noise of two runs
+    change = float(line.rsplit(None, 1)[1].rstrip('%'))
+    assert -100 < change < 0
@@ -0,0 +1,243 @@
+# Tests of the game rules.
+
+import random
+
+import pytest
+
+import engine
+
+
+FIELDS = [engine.Playfield, engine.BitPlayfield]
+
+
+def landed(state):
+    piece = state.piece
+    return not state.board.fits_piece(piece.kind, piece.rotation, piece.x, piece.y + 1)
+
+
+@pytest.mark.parametrize('field_class', FIELDS)
+def test_one_tick_at_20g_lands_the_piece(field_class):
+    level = next(level for level in range(1, 100)
+                 if engine.gravity_for_level(level) >= engine.MAX_GRAVITY)
+    state = engine.GameState(10, 20, field_class=field_class, level=level,
+                             randomizer=engine.UniformRandomizer(1))
+    piece = state.piece
+    # one tick of a 100 Hz loop is 0.6 frames
+    assert state.apply_gravity(0.6) > 12
+    assert state.piece is piece and landed(state)
+    # resting on the floor, it locks on the next step
+    assert state.apply_gravity(0.6) == 0
+    assert state.piece is not piece
+
+
+@pytest.mark.parametrize('field_class', FIELDS)
+def test_slow_gravity_adds_up_fractions(field_class):
+    state = engine.GameState(10, 20, field_class=field_class, level=1,
+                             randomizer=engine.UniformRandomizer(1))
+    frames_per_row = engine.SUBCELLS / engine.gravity_for_level(1)
+    y = state.piece.y
+    fell = sum(state.apply_gravity(0.6) for _ in range(int(frames_per_row / 0.6)))
+    assert fell == 0 and state.piece.y == y
+    fell = sum(state.apply_gravity(0.6) for _ in range(2))
+    assert fell == 1 and state.piece.y == y + 1
+
+
+def occupied(board):
+    return [(x, y) for y in range(board.height) for x in range(board.width)
+            if not board.is_free(x, y)]
+
+
+def test_squares_64_rows_apart_hash_differently():
+    assert engine.zobrist_hash([(3, 5)], 10, 200) != engine.zobrist_hash([(3, 69)], 10, 200)
+    keys = engine.zobrist_keys(10, 200)
+    assert len(set(keys[:10 * 200])) == 10 * 200
+
+
+@pytest.mark.parametrize('field_class', FIELDS)
+@pytest.mark.parametrize('height', [20, 200])
+def test_zobrist_follows_locks_and_clears(field_class, height):
+    rng = random.Random(height)
+    board = field_class(10, height)
+    reference = engine.Playfield(10, height)
+    cleared = 0
+    for _ in range(3000):
+        # random blocks in the bottom rows, so rows fill and clear often
+        y = height - 1 - rng.randrange(6)
+        cells = [(x, y) for x in rng.sample(range(10), rng.randint(1, 4))
+                 if board.is_free(x, y)]
+        if not cells:
+            continue
+        cleared += len(board.lock(cells, 'I'))
+        reference.lock(cells, 'I')
+        assert board.zobrist == engine.zobrist_hash(occupied(board), 10, height)
+        assert board.zobrist == reference.zobrist
+    assert cleared
+
+
+@pytest.mark.parametrize('name', sorted(engine.RANDOMIZERS))
+def test_fill_deals_the_same_pieces_as_next(name):
+    randomizer_class = engine.RANDOMIZERS[name]
+    dealt = randomizer_class(16)
+    filled = randomizer_class(16)
+    rng = random.Random(16)
+    pieces = []
+    while len(pieces) < 2000:
+        # chunks that start and end inside bags
+        count = rng.randint(0, 11)
+        pieces.extend(filled.fill(count))
+        if rng.random() < 0.5:
+            pieces.append(next(filled))
+    assert pieces == [next(dealt) for _ in pieces]
+    assert set(pieces) == set(range(len(engine.SHAPES)))
+
+
+def test_bag_deals_every_shape_once_per_bag():
+    pieces = engine.BagRandomizer(16).fill(7 * 300)
+    for start in range(0, len(pieces), 7):
+        assert sorted(pieces[start:start + 7]) == list(range(7))
+
+
+def test_history_starts_without_s_z_o_and_rarely_repeats():
+    firsts = {next(engine.HistoryRandomizer(seed)) for seed in range(200)}
+    assert firsts == set(engine.HistoryRandomizer.FIRST)
+    pieces = engine.HistoryRandomizer(16).fill(7000)
+    repeats = sum(1 for i in range(1, len(pieces)) if pieces[i] in pieces[max(0, i - 4):i])
+    # a uniform pick would repeat one of the last 4 shapes about 60% of the time
+    assert repeats < len(pieces) * 0.05
+
+
+def by_the_wall(field_class, kind, rotation, side):
+    # a piece in the given orientation against the left or right wall
+    board = field_class(10, 20)
+    xs = [dx for dx, dy in engine.ROTATIONS[kind][rotation]]
+    piece = engine.Piece(kind, 0)
+    piece.rotation = rotation
+    piece.x = -min(xs) if side == 'left' else board.width - 1 - max(xs)
+    piece.y = 10
+    return board, piece
+
+
+@pytest.mark.parametrize('field_class', FIELDS)
+def test_vertical_i_by_a_wall_rotates_with_kicks_only(field_class):
+    for side in ('left', 'right'):
+        board, piece = by_the_wall(field_class, 'I', 1, side)
+        assert engine.find_rotation(board, piece, kicks=False) is None
+        rotation, x, y = engine.find_rotation(board, piece, kicks=True)
+        assert rotation == 0 and y == piece.y
+        assert board.fits_piece('I', rotation, x, y)
+
+
+@pytest.mark.parametrize('kind', engine.SHAPES)
+def test_kicks_push_a_piece_off_either_wall(kind):
+    for rotation in range(len(engine.ROTATIONS[kind])):
+        for side in ('left', 'right'):
+            board, piece = by_the_wall(engine.BitPlayfield, kind, rotation, side)
+            kicked = engine.find_rotation(board, piece, kicks=True)
+            if len(engine.ROTATIONS[kind]) == 1:
+                assert kicked is None
+                continue
+            # whatever sticks out of the wall is pushed back in
+            assert kicked is not None
+            in_place = engine.find_rotation(board, piece, kicks=False)
+            assert in_place is None or in_place == kicked
+            # the kick is no further than needed
+            target, x, y = kicked
+            xs = [x + dx for dx, dy in engine.ROTATIONS[kind][target]]
+            assert min(xs) == 0 or max(xs) == board.width - 1 or x == piece.x
+
+
+def test_kicks_only_differ_where_the_rotation_sticks_out():
+    assert engine.KICKS['I'] == (((0, 0),), ((0, 0), (-1, 0), (1, 0), (-2, 0)))
+    assert engine.KICKS['O'] == (((0, 0),),)
+    assert engine.KICKS['T'][0] == ((0, 0),)
+
+
+def test_levels_go_up_every_ten_lines_from_the_start_level():
+    assert [engine.level_for_lines(lines) for lines in (0, 9, 10, 25)] == [1, 1, 2, 3]
+    assert [engine.level_for_lines(lines, 2) for lines in (0, 9, 10, 25)] == [2, 2, 3, 4]
+    state = engine.GameState(level=2, randomizer=engine.UniformRandomizer(1))
+    # four rows full but for column 0 and an upright I down the well, three times
+    for _ in range(3):
+        state.board.lock([(x, y) for y in range(16, 20) for x in range(1, 10)], 'O')
+        piece = state.piece = engine.Piece('I', 0)
+        piece.rotation, piece.x, piece.y = 1, 0, 2
+        state.drop()
+    assert state.lines == 12 and state.level == 3
+
+
+def repeats(repeat, ticks, frames=1, inputs=None, room=None):
+    """
+    The repeats function runs an AutoRepeat for some ticks and returns
+    the actions it applied, with their tick.
+
+    :param repeat: The AutoRepeat
+    :param ticks: Number of ticks
+    :param frames: Frames per tick
+    :param inputs: Dictionary tick: list of ('press' or 'release', action)
+                   made before the update of that tick
+    :param room: Moves an action can make per tick before it is blocked,
+                 None for no limit
+    :return: A list of (tick, action)
+    """
+    applied = []
+    for tick in range(ticks):
+        for kind, action in (inputs or {}).get(tick, ()):
+            if kind == 'press':
+                repeat.press(action)
+            else:
+                repeat.release(action)
+        done = []
+
+        def apply(action):
+            if room is not None and done.count(action) >= room:
+                return False
+            done.append(action)
+            applied.append((tick, action))
+            return True
+        repeat.update(frames, apply)
+    return applied
+
+
+def test_held_direction_waits_das_then_repeats_every_arr():
+    repeat = engine.AutoRepeat(das=10, arr=2)
+    assert repeat.press(engine.LEFT)
+    assert not repeat.press(engine.LEFT)
+    applied = repeats(repeat, 17)
+    assert applied == [(tick, engine.LEFT) for tick in (9, 11, 13, 15)]
+    # at 100 ticks a second a tick is 0.6 frames: 16.7 ticks of delay
+    repeat = engine.AutoRepeat(das=10, arr=2)
+    repeat.press(engine.RIGHT)
+    ticks = [tick for tick, action in repeats(repeat, 25, frames=0.6)]
+    assert ticks == [16, 19, 23]
+
+
+def test_arr_0_moves_as_far_as_possible_every_tick():
+    repeat = engine.AutoRepeat(das=10, arr=0)
+    repeat.press(engine.RIGHT)
+    applied = repeats(repeat, 12, room=3)
+    assert applied == [(tick, engine.RIGHT) for tick in (9, 9, 9, 10, 10, 10, 11, 11, 11)]
+
+
+def test_held_soft_drop_repeats_without_das():
+    repeat = engine.AutoRepeat(das=10, arr=2, soft_drop=3)
+    repeat.press(engine.DOWN)
+    # rotations and drops never repeat
+    repeat.press(engine.ROTATE)
+    repeat.press(engine.DROP)
+    applied = repeats(repeat, 10, inputs={7: [('release', engine.DOWN)]})
+    assert applied == [(2, engine.DOWN), (5, engine.DOWN)]
+
+
+def test_last_direction_pressed_repeats_and_hands_back_on_release():
+    repeat = engine.AutoRepeat(das=10, arr=2)
+    repeat.press(engine.LEFT)
+    inputs = {12: [('press', engine.RIGHT)], 30: [('release', engine.RIGHT)],
+              45: [('release', engine.LEFT)]}
+    applied = repeats(repeat, 50, inputs=inputs)
+    left = [tick for tick, action in applied if action == engine.LEFT]
+    right = [tick for tick, action in applied if action == engine.RIGHT]
+    # LEFT until RIGHT is pressed, RIGHT after its own delay, then LEFT
+    # again after the delay once RIGHT is released
+    assert left == [9, 11, 39, 41, 43]
+    assert right == [21, 23, 25, 27, 29]
+    assert repeat.shift is None and not repeat.held
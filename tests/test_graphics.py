@@ -0,0 +1,47 @@
+# Tests of graphics, drawn into an OffscreenWindow. graphics needs apply
+# and is skipped without it.
+
+import pytest
+
+graphics = pytest.importorskip("graphics")
+
+
+def frame(pooled):
+    canvas_frame = graphics.CanvasFrame(graphics.OffscreenWindow("test"), 40, 40)
+    canvas_frame.setPooling(pooled)
+    canvas_frame.setDeferred(True)
+    return canvas_frame
+
+
+def square(x, y, color):
+    rectangle = graphics.Rectangle(graphics.Point(x, y), graphics.Point(x + 10, y + 10))
+    rectangle.setFill(color)
+    return rectangle
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_deferred_changes_show_on_commit_only(pooled):
+    canvas_frame = frame(pooled)
+    canvas = canvas_frame.canvas
+    first = square(0, 0, 'red')
+    first.draw(canvas_frame)
+    text = graphics.Text(graphics.Point(20, 20), 'text')
+    text.draw(canvas_frame)
+    assert canvas.raster() == frame(pooled).canvas.raster()
+    assert canvas.itemcget(text.id, 'state') == 'hidden'
+    canvas_frame.commit()
+    shown = canvas.raster()
+    assert shown[5][5] == 'red'
+    assert canvas.itemcget(text.id, 'state') == 'normal'
+
+    # replacing the square with one elsewhere, recycled when pooled
+    first.undraw()
+    second = square(20, 20, 'blue')
+    second.draw(canvas_frame)
+    second.move(0, -10)
+    assert canvas.raster() == shown
+    canvas_frame.commit()
+    assert canvas.raster()[5][5] != 'red'
+    assert canvas.raster()[15][25] == 'blue'
+    # the text and one square, the red one deleted or hidden for reuse
+    assert len([id for id in canvas.find_all() if canvas.itemcget(id, 'state') != 'hidden']) == 2
@@ -0,0 +1,120 @@
+# Tests of the joystick backends of joydev: the Linux one fed raw
+# js_event packets through a FIFO, and the scripted fake through the
+# poller. They need pyglet and are skipped without it.
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("pyglet")
+joydev = pytest.importorskip("joydev")
+
+import joypoll
+from joydev import JS_EVENT, JS_EVENT_AXIS, JS_EVENT_BUTTON, JS_EVENT_INIT
+
+
+class Events():
+    """The on_button and on_axis events of a device, in order"""
+    def __init__(self, device):
+        self.events = []
+        device.push_handlers(on_button=self.on_button, on_axis=self.on_axis)
+
+    def on_button(self, button, pressed):
+        self.events.append(('button', button, pressed))
+
+    def on_axis(self, axis, value):
+        self.events.append(('axis', axis, value))
+
+    def take(self):
+        events, self.events = self.events, []
+        return events
+
+
+@pytest.fixture
+def linux_joystick(tmp_path):
+    # A LinuxJoystick reading a FIFO the test writes js_event packets to
+    path = str(tmp_path / 'js0')
+    os.mkfifo(path)
+    joystick = joydev.LinuxJoystick(0, path=path)
+    writer = os.open(path, os.O_WRONLY)
+
+    def send(*events):
+        os.write(writer, b''.join(JS_EVENT.pack(*event) for event in events))
+        joystick.dispatch_events()
+    yield joystick, send
+    os.close(writer)
+    joystick.close()
+
+
+def button(number):
+    # The button number of the events for an XInput bit
+    return number.bit_length()
+
+
+def test_linux_buttons_and_hats(linux_joystick):
+    joystick, send = linux_joystick
+    events = Events(joystick)
+    # the state on opening sets the buttons without events
+    send((0, 1, JS_EVENT_BUTTON | JS_EVENT_INIT, 1))
+    assert events.take() == []
+    assert joystick.get_state().gamepad.buttons == joydev.B
+    # A and Y pressed in one read, then A released; button 15 has no bit
+    send((10, 1, JS_EVENT_BUTTON, 0), (11, 1, JS_EVENT_BUTTON, 3), (12, 1, JS_EVENT_BUTTON, 15))
+    send((20, 0, JS_EVENT_BUTTON, 0))
+    assert events.take() == [('button', button(joydev.A), 1), ('button', button(joydev.Y), 1),
+                             ('button', button(joydev.A), 0)]
+    # the hats are the d-pad, one direction at a time
+    send((30, -32767, JS_EVENT_AXIS, 6), (31, 32767, JS_EVENT_AXIS, 6), (32, 0, JS_EVENT_AXIS, 6))
+    left, right = button(joydev.DPAD_LEFT), button(joydev.DPAD_RIGHT)
+    assert events.take() == [('button', left, 1), ('button', left, 0), ('button', right, 1),
+                             ('button', right, 0)]
+    assert joystick.received_packets == 6
+
+
+def test_linux_sticks_and_triggers(linux_joystick):
+    joystick, send = linux_joystick
+    events = Events(joystick)
+    # y is down on Linux and up in XInput
+    send((0, 32767, JS_EVENT_AXIS, 1), (1, -32767, JS_EVENT_AXIS, 0))
+    gamepad = joystick.get_state().gamepad
+    assert (gamepad.l_thumb_x, gamepad.l_thumb_y) == (-32767, -32767)
+    # a trigger goes from -32767 at rest to 32767 pressed
+    send((2, 32767, JS_EVENT_AXIS, 5))
+    assert joystick.get_state().gamepad.right_trigger == 255
+    send((3, -32767, JS_EVENT_AXIS, 5))
+    assert joystick.get_state().gamepad.right_trigger == 0
+    assert [event[:2] for event in events.take()] == [
+        ('axis', 'l_thumb_y'), ('axis', 'l_thumb_x'), ('axis', 'right_trigger'),
+        ('axis', 'right_trigger')]
+    # unknown axes and event types change nothing
+    before = joystick.received_packets
+    send((4, 100, JS_EVENT_AXIS, 9), (5, 1, 0x04, 0))
+    assert events.take() == [] and joystick.received_packets == before
+
+
+def test_fake_joystick_through_the_poller():
+    pad = joydev.FakeJoystick()
+    poller = joypoll.JoystickPoller(pad, rate=1000)
+    pad.tap(13)
+    pad.press(3)
+    pad.move('l_thumb_x', 32767)
+    pad.release(3)
+    pad.idle(2)
+    poller.start()
+    try:
+        deadline = time.perf_counter() + 5
+        while pad.script and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        assert not pad.script
+    finally:
+        poller.stop()
+    assert poller.error is None and poller.polls >= 6
+    events = []
+    assert poller.drain(lambda *event: events.append(event)) == 5
+    times = [event[0] for event in events]
+    assert times == sorted(times)
+    assert [event[1:3] for event in events] == [
+        (joypoll.BUTTON, 13), (joypoll.BUTTON, 13), (joypoll.BUTTON, 3),
+        (joypoll.AXIS, 'l_thumb_x'), (joypoll.BUTTON, 3)]
+    assert [event[3] for event in events if event[1] == joypoll.BUTTON] == [1, 0, 1, 0]
@@ -0,0 +1,47 @@
+# Tests of the joystick poller, fed by hand without its thread.
+
+import joypoll
+
+
+class Pad():
+    """The part of a joystick the poller uses"""
+    def push_handlers(self, **handlers):
+        self.handlers = handlers
+
+
+def held_buttons(poller):
+    held = set()
+
+    def handler(time, kind, code, value):
+        if kind == joypoll.BUTTON:
+            if value:
+                held.add(code)
+            else:
+                held.discard(code)
+    poller.drain(handler)
+    return held
+
+
+def test_a_full_queue_keeps_releases():
+    poller = joypoll.JoystickPoller(Pad(), maxsize=4)
+    poller.on_button(1, True)
+    poller.on_button(2, True)
+    for value in range(10):
+        poller.on_axis('l_thumb_x', value)
+    poller.on_button(3, True)
+    poller.on_button(1, False)
+    poller.on_button(3, False)
+    poller.on_button(2, False)
+    assert held_buttons(poller) == set()
+    # the axis events past the size, the press of 3 and its release
+    assert poller.dropped == 10 - 2 + 2
+
+
+def test_queue_stays_bounded_while_full():
+    poller = joypoll.JoystickPoller(Pad(), maxsize=8)
+    for _ in range(1000):
+        for button in range(1, 15):
+            poller.on_button(button, True)
+            poller.on_button(button, False)
+    assert len(poller.events) <= 8 + 14
+    assert held_buttons(poller) == set()
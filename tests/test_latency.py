@@ -0,0 +1,85 @@
+# Tests of the latency tracer, run on a fake clock.
+
+import latency
+
+
+class Clock():
+    """A clock that only moves when told to"""
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stages_of_each_input():
+    clock = Clock()
+    tracer = latency.LatencyTracer(clock)
+    # two inputs shown by one frame, then one by the next
+    tracer.arrive(99.990)
+    clock.now = 100.000
+    tracer.apply()
+    tracer.arrive(100.001)
+    clock.now = 100.005
+    tracer.apply()
+    clock.now = 100.016
+    tracer.flush()
+    tracer.arrive()
+    clock.now = 100.020
+    tracer.apply()
+    clock.now = 100.032
+    tracer.flush()
+    samples = dict((stage, [round(value, 6) for value in tracer.samples[stage]])
+                   for stage in latency.STAGES)
+    assert samples == {'arrive-apply': [0.010, 0.004, 0.004],
+                       'apply-flush': [0.016, 0.011, 0.012],
+                       'arrive-flush': [0.026, 0.015, 0.016]}
+    assert tracer.ignored == 0
+    report = tracer.report()
+    assert report['arrive-flush']['count'] == 3
+    assert round(report['arrive-flush']['p50'], 6) == 16.0
+    assert round(report['arrive-flush']['max'], 6) == 26.0
+
+
+def test_inputs_that_did_nothing_are_ignored():
+    clock = Clock()
+    tracer = latency.LatencyTracer(clock)
+    # an action without an arrival, e.g. gravity, is not traced
+    tracer.apply()
+    # a press lost to the next one, e.g. a blocked move
+    tracer.arrive(99.0)
+    tracer.arrive(99.5)
+    tracer.apply()
+    tracer.arrive(99.8)
+    tracer.flush()
+    assert tracer.ignored == 1
+    assert list(tracer.samples['arrive-apply']) == [0.5]
+    tracer.arrive(99.9)
+    assert tracer.ignored == 2
+    assert '2 inputs did nothing' in tracer.format_report()
+
+
+def test_percentile_is_the_nearest_rank():
+    ordered = list(range(1, 101))
+    assert latency.percentile(ordered, 0.5) == 50
+    assert latency.percentile(ordered, 0.99) == 99
+    assert latency.percentile(ordered, 1.0) == 100
+    assert latency.percentile([7], 0.5) == 7
+    assert latency.percentile([], 0.5) is None
+
+
+def test_event_times_align_on_the_fastest_event():
+    clock = Clock()
+    tracer = latency.LatencyTracer(clock)
+    # the X server clock is 40 s behind; the first event waited 3 ms
+    clock.now = 100.003
+    assert round(tracer.event_time(60000), 6) == 100.003
+    # the second waited 1 ms, the fastest so far
+    clock.now = 100.511
+    assert round(tracer.event_time(60510), 6) == 100.511
+    # the third waited 8 ms more than it
+    clock.now = 101.009
+    assert round(tracer.event_time(61000), 6) == 101.001
+    # the ms wrapped around: aligned again
+    clock.now = 102.0
+    assert round(tracer.event_time(5), 6) == 102.0
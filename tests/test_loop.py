@@ -0,0 +1,68 @@
+# Tests of the fixed-timestep loop, run on a fake clock.
+
+import random
+
+from loop import FixedTimestep
+
+
+class Clock():
+    """A clock that only moves when told to"""
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ticks_follow_the_clock_whatever_the_callbacks_timing():
+    clock = Clock()
+    loop = FixedTimestep(tick_rate=100, frame_rate=60, clock=clock)
+    counts = {'tick': 0, 'third': 0, 'render': 0}
+    loop.every(1, lambda: counts.__setitem__('tick', counts['tick'] + 1))
+    loop.every(3, lambda: counts.__setitem__('third', counts['third'] + 1))
+    loop.on_render(lambda: counts.__setitem__('render', counts['render'] + 1))
+    loop.advance()
+    rng = random.Random(14)
+    start = clock.now
+    advances = 0
+    while clock.now - start < 10.0:
+        # Tk calling back late and early, never more than max_steps ticks
+        clock.now += rng.choice([0.001, 0.004, 0.01, 0.03]) * rng.random()
+        loop.advance()
+        advances += 1
+        assert loop.accumulator < loop.dt
+    elapsed = clock.now - start
+    assert abs(loop.tick - elapsed * 100) <= 1
+    assert counts['tick'] == loop.tick
+    assert counts['third'] == loop.tick // 3
+    # one frame per advance at most, and never more than 60 per second
+    assert counts['render'] <= advances + 1
+    assert elapsed * 60 * 0.6 <= counts['render'] <= elapsed * 60 + 1
+
+
+def test_a_stall_runs_max_steps_and_drops_the_rest():
+    clock = Clock()
+    loop = FixedTimestep(tick_rate=100, max_steps=10, clock=clock)
+    loop.advance()
+    clock.now += 0.025
+    assert loop.advance() == 2
+    clock.now += 1.0
+    assert loop.advance() == 10
+    assert loop.accumulator == 0.0
+    # back to one tick per tick length after the stall
+    clock.now += 0.01
+    assert loop.advance() == 1
+
+
+def test_delay_waits_for_the_next_tick():
+    clock = Clock()
+    loop = FixedTimestep(tick_rate=100, clock=clock)
+    loop.advance()
+    clock.now += 0.004
+    loop.advance()
+    # whole milliseconds, rounded down
+    assert 5 <= loop.delay() <= 6
+    clock.now += 0.003
+    assert 2 <= loop.delay() <= 3
+    clock.now += 0.005
+    assert loop.delay() == 1
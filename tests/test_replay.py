@@ -0,0 +1,141 @@
+# Tests of the replay format and the replay archive.
+
+import random
+
+import pytest
+
+import engine
+import replay
+
+
+def state_key(state):
+    # What two game states must agree on to be the same game
+    piece = state.piece
+    return (sorted(state.board.grid.items()), state.lines, state.pieces, piece.kind,
+            piece.x, piece.y, piece.rotation, state.fall, state.level, state.over)
+
+
+def record_game(path, seed, randomizer='uniform', level=1, max_ticks=20000):
+    """
+    The record_game function plays a game with random actions, the way
+    Tetris records one, and returns the state after every tick.
+
+    :param path: File the replay is written to
+    :param seed: Seed of the pieces and the actions
+    :param randomizer: Name of the randomizer
+    :param level: Start level
+    :param max_ticks: Ticks after which the game stops if it is not over
+    :return: A dictionary tick: state_key after the gravity of that tick
+    """
+    header = replay.ReplayHeader(seed, 10, 20, level, randomizer, True, 100)
+    recorder = replay.Recorder(open(path, 'wb'), header)
+    state = header.new_game(engine.Playfield)
+    rng = random.Random(seed)
+    frames = header.frames_per_tick()
+    trace = {0: state_key(state)}
+    while not state.over and recorder.tick < max_ticks:
+        if rng.random() < 0.3:
+            action = rng.choice(engine.ACTIONS[1:])
+            recorder.action(action)
+            state.step(action)
+        if not state.over:
+            state.apply_gravity(frames)
+            recorder.tick += 1
+        trace[recorder.tick] = state_key(state)
+    recorder.close()
+    return trace
+
+
+def test_state_at_end_matches_simulate(tmp_path):
+    # the last actions, often the drop that ends the game, belong to the end
+    writer = replay.ArchiveWriter(str(tmp_path / 'games.tra'), keyframe_interval=50)
+    players = []
+    for game in range(20):
+        path = str(tmp_path / ('%d.rpl' % game))
+        record_game(path, 1000 + game, replay.RANDOMIZER_NAMES[game % 3])
+        writer.add_file(path)
+        players.append(path)
+    writer.close()
+
+    archive = replay.Archive(str(tmp_path / 'games.tra'))
+    try:
+        for game, path in enumerate(players):
+            with open(path, 'rb') as stream:
+                final = replay.Player(stream).simulate(engine.Playfield)
+            end = archive.end(game)
+            assert state_key(archive.state_at(game, end)) == state_key(final)
+            assert state_key(archive.state_at(game, end + 100)) == state_key(final)
+    finally:
+        archive.close()
+
+
+def test_state_at_matches_the_recorded_game(tmp_path):
+    interval = 50
+    writer = replay.ArchiveWriter(str(tmp_path / 'games.tra'), keyframe_interval=interval)
+    traces = []
+    for game in range(6):
+        path = str(tmp_path / ('%d.rpl' % game))
+        traces.append(record_game(path, 2000 + game, replay.RANDOMIZER_NAMES[game % 3],
+                                  level=1 + game * 3, max_ticks=3000))
+        writer.add_file(path)
+    writer.close()
+
+    archive = replay.Archive(str(tmp_path / 'games.tra'))
+    rng = random.Random(18)
+    try:
+        assert len(archive) == len(traces)
+        for game, trace in enumerate(traces):
+            end = archive.end(game)
+            assert end == max(trace)
+            # one keyframe every interval ticks up to the end
+            assert archive.entry(game)[3] == end // interval + 1
+            # the keyframes, the ticks around them and random ones
+            ticks = {0, end}
+            for key in range(0, end + 1, interval):
+                ticks.update((key - 1, key, key + 1))
+            ticks.update(rng.randint(0, end) for _ in range(50))
+            for tick in sorted(t for t in ticks if 0 <= t <= end):
+                assert state_key(archive.state_at(game, tick)) == trace[tick], tick
+            header = archive.header(game)
+            assert header.seed == 2000 + game and header.level == 1 + game * 3
+    finally:
+        archive.close()
+
+
+@pytest.mark.parametrize('name', replay.RANDOMIZER_NAMES)
+def test_randomizer_state_survives_a_keyframe(name):
+    randomizer_class = engine.RANDOMIZERS[name]
+    saved = randomizer_class(5)
+    for count in (0, 1, 3, 7, 10):
+        saved.fill(count)
+        if count == 7:
+            saved.rng.gauss(0, 1)
+        buffer = bytearray()
+        replay.encode_randomizer(buffer, saved)
+        restored = randomizer_class(99)
+        assert replay.decode_randomizer(buffer, 0, restored) == len(buffer)
+        assert restored.fill(30) == saved.fill(30)
+
+
+def test_truncated_replay_is_rejected(tmp_path):
+    path = str(tmp_path / 'game.rpl')
+    record_game(path, 3000, max_ticks=500)
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    header_size = replay.ReplayHeader.decode_from(data, len(replay.MAGIC))[1]
+    # without the END record, then cut inside a record of two bytes or more
+    cuts = [len(data) - 1]
+    cuts += [pos + 1 for pos, tick, action in replay.replay_records(data, header_size)
+             if data[pos] & 0x80][:1]
+    assert len(cuts) == 2
+    writer = replay.ArchiveWriter(str(tmp_path / 'games.tra'))
+    for cut in cuts:
+        with pytest.raises(ValueError):
+            writer.add(data[:cut])
+        cut_path = str(tmp_path / 'cut.rpl')
+        with open(cut_path, 'wb') as stream:
+            stream.write(data[:cut])
+        with open(cut_path, 'rb') as stream:
+            with pytest.raises(ValueError):
+                replay.Player(stream).simulate()
+    writer.close()
@@ -0,0 +1,35 @@
+# Tests of the self-play farm. They need numpy and are skipped without it.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import selfplay
+
+
+def serial_run(games, width, height, seed, max_steps, randomizer):
+    # every game played in this process, into a block of the same layout
+    shared = selfplay.SharedResults(games, width, height)
+    try:
+        selfplay.play_games(shared.shm.name, games, width, height, 0, games,
+                            selfplay.random_policy, seed, max_steps, randomizer)
+        return shared.results.copy(), shared.boards.copy()
+    finally:
+        shared.close()
+        shared.shm.unlink()
+
+
+@pytest.mark.parametrize('randomizer', ['uniform', 'bag'])
+def test_farm_matches_a_serial_run(randomizer):
+    randomizer = selfplay.engine.RANDOMIZERS[randomizer]
+    results, boards = selfplay.run_farm(workers=2, games_per_worker=3, width=8, height=16,
+                                        seed=70, max_steps=3000, randomizer=randomizer)
+    assert results.shape == (6, selfplay.RESULT_FIELDS)
+    assert boards.shape == (6, 16, 8)
+    assert (results[:, selfplay.DONE] == 1).all()
+    assert (results[:, selfplay.PIECES] > 1).all()
+    expected_results, expected_boards = serial_run(6, 8, 16, 70, 3000, randomizer)
+    assert (results == expected_results).all()
+    assert (boards == expected_boards).all()
+    # the games differ from each other
+    assert len({board.tobytes() for board in boards}) == 6
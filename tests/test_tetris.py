@@ -0,0 +1,151 @@
+# Tests of the Tk view, run on graphics.OffscreenWindow. They need the
+# view's dependencies (apply, pyglet) and are skipped without them.
+
+import pytest
+
+tetris = pytest.importorskip("tetris")
+graphics = pytest.importorskip("graphics")
+
+
+class Key():
+    """A key event for Tetris.key_pressed and key_released"""
+    def __init__(self, keysym, time=None):
+        self.keysym = keysym
+        self.time = time
+
+
+def new_game(**settings):
+    settings.setdefault('SEED', 1)
+    settings.setdefault('JOYSTICK', False)
+    game_class = type('TestTetris', (tetris.Tetris,), settings)
+    return game_class(graphics.OffscreenWindow("test"))
+
+
+def tap(game, keysym):
+    key = Key(keysym)
+    game.key_pressed(key)
+    game.key_released(key)
+    game.render()
+
+
+def play_until_over(game):
+    for _ in range(1000):
+        if game.state.over:
+            return
+        tap(game, 'space')
+    raise AssertionError("the game did not end")
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_game_over_message_is_drawn_once(pooled):
+    game = new_game(POOLED_RENDER=pooled)
+    play_until_over(game)
+    canvas = game.board.canvas.canvas
+    items = len(canvas.items)
+    for keysym in ('Left', 'Right', 'Up', 'Down', 'space') * 10:
+        tap(game, keysym)
+    assert len(canvas.items) == items
+
+
+def test_closing_the_window_finishes_the_recording(tmp_path):
+    replay = pytest.importorskip("replay")
+    path = str(tmp_path / 'game.rpl')
+    game = new_game(REPLAY_FILE=path, FIELD_CLASS=tetris.engine.Playfield)
+    for keysym in ('Left', 'Up', 'space', 'Right', 'space'):
+        tap(game, keysym)
+    for _ in range(30):
+        game.animate_shape()
+    assert not game.state.over
+    game.win.protocols["WM_DELETE_WINDOW"]()
+    assert game.win.closed
+
+    with open(path, 'rb') as stream:
+        player = replay.Player(stream)
+        state = player.simulate(tetris.engine.Playfield)
+    assert player.end == 30
+    assert sorted(state.board.grid.items()) == sorted(game.state.board.grid.items())
+    assert (state.piece.x, state.piece.y) == (game.state.piece.x, game.state.piece.y)
+
+
+class IdleJoystick():
+    """A joystick that never changes"""
+    def push_handlers(self, **handlers):
+        pass
+
+    def dispatch_events(self):
+        pass
+
+
+class UnpluggedJoystick():
+    """A joystick that presses LEFT, then fails like a disconnected one"""
+    def push_handlers(self, on_button, on_axis):
+        self.on_button = on_button
+        self.polls = 0
+
+    def dispatch_events(self):
+        self.polls += 1
+        if self.polls == 1:
+            self.on_button(3, True)
+        else:
+            raise OSError("No such device")
+
+
+def test_lost_joystick_falls_back_to_the_keyboard(capsys):
+    joystick = UnpluggedJoystick()
+    game = new_game(JOYSTICK=joystick)
+    poller = game.joy_poller
+    poller._thread.join(5)
+    assert isinstance(poller.error, OSError)
+    x = game.state.piece.x
+    game.poll_input()
+    # the press read before the failure is played, then released
+    assert game.state.piece.x == x - 1
+    assert game.joy_poller is None and not game.repeat.held
+    assert "No such device" in capsys.readouterr().err
+    tap(game, 'Right')
+    assert game.state.piece.x == x
+    game.close()
+
+
+def test_replay_does_not_poll_the_joystick(tmp_path, monkeypatch):
+    path = str(tmp_path / 'game.rpl')
+    game = new_game(REPLAY_FILE=path)
+    tap(game, 'space')
+    game.close()
+    monkeypatch.setattr(tetris.Tetris, 'JOYSTICK', IdleJoystick())
+    replay_game = tetris.ReplayTetris(graphics.OffscreenWindow("replay"), path)
+    assert replay_game.joy_poller is None
+    replay_game.close()
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_inputs_reach_the_canvas_on_render_only(pooled):
+    game = new_game(POOLED_RENDER=pooled)
+    canvas = game.board.canvas.canvas
+    game.render()
+    for keysym in ('Left', 'Up', 'space', 'Right', 'Right', 'space', 'Down') * 5:
+        shown = canvas.raster(step=5)
+        key = Key(keysym)
+        game.key_pressed(key)
+        game.key_released(key)
+        game.animate_shape()
+        assert canvas.raster(step=5) == shown
+        game.render()
+
+
+def test_key_latency_starts_at_the_tk_event_time():
+    now = [100.0]
+    game = new_game(LATENCY_TRACE=True)
+    game.tracer = tetris.latency.LatencyTracer(lambda: now[0])
+    # the first key reaches the game at once, the second 20 ms late
+    for time, late in ((1000, 0.0), (1500, 0.020)):
+        now[0] = 100.0 + (time - 1000) / 1000.0 + late
+        game.key_pressed(Key('Left', time))
+        game.key_released(Key('Left', time + 50))
+        game.poll_input()
+        now[0] += 0.005
+        game.render()
+    samples = game.tracer.samples
+    assert [round(value, 6) for value in samples['arrive-apply']] == [0.0, 0.020]
+    assert [round(value, 6) for value in samples['arrive-flush']] == [0.005, 0.025]
+    game.close()
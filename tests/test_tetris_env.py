@@ -0,0 +1,77 @@
+# Tests of the gym-style environments. They need numpy and are skipped
+# without it.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import engine
+from tetris_env import LOCKED, PIECE, TetrisEnv, VecTetrisEnv
+
+
+def test_reset_and_step_shapes():
+    env = TetrisEnv(seed=6)
+    obs = env.reset()
+    assert obs.shape == (20, 10) and obs.dtype == np.uint8
+    assert (obs == PIECE).sum() == 4 and (obs == LOCKED).sum() == 0
+    obs, reward, done, info = env.step(engine.DROP)
+    assert obs.shape == (20, 10)
+    assert reward == 0 and done is False
+    assert (obs == LOCKED).sum() == 4 and (obs == PIECE).sum() == 4
+    assert info == {'lines': 0, 'pieces': 2}
+
+    vec = VecTetrisEnv(3, seed=6)
+    obs = vec.reset()
+    assert obs.shape == (3, 20, 10) and obs.dtype == np.uint8
+    obs, rewards, dones, info = vec.step(np.full(3, engine.DROP))
+    assert obs.shape == (3, 20, 10)
+    assert rewards.shape == dones.shape == (3,)
+    assert info['lines'].shape == info['pieces'].shape == (3,)
+
+
+def test_reward_is_the_rows_cleared():
+    env = TetrisEnv(seed=6)
+    env.reset()
+    # a well in column 0, four rows deep, and an upright I above it
+    env.state.board.lock([(x, y) for y in range(16, 20) for x in range(1, 10)])
+    piece = env.state.piece = engine.Piece('I', 0)
+    piece.rotation, piece.x, piece.y = 1, 0, 2
+    obs, reward, done, info = env.step(engine.DROP)
+    assert reward == info['lines'] == 4
+    assert (obs == LOCKED).sum() == 0 and not done
+
+
+def test_game_over_is_done():
+    env = TetrisEnv(seed=6)
+    env.reset()
+    done = False
+    for _ in range(200):
+        obs, reward, done, info = env.step(engine.DROP)
+        if done:
+            break
+    assert done and env.state.over
+
+
+def test_vectorized_env_matches_single_envs():
+    n = 4
+    vec = VecTetrisEnv(n, seed=60)
+    singles = [TetrisEnv(seed=60 + i) for i in range(n)]
+    obs = vec.reset()
+    for i, env in enumerate(singles):
+        assert (obs[i] == env.reset()).all()
+    rng = np.random.default_rng(7)
+    ended = 0
+    for _ in range(3000):
+        actions = rng.choice(len(engine.ACTIONS), size=n, p=[0.1, 0.25, 0.25, 0.2, 0.15, 0.05])
+        obs, rewards, dones, info = vec.step(actions)
+        for i, env in enumerate(singles):
+            single_obs, reward, done, single_info = env.step(int(actions[i]))
+            assert reward == rewards[i] and done == dones[i]
+            assert single_info['lines'] == info['lines'][i]
+            if done:
+                # the vectorized env starts the next game at once
+                assert (info['final_observation'][i] == single_obs).all()
+                single_obs = env.reset()
+                ended += 1
+            assert (obs[i] == single_obs).all()
+    assert ended > 0
@@ -0,0 +1,91 @@
+# Tests of the event dispatch of xbox_joystick. It needs pyglet and is
+# skipped without it.
+
+import ctypes
+import random
+from itertools import count, starmap
+from operator import itemgetter
+
+import pytest
+
+pytest.importorskip("pyglet")
+xbox_joystick = pytest.importorskip("xbox_joystick")
+
+from xbox_joystick import Gamepad, XINPUT_GAMEPAD, XINPUT_STATE, get_bit_values
+
+
+class ReferenceGamepad(Gamepad):
+    """A Gamepad dispatching with the code it had before AXES and the
+    walk over the set bits, kept to check the new code against"""
+
+    def get_state(self):
+        return XINPUT_STATE()
+
+    def translate_using_data_size(self, value, data_size):
+        data_bits = 8 * data_size
+        return float(value) / (2 ** data_bits - 1)
+
+    def dispatch_axis_events(self, state):
+        axis_fields = dict(XINPUT_GAMEPAD._fields_)
+        axis_fields.pop('buttons')
+        for axis, type in list(axis_fields.items()):
+            old_val = getattr(self._last_state.gamepad, axis)
+            new_val = getattr(state.gamepad, axis)
+            data_size = ctypes.sizeof(type)
+            old_val = self.translate(old_val, data_size)
+            new_val = self.translate(new_val, data_size)
+            if ((old_val != new_val and (new_val > 0.08000000000000000 or new_val < -0.08000000000000000) and abs(old_val - new_val) > 0.00000000500000000) or
+               (axis == 'right_trigger' or axis == 'left_trigger') and new_val == 0 and abs(old_val - new_val) > 0.00000000500000000):
+                self.dispatch_event('on_axis', axis, new_val)
+
+    def dispatch_button_events(self, state):
+        changed = state.gamepad.buttons ^ self._last_state.gamepad.buttons
+        changed = get_bit_values(changed, 16)
+        buttons_state = get_bit_values(state.gamepad.buttons, 16)
+        changed.reverse()
+        buttons_state.reverse()
+        button_numbers = count(1)
+        changed_buttons = list(
+            filter(itemgetter(0), list(zip(changed, button_numbers, buttons_state))))
+        tuple(starmap(self.dispatch_button_event, changed_buttons))
+
+
+class ScriptedGamepad(Gamepad):
+    def get_state(self):
+        return XINPUT_STATE()
+
+
+def random_packets(rng, number):
+    state = XINPUT_STATE()
+    for packet in range(1, number + 1):
+        state = XINPUT_STATE.from_buffer_copy(state)
+        gamepad = state.gamepad
+        if rng.random() < 0.5:
+            gamepad.buttons ^= 1 << rng.randrange(16)
+        for name in ('left_trigger', 'right_trigger'):
+            if rng.random() < 0.2:
+                setattr(gamepad, name, rng.choice([0, 1, 20, 21, rng.randrange(256)]))
+        for name in ('l_thumb_x', 'l_thumb_y', 'r_thumb_x', 'r_thumb_y'):
+            if rng.random() < 0.2:
+                setattr(gamepad, name, rng.choice([0, -1, 5000, -5000, rng.randrange(-32768, 32768)]))
+        state.packet_number = packet
+        yield state
+
+
+def events(gamepad_class, normalize_axes, packets):
+    gamepad = gamepad_class(0, normalize_axes)
+    seen = []
+    gamepad.push_handlers(on_button=lambda *event: seen.append(('button',) + event),
+                          on_axis=lambda *event: seen.append(('axis',) + event))
+    for state in packets:
+        gamepad.handle_changed_state(state)
+        gamepad._last_state = state
+    return seen
+
+
+@pytest.mark.parametrize('normalize_axes', [True, False])
+def test_dispatch_matches_the_reference(normalize_axes):
+    packets = list(random_packets(random.Random(22), 20000))
+    seen = events(ScriptedGamepad, normalize_axes, packets)
+    assert len(seen) > 10000
+    assert seen == events(ReferenceGamepad, normalize_axes, packets)
@@ -5,8 +5,16 @@
 
 
 from graphics import *
+import argparse
 import random
-import xbox_joystick as joy
+import sys
+import ai
+import engine
+import joydev
+import joypoll
+import latency
+from loop import FixedTimestep
+import replay
 
 ############################################################
 # BLOCK CLASS
@@ -69,23 +77,22 @@ class Block(Rectangle):
 class Shape():
     """ 
     Shape class:
-    Base class for all the tetris shapes
+    Base class for all the tetris shapes. A shape draws the blocks of an
+    engine Piece; the piece decides where the blocks go.
 
+    :attr piece: type: Piece - the engine piece drawn by this shape
     :attr blocks: type: list - the list of blocks making up the shape
-    :attr rotation_dir: type: int - the current rotation direction of the shape
-    :attr shift_rotation_dir: type: Boolean - whether or not the shape rotates
+    :attr COLOR: type: str - the fill color of the blocks
     """
 
-    def __init__(self, coords, color):
+    COLOR = 'white'
+
+    def __init__(self, piece):
+        self.piece = piece
         self.blocks = []
-        self.rotation_dir = 1
 
-        # A boolean to indicate if a shape shifts rotation direction or not.
-        # Defaults to false since only 3 shapes shift rotation directions (I, S and Z)
-        self.shift_rotation_dir = False
-        
-        for pos in coords:
-            self.blocks.append(Block(pos, color))
+        for x, y in piece.cells:
+            self.blocks.append(Block(Point(x, y), self.COLOR))
 
     def get_blocks(self):
         """
@@ -106,106 +113,41 @@ class Shape():
         for block in self.blocks:
             block.draw(win)
 
-    def move(self, dx, dy):
+    def sync(self):
         """
-        The move function moves the shape dx squares in the x direction
-        and dy squares in the y direction, i.e. moves each of the blocks
+        The sync function moves each block to the square of the piece
+        it draws, so the shape shows wherever the engine put the piece.
         
-        :param dx: Move the shape in the x direction
-        :param dy: Move the shape in the y direction
         :return: None
         """
-        for block in self.blocks:
-            block.move(dx, dy)
+        for block, (x, y) in zip(self.blocks, self.piece.cells):
+            if block.x != x or block.y != y:
+                block.move(x - block.x, y - block.y)
 
     def can_move(self, board, dx, dy):
         """
         The can_move function checks if the shape can move dx squares in the x direction
-        and dy squares in the y direction, i.e. check if each of the blocks can move
-        Returns True if all of them can, and False otherwise
+        and dy squares in the y direction.
+        Returns True if all of its blocks can, and False otherwise
         
         :param board: Board object to check if the shape is in a valid position
         :param dx: Move the shape dx squares in the x direction
         :param dy: Move the shape dy squares in the y direction
         :return: True if all the blocks can move and false otherwise
         """
+        piece = self.piece
+        return board.field.fits_piece(piece.kind, piece.rotation, piece.x + dx, piece.y + dy)
 
-        # Computes the new position of each block of the figure,
-        # checks whether each block can move to the new position,
-        # and returns a list of booleans.
-        verified_pos_each_block = [block.can_move(board, block.x + dx, block.y + dy) for block in self.get_blocks()]
-        
-        # Checks if there is any block in the list that cannot be moved to the new position.
-        if False in verified_pos_each_block:
-            return False
-        return True
-    
-    def get_rotation_dir(self):
-        """
-        The get_rotation_dir function returns the current rotation direction.
-        
-        :return: The current rotation direction
-        """
-        return self.rotation_dir
-
-    def can_rotate(self, board):
+    def can_rotate(self, board, kicks=False):
         """
-        The can_rotate function checks if the shape can be rotated.
-            1. Get the rotation direction using the get_rotation_dir method
-            2. Compute the position of each block after rotation and check if
-            the new position is valid
-            3. If any of the blocks cannot be moved to their new position,
-            return False. Otherwise all is good, return True
+        The can_rotate function checks if the shape can be rotated,
+        looking up its next orientation in the engine rotation tables.
         
         :param board: Board object
+        :param kicks: Whether the rotation may kick the shape sideways
         :return: A boolean value
         """
-        # Obtains the rotation direction of the figure and the central block location
-        # that will serve as the pivot point.
-        dir = self.get_rotation_dir()
-        center = self.blocks[1]
-
-        # Calculates the new position of each block in the figure,
-        # checks if each block can move to the new position,
-        # and returns a list of booleans.
-        verified_pos_each_block = []
-        new_pos_each_block = []
-        for block in self.blocks:
-            x = center.x - dir*center.y + dir*block.y
-            y = center.y + dir*center.x - dir*block.x
-            verified_pos_each_block.append(block.can_move(board, x, y))
-            new_pos_each_block.append((x - block.x, y - block.y))
-            self.pos_each_block_rotated = new_pos_each_block
-        
-        # Checks if there is any block in the list that cannot
-        # be moved to the new position.
-        if False in verified_pos_each_block:
-            return False
-        else:
-            return True
-
-    def rotate(self, board):
-        """
-        The rotate function is responsible for rotating the shape.
-        1. Get the rotation direction using the get_rotation_dir method
-        2. Compute the position of each block after rotation
-        3. Move the block to the new position
-
-        :param board: Board object
-        :return: None
-        """
-
-        if self.can_rotate:
-            for i in range(len(self.blocks)):
-                self.blocks[i].move(self.pos_each_block_rotated[i][0],
-                                    self.pos_each_block_rotated[i][1])
- 
-        # Default behavior is that a piece will only shift
-        # rotation direction after a successful rotation. This ensures that 
-        # pieces which switch rotations definitely remain within their 
-        # accepted rotation positions.
-        if self.shift_rotation_dir:
-            self.rotation_dir *= -1
+        return engine.find_rotation(board.field, self.piece, kicks) is not None
 
         
 ############################################################
@@ -214,76 +156,25 @@ class Shape():
 
  
 class I_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x - 2, center.y),
-                  Point(center.x - 1, center.y),
-                  Point(center.x    , center.y),
-                  Point(center.x + 1, center.y)]
-        Shape.__init__(self, coords, '#2962FF')
-        self.shift_rotation_dir = True
-        self.center_block = self.blocks[2]
+    COLOR = '#2962FF'
 
 class J_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x - 1, center.y),
-                  Point(center.x    , center.y),
-                  Point(center.x + 1, center.y),
-                  Point(center.x + 1, center.y + 1)]
-        Shape.__init__(self, coords, '#FFAE00')        
-        self.center_block = self.blocks[1]
+    COLOR = '#FFAE00'
 
 class L_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x - 1, center.y),
-                  Point(center.x    , center.y),
-                  Point(center.x + 1, center.y),
-                  Point(center.x - 1, center.y + 1)]
-        Shape.__init__(self, coords, '#0AD2FF')        
-        self.center_block = self.blocks[1]
+    COLOR = '#0AD2FF'
 
 class O_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x    , center.y),
-                  Point(center.x - 1, center.y),
-                  Point(center.x   , center.y + 1),
-                  Point(center.x - 1, center.y + 1)]
-        Shape.__init__(self, coords, '#FF0800')
-        self.center_block = self.blocks[0]
-
-    def rotate(self, board):
-        # Override Shape's rotate method since O_Shape does not rotate
-        return 
+    COLOR = '#FF0800'
 
 class S_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x    , center.y),
-                  Point(center.x    , center.y + 1),
-                  Point(center.x + 1, center.y),
-                  Point(center.x - 1, center.y + 1)]
-        Shape.__init__(self, coords, '#B4E600')
-        self.center_block = self.blocks[0]
-        self.shift_rotation_dir = True
-        self.rotation_dir = -1
+    COLOR = '#B4E600'
 
 class T_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x - 1, center.y),
-                  Point(center.x    , center.y),
-                  Point(center.x + 1, center.y),
-                  Point(center.x    , center.y + 1)]
-        Shape.__init__(self, coords, '#FEFE00')
-        self.center_block = self.blocks[1]
+    COLOR = '#FEFE00'
 
 class Z_shape(Shape):
-    def __init__(self, center):
-        coords = [Point(center.x - 1, center.y),
-                  Point(center.x    , center.y), 
-                  Point(center.x    , center.y + 1),
-                  Point(center.x + 1, center.y + 1)]
-        Shape.__init__(self, coords, '#9500FF')
-        self.center_block = self.blocks[1]
-        self.shift_rotation_dir = True
-        self.rotation_dir = -1      
+    COLOR = '#9500FF'
 
 
 ############################################################
@@ -293,16 +184,17 @@ class Z_shape(Shape):
 class Board():
     """ 
     Board class:
-    It represents the Tetris board
+    It draws the Tetris board
 
     :attr width: type:int - width of the board in squares
     :attr height: type:int - height of the board in squares
     :attr canvas: type:CanvasFrame - where the pieces will be drawn
-    :attr grid: type:Dictionary - keeps track of the current state of
-                the board; stores the blocks for a given position
+    :attr field: type:Playfield - the engine state of the board
+    :attr grid: type:Dictionary - stores the drawn block for each
+                locked (x, y) position
     """
     
-    def __init__(self, win, width, height):
+    def __init__(self, win, width, height, field=None):
         self.width = width
         self.height = height
 
@@ -310,11 +202,30 @@ class Board():
         self.canvas = CanvasFrame(win, self.width * Block.BLOCK_SIZE + 3,
                                   self.height * Block.BLOCK_SIZE + 3)
         self.canvas.setBackground('gray12')
+        # blocks of locked pieces and cleared rows are recycled, not deleted
+        self.canvas.setPooling(True)
+        # changes are sent to Tk once per frame, see Tetris.event_switcher
+        self.canvas.setDeferred(True)
+
+        # the engine decides what is on the board, we only draw it
+        if field is None:
+            field = engine.Playfield(width, height)
+        self.field = field
 
         # create an empty dictionary
         # currently we have no shapes on the board
         self.grid = {}
         
+    @property
+    def zobrist(self):
+        """
+        The 64-bit Zobrist hash of the locked blocks, for caches,
+        deduplication and replay checks
+        
+        :return: A 64-bit int
+        """
+        return self.field.zobrist
+
     def draw_shape(self, shape):
         """
         The draw_shape function draws the shape on the board if there is space for it
@@ -323,116 +234,75 @@ class Board():
         :param shape: Shape object
         :return: Bool
         """
-        if shape.can_move(self, 0, 0):
+        if self.field.fits(shape.piece.cells):
             shape.draw(self.canvas)
             return True
         return False
 
     def can_move(self, x, y):
         """
-        1. check if it is ok to move to square x,y
-        if the position is outside of the board boundaries, can't move there
-        return False
-        2. if there is already a block at that postion, can't move there
-        return False
-        3. otherwise return True        
+        The can_move function checks if it is ok to move to square x,y,
+        i.e. it is inside the board and there is no block there
         
         :param x: x position
         :param y: y position
         :return: Bool
         """
-        # checks if position (x,y) is within the board
-        if x >= self.width or y >= self.height:
-            return False
-        elif x < 0 or y < 0:
-            return False
-        
-        # checks if there is no other block at position (x,y)
-        if (x,y) in self.grid:
-            return False
-  
-        return True
+        return self.field.is_free(x, y)
 
-    def add_shape(self, shape):
+    def add_shape(self, shape, rows):
         """
-        The add_shape function adds a shape to the grid, i.e.
-        adds each block to the grid using its (x, y) coordinates as a dictionary key
+        The add_shape function adds the blocks of a locked shape to the grid,
+        using its (x, y) coordinates as a dictionary key, and then removes
+        the rows the engine cleared
         
         :param shape: Shape object
+        :param rows: The rows cleared by locking the shape, top to bottom
         :return: None
         """
         blocks_list = shape.get_blocks()
         for block in blocks_list:
             self.grid[(block.x, block.y)] = block
         
-        # Checks and removes any fully filled row.
-        self.remove_complete_rows()
-
-    def delete_row(self, y):
-        """
-        The delete_row function takes in a y value and removes all blocks in row y.
-        Removes blocks from the grid and erases it from the screen.
-        
-        :param y: Determine which row to delete
-        :return: None
-        """
-        listof_blocks = [item[1] for item in self.grid.items() if item[0][1] == y]
-        listof_pos = [item[0] for item in self.grid.items() if item[0][1] == y]
+        # Erases the rows that were completed by the shape.
+        self.remove_complete_rows(rows)
 
-        for block in listof_blocks: block.undraw()
-        for pos in listof_pos: self.grid.pop(pos)
-    
     def is_row_complete(self, y):
         """
-        The is_row_complete function checks if a row is complete.
-        It does this by checking the number of blocks in the grid that are in a given row,
+        The is_row_complete function checks if a row is complete,
         if there is one square that is not occupied, return False
         otherwise return True
         
         :param y: The number of the row to be checked
         :return: Bool
         """
-        count = 0
-        for pos in self.grid:
-            if pos[1] == y:
-                count += 1
-        return count == self.width
+        return self.field.is_row_complete(y)
     
-    def move_down_rows(self, y_start):
-        """
-        for each row from y_start to the top
-        for each column check if there is a block in the grid
-        if there is, remove it from the grid
-        and move the block object down on the screen
-        and then place it back in the grid in the new position
-        
-        :param y_start: Specify the row from which start to move down all the blocks
-        :return: A dictionary
-        """
-        # Computes all positions (x, y) that are above the row y_start.
-        pos_above_y = [(x,y) for x in range(self.width) for y in range(y_start, -1, -1)]
-
-        # Moves down one position each block in the self.grid list
-        # that is above the row y_start
-        for pos in pos_above_y:
-            if pos in self.grid:
-                self.grid[pos].move(0,1)
-                self.grid[(pos[0],pos[1]+1)] = self.grid[pos]
-                self.grid.pop(pos)
-
-    def remove_complete_rows(self):
+    def remove_complete_rows(self, rows):
         """
-        The remove_complete_rows function removes all the complete rows.
-            1. for each row, y, 
-            2. check if the row is complete
-            if it is, delete the row move all rows down starting at row y - 1
+        The remove_complete_rows function erases the given rows in one pass.
+            1. erase every block in the removed rows
+            2. compute how far each remaining row falls
+            3. move each block straight to its final square,
+            so it is moved on the canvas only once
         
+        :param rows: The rows to remove, top to bottom
         :return: None
         """
-        for row in range(self.height):
-            if self.is_row_complete(row):
-                self.delete_row(row)
-                self.move_down_rows(row)
+        if not rows:
+            return
+
+        drops = engine.drop_distances(rows, self.height)
+        grid = {}
+        for (x, y), block in self.grid.items():
+            if drops[y] is None:
+                block.undraw()
+            elif drops[y]:
+                block.move(0, drops[y])
+                grid[(x, y + drops[y])] = block
+            else:
+                grid[(x, y)] = block
+        self.grid = grid
 
     def game_over(self):
         """
@@ -455,6 +325,105 @@ class Board():
         text.draw(self.canvas)
 
 
+############################################################
+# GRID RENDERER CLASS
+############################################################
+
+class GridRenderer():
+    """
+    GridRenderer class:
+    Draws the board with a fixed pool of one block per square. The blocks
+    are created once and only recolored: every frame the wanted colors
+    are compared with the ones on the canvas and only the squares that
+    changed are sent to Tk, in a single flush.
+
+    :attr board: type: Board - the board whose canvas holds the pool
+    :attr items: type: Dictionary - the pooled block of each (x, y)
+    :attr shown: type: Dictionary - the color each square has on the canvas
+    :attr locked: type: Dictionary - the color of each locked (x, y)
+    :attr piece: type: Piece - the falling piece, None if not shown
+    :attr dirty: type: Boolean - whether something changed since the last flush
+    """
+
+    EMPTY = 'gray12'
+
+    def __init__(self, board):
+        self.board = board
+        self.items = {}
+        self.shown = {}
+        for y in range(board.height):
+            for x in range(board.width):
+                block = Block(Point(x, y), self.EMPTY)
+                block.setOutline(self.EMPTY)
+                block.draw(board.canvas)
+                self.items[(x, y)] = block
+                self.shown[(x, y)] = self.EMPTY
+
+        self.locked = {}
+        self.piece = None
+        self.piece_color = None
+        self.dirty = False
+
+    def show_piece(self, piece, color):
+        """
+        The show_piece function sets the falling piece to draw.
+        
+        :param piece: Piece object, or None to hide it
+        :param color: The color of its blocks
+        :return: None
+        """
+        self.piece = piece
+        self.piece_color = color
+        self.dirty = True
+
+    def lock(self, cells, color, rows):
+        """
+        The lock function adds a locked piece to the board colors and
+        moves the colors down the way the engine removed the rows.
+        
+        :param cells: The squares of the locked piece
+        :param color: The color of its blocks
+        :param rows: The rows cleared by locking it, top to bottom
+        :return: None
+        """
+        for pos in cells:
+            self.locked[pos] = color
+        if rows:
+            drops = engine.drop_distances(rows, self.board.height)
+            self.locked = {(x, y + drops[y]): c
+                           for (x, y), c in self.locked.items()
+                           if drops[y] is not None}
+        self.dirty = True
+
+    def flush(self):
+        """
+        The flush function recolors the squares whose color changed
+        since the last flush.
+        
+        :return: The number of squares recolored
+        """
+        if not self.dirty:
+            return 0
+
+        frame = self.locked
+        if self.piece is not None:
+            frame = dict(frame)
+            for pos in self.piece.cells:
+                frame[pos] = self.piece_color
+
+        changed = 0
+        shown = self.shown
+        for pos, block in self.items.items():
+            color = frame.get(pos, self.EMPTY)
+            if shown[pos] != color:
+                outline = self.EMPTY if color == self.EMPTY else 'black'
+                block.configure(fill=color, outline=outline)
+                shown[pos] = color
+                changed += 1
+        self.dirty = False
+        return changed
+
+
 ############################################################
 # TETRIS CLASS
 ############################################################
@@ -463,225 +432,577 @@ class Board():
 class Tetris():
     """
     Tetris class:
-    Controls the game play
+    Controls the game play. The rules run in an engine GameState,
+    this class feeds it the input and draws the result
     
     :attr SHAPES: type: list (list of Shape classes)
-    :attr DIRECTION: type: dictionary - converts string direction to (dx, dy)
     :attr BOARD_WIDTH: type:int - the width of the board
     :attr BOARD_HEIGHT: type:int - the height of the board
+    :attr FIELD_CLASS: type:class - the engine backend for the board
+    :attr WALL_KICKS: type:Boolean - whether rotations may kick the shape sideways
+    :attr POOLED_RENDER: type:Boolean - draw with a GridRenderer instead of
+                         one Shape of blocks per piece
+    :attr START_LEVEL: type:int - level of a new game, see engine.GRAVITY
+    :attr RANDOMIZER: type:class - the engine Randomizer picking the pieces
+    :attr SEED: type:int - seed of the pieces, None for a different game each time
+    :attr REPLAY_FILE: type:str - file the game is recorded to, None to not record it
+    :attr TICK_RATE: type:int - logical ticks per second of the game loop
+    :attr FRAME_RATE: type:int - frames drawn per second at most
+    :attr KEY_ACTIONS: type: dictionary - the engine action of each key
+    :attr JOY_ACTIONS: type: dictionary - the engine action of each joystick button
+    :attr DAS: type:int - frames a direction is held before it repeats, see engine.AutoRepeat
+    :attr ARR: type:int - frames between the repeats of a held direction
+    :attr SOFT_DROP: type:int - frames between the moves of a held 'Down'
+    :attr state: type:GameState - the rules of the game
     :attr board: type:Board - the tetris board
     :attr win: type:Window - the window for the tetris game
     :attr delay: type:int - the speed in milliseconds for moving the shapes
     :attr current_shapes: type: Shape - the current moving shape on the board
+    :attr loop: type:FixedTimestep - runs input, gravity and rendering
+    :attr repeat: type:AutoRepeat - the held keys and buttons
     """
     
     SHAPES = [I_shape, J_shape, L_shape, O_shape, S_shape, T_shape, Z_shape]
-    DIRECTION = {'Left':(-1, 0), 'Right':(1, 0), 'Down':(0, 1), 3:(-1, 0), 4:(1, 0), 2:(0, 1)}
     BOARD_WIDTH = 10
     BOARD_HEIGHT = 20
-    JOY_TURBO = 5   #  Values accepted within the range of 0 to 10.
+    FIELD_CLASS = engine.BitPlayfield
+    WALL_KICKS = False
+    POOLED_RENDER = True
+    START_LEVEL = 2     #  About the 0.8 s per row the game always had, 10 lines to level 3
+    RANDOMIZER = engine.UniformRandomizer
+    SEED = None
+    REPLAY_FILE = None
+    TICK_RATE = 100
+    FRAME_RATE = 60
+    KEY_ACTIONS = {'Left': engine.LEFT, 'Right': engine.RIGHT, 'Down': engine.DOWN,
+                   'Up': engine.ROTATE, 'space': engine.DROP}
+    #  The pad (3, 4, 2), X (15) and A (13), see joydev
+    JOY_ACTIONS = {3: engine.LEFT, 4: engine.RIGHT, 2: engine.DOWN,
+                   15: engine.ROTATE, 13: engine.DROP}
+    DAS = engine.DAS
+    ARR = engine.ARR
+    SOFT_DROP = engine.SOFT_DROP
+    JOY_POLL_RATE = 500     #  Hz, see joypoll
+    JOYSTICK = None     #  A joydev device to use instead of the one detected.
+    LATENCY_TRACE = False   #  Trace the latency of the inputs, see latency.
     
     def __init__(self, win):
-        self.board = Board(win, self.BOARD_WIDTH, self.BOARD_HEIGHT)
+        # a seed is always picked, so that the game can be replayed
+        self.seed = self.SEED if self.SEED is not None else random.randrange(1 << 32)
+        self.state = engine.GameState(self.BOARD_WIDTH, self.BOARD_HEIGHT,
+                                      field_class=self.FIELD_CLASS,
+                                      kicks=self.WALL_KICKS, level=self.START_LEVEL,
+                                      randomizer=self.RANDOMIZER(self.seed))
+        self.recorder = None
+        if self.REPLAY_FILE is not None:
+            header = replay.ReplayHeader(self.seed, self.BOARD_WIDTH, self.BOARD_HEIGHT,
+                                         self.START_LEVEL,
+                                         replay.randomizer_name(self.RANDOMIZER),
+                                         self.WALL_KICKS, self.TICK_RATE)
+            self.recorder = replay.Recorder(open(self.REPLAY_FILE, 'wb'), header)
+        self.tracer = latency.LatencyTracer() if self.LATENCY_TRACE else None
+        self.board = Board(win, self.BOARD_WIDTH, self.BOARD_HEIGHT, self.state.board)
         self.win = win
-        self.level_speed = 0.8
-        self.list_pressed_btn = {}
-        self.count = 50 # Enables the animation of block falling.
+
+        # held keys and buttons repeat on the ticks of the game, not the OS
+        self.repeat = engine.AutoRepeat(self.DAS, self.ARR, self.SOFT_DROP)
+        self.key_releases = {}
 
         # sets up the keyboard events
         # when a key is called the method key_pressed will be called
         self.win.bind_all('<Key>', self.key_pressed)
+        self.win.bind_all('<KeyRelease>', self.key_released)
+        self.win.bind_all('<FocusOut>', self.focus_lost)
+        # the recording is finished when the window is closed mid-game
+        self.win.protocol("WM_DELETE_WINDOW", self.window_closed)
+
+        if self.POOLED_RENDER:
+            # one block per square, recolored once per frame
+            self.renderer = GridRenderer(self.board)
+            self.current_shape = None
+            self.update_grid()
+            self.renderer.flush()
+        else:
+            self.renderer = None
 
-        # set the current shape to a random new shape
-        self.current_shape = self.create_new_shape()
+            # set the current shape to the first piece of the game
+            self.current_shape = self.create_new_shape()
 
-        # Draw the current_shape on the board (take a look at the
-        # draw_shape method in the Board class)
-        self.board.draw_shape(self.current_shape)
+            # Draw the current_shape on the board (take a look at the
+            # draw_shape method in the Board class)
+            self.board.draw_shape(self.current_shape)
         
         # Allows to capture input from an Xbox joystick
         self.joystick = self.joy_detect()
+        self.joy_poller = None
+        if self.joystick != False:
+            # read by a thread of its own, the events are handled every tick
+            self.joy_poller = joypoll.JoystickPoller(self.joystick, self.JOY_POLL_RATE)
+            self.joy_poller.start()
+
+        # The AI plays instead of the player while autoplay is on ('a' toggles it)
+        self.autoplay = False
+        # the placements already searched are kept, a replanned piece and
+        # a board seen again are looked up instead of searched
+        self.bot = ai.PlacementAI(kicks=self.WALL_KICKS, cache=ai.TranspositionCache())
+
+        # The game runs in fixed ticks measured on a monotonic clock:
+        # input is polled and gravity applied every tick, and frames are
+        # drawn at their own rate
+        self.loop = FixedTimestep(self.TICK_RATE, self.FRAME_RATE)
+        self.loop.every(1, self.poll_input)
+        self.loop.every(1, self.animate_shape)
+        self.loop.on_render(self.render)
 
         # animate the shape!
         self.event_switcher()
 
     def create_new_shape(self):
         """
-        The create_new_shape function creates a random new shape that is centered at the top of the board
-        and returns the shape.
+        The create_new_shape function creates the shape that draws
+        the current piece of the game state and returns the shape.
         
         :return: Shape object
         """
-        # Randomly selects a tetromino from the self.SHAPES list.
-        random_tetrominoe = self.SHAPES[random.randint(0,6)]
+        shape_class = self.SHAPES[engine.SHAPES.index(self.state.piece.kind)]
+        return shape_class(self.state.piece)
+
+    def update_shape(self):
+        """
+        The update_shape function brings the drawing up to date with the game state.
+        It moves the blocks of current_shape to where the engine put its piece.
+        If the piece was locked,
+        1. add the current shape to the board, erasing the cleared rows
+        2. create the shape for the new piece and set current_shape attribute
+        3. If the shape cannot be drawn on the board, display a game over message
+        With POOLED_RENDER the GridRenderer is updated instead.
         
-        # Returns the figure positioned centered at the top of the screen.
-        return random_tetrominoe(Point(self.BOARD_WIDTH/2 , 0))
+        :return: None
+        """
+        if self.renderer is not None:
+            self.update_grid()
+            return
+
+        self.current_shape.sync()
+        if self.current_shape.piece is self.state.piece:
+            return
+
+        self.board.add_shape(self.current_shape, self.state.last_cleared)
+        self.current_shape = self.create_new_shape()
+        if not self.board.draw_shape(self.current_shape):
+            self.game_over()
     
+    def update_grid(self):
+        """
+        The update_grid function tells the GridRenderer what changed in the
+        game state; the canvas itself is only updated by its flush.
+        If the piece was locked, its colors are added to the board and the
+        new piece is shown, or a game over message if it does not fit.
+        
+        :return: None
+        """
+        renderer = self.renderer
+        piece = self.state.piece
+        if renderer.piece is piece:
+            renderer.dirty = True
+            return
+        if self.state.over and renderer.piece is None:
+            # the game over message is already up
+            return
+
+        if renderer.piece is not None:
+            renderer.lock(renderer.piece.cells, renderer.piece_color,
+                          self.state.last_cleared)
+        if self.state.over:
+            renderer.show_piece(None, None)
+            self.game_over()
+        else:
+            shape_class = self.SHAPES[engine.SHAPES.index(piece.kind)]
+            renderer.show_piece(piece, shape_class.COLOR)
+
     def animate_shape(self):
         """
-        The animate_shape function is responsible for moving the shape down at equal intervals
-        specified by the delay attribute.
+        The animate_shape function is responsible for moving the shape down
+        at the gravity of the current level (see engine.GRAVITY). It runs
+        every tick; the engine adds up the fractions of a row and moves the
+        shape by all the rows due at once, so fast levels do not need
+        faster ticks.
         
         
         :return: None
         """        
-        self.do_move(self.DIRECTION['Down'])
+        piece = self.state.piece
+        frames = engine.FRAME_RATE / self.loop.tick_rate
+        fell = self.state.apply_gravity(frames)
+        if self.recorder is not None:
+            # counted first: a lock that ends the game belongs to this tick
+            self.recorder.tick += 1
+        if fell or self.state.piece is not piece:
+            self.update_shape()
+
+    def game_over(self):
+        """
+        The game_over function displays the game over message and ends
+        the recording of the game.
+        
+        :return: None
+        """
+        self.board.game_over()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def close(self):
+        """
+        The close function ends the game for good: it finishes the
+        recording, if it is not finished yet, and stops the joystick
+        poller. It may be called more than once.
+        
+        :return: None
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.joy_poller is not None:
+            self.joy_poller.stop()
+
+    def window_closed(self):
+        """
+        The window_closed function is called when the window is closed,
+        it closes the game and then the window.
+        
+        :return: None
+        """
+        self.close()
+        self.win.destroy()
     
     def do_move(self, direction):
         """
-        Move the current shape in the direction specified by the parameter:
-        First check if the shape can move. If it can, move it and return True
-        Otherwise if the direction we tried to move was 'Down',
-        1. add the current shape to the board
-        2. remove the completed rows if any 
-        3. create a new random shape and set current_shape attribute
-        4. If the shape cannot be drawn on the board, display a game over message
+        Move the current shape in the direction specified by the parameter.
+        If it cannot move 'Down', the engine locks it, removes the completed
+        rows and spawns a new piece
         
-        :param direction: type:string - Move the shape in a specific direction
+        :param direction: type:tuple - (dx, dy) to move the shape
         :return: Bool
         """
+        if self.recorder is not None:
+            self.recorder.action(engine.MOVE_ACTIONS[direction])
         dx, dy = direction
-
-        if self.current_shape.can_move(self.board, dx, dy):
-            self.current_shape.move(dx, dy)
-            return True
-        elif direction == (0, 1):
-            # Adds all the blocks from current_shape to the board.
-            self.board.add_shape(self.current_shape)
-
-            # set the current shape to a random new shape
-            self.current_shape = self.create_new_shape()
-
-            # Draw the current_shape on the board (take a look at the
-            # draw_shape method in the Board class)
-            if not self.board.draw_shape(self.current_shape):
-                self.board.game_over()
-
-        return False
+        moved = self.state.move(dx, dy)
+        self.update_shape()
+        if self.tracer is not None:
+            self.tracer.apply()
+        return moved
 
     def do_rotate(self):
         """
-        The do_rotate function checks if the current_shape can be rotated and rotates it if it can.
+        The do_rotate function rotates the current_shape if it can,
+        kicking it away from walls and blocks when WALL_KICKS is set.
+        
         
+        :return: None
+        """
+        if self.recorder is not None:
+            self.recorder.action(engine.ROTATE)
+        self.state.rotate()
+        self.update_shape()
+        if self.tracer is not None:
+            self.tracer.apply()
+
+    def do_drop(self):
+        """
+        The do_drop function moves the current_shape down until
+        it is added to the board.
         
         :return: None
         """
-        if self.current_shape.can_rotate(self.board):
-            self.current_shape.rotate(self.board)
+        if self.recorder is not None:
+            self.recorder.action(engine.DROP)
+        self.state.drop()
+        self.update_shape()
+        if self.tracer is not None:
+            self.tracer.apply()
     
     def key_pressed(self, event):
         """
         The key_pressed function is called when a key is pressed on the keyboard.
         If the user presses the arrow keys 'Left', 'Right' or 'Down', 
-        the current_shape will move in the appropriate direction. If they press 
+        the current_shape will move in the appropriate direction, and keeps
+        moving while the key is held. If they press 
         the space bar, it will move down until it can no longer move and is added to 
-        the board. If they press up, it should rotate.
+        the board. If they press up, it should rotate. The 'a' key turns autoplay on and off.
+        The repeats of the OS for a held key are ignored.
         
         :param event: Get the key that was pressed
         :return: None
         """
         key = event.keysym
-        if key in self.DIRECTION:
-            self.do_move(self.DIRECTION[key])
-        elif key == "Up":
-            self.do_rotate()
-        elif key == "space":
-            can_move = True
-            while can_move:
-                can_move = self.do_move(self.DIRECTION["Down"])
+        action = self.KEY_ACTIONS.get(key)
+        if action is None:
+            if key == "a":
+                self.autoplay = not self.autoplay
+            return
+        if key in self.key_releases:
+            time = self.key_releases.pop(key)
+            if time is not None and time == getattr(event, 'time', None):
+                # X11 repeats a held key as a release and a press
+                # sent at the same time: the key is still held
+                return
+            self.repeat.release(action)
+        when = None
+        if self.tracer is not None and getattr(event, 'time', 0):
+            # the arrival is when Tk read the key, not when it got here
+            when = self.tracer.event_time(event.time)
+        self.input_pressed(action, when)
+
+    def key_released(self, event):
+        """
+        The key_released function is called when a key is released. The
+        release is applied on the next tick, by poll_input(), so that the
+        release and press X11 sends for a held key can be told from a
+        new press.
+        
+        :param event: Get the key that was released
+        :return: None
+        """
+        if event.keysym in self.KEY_ACTIONS:
+            self.key_releases[event.keysym] = getattr(event, 'time', None)
+
+    def focus_lost(self, event):
+        """
+        The focus_lost function releases every key and button when the
+        window loses the focus, as their releases would not be seen.
+        
+        :param event: The Tk event
+        :return: None
+        """
+        self.key_releases.clear()
+        self.repeat.release_all()
 
-    def joy_btn_pressed(self, event, value = 0):
+    def input_pressed(self, action, time=None):
         """
-        The joy_btn_pressed function is called when a button on the joystick is pressed.
-        The function checks if the button pressed corresponds to one of the directions in self.DIRECTION, and if so, calls do_move with that direction as an argument.
-        If it's not a direction, then it checks for other buttons: 
-            If event == 15 (the 'A' button), then call do_rotate() to rotate the piece clockwise 90 degrees; 
-            If event == 13 (the 'B' button), then keep calling do_move(self.DIRECTION[2]) until can_move returns False
+        The input_pressed function applies the action of a key or button
+        that went down, unless it was already held. Held, the moves repeat
+        on their own, see engine.AutoRepeat.
         
-        :param event: Specifies which event the joystick is reporting.
-        :param value: Determine the value asociate to the given event
+        :param action: One of engine.ACTIONS
+        :param time: When the input arrived, for the latency tracer; now if None
         :return: None
         """
+        if not self.repeat.press(action):
+            return
+        if self.tracer is not None:
+            self.tracer.arrive(time)
+        self.do_action(action)
+
+    def do_action(self, action):
+        """
+        The do_action function applies an engine action the same way
+        the matching key would.
         
-        if event in self.DIRECTION:
-            self.do_move(self.DIRECTION[event])
-        elif event == 15:
+        :param action: One of engine.ACTIONS
+        :return: Bool - False for a move that was blocked
+        """
+        if action in engine.MOVES:
+            return self.do_move(engine.MOVES[action])
+        elif action == engine.ROTATE:
             self.do_rotate()
-        elif event == 13:
-            can_move = True
-            while can_move:
-                can_move = self.do_move(self.DIRECTION[2])
+        elif action == engine.DROP:
+            self.do_drop()
+        return True
 
-    def joy_capture(self, joy):
+    def ai_capture(self):
         """
-        The joy_capture function allows to capture events from xbox joysticks.
-        It requires as an argument an XInputJoystick object.
-        When a button on the joystick is pressed, it executes the function on_button().
-        When one of the axes of the joystick moves, it executes the function on_axis()
+        The ai_capture function lets the AI play one action, it is the
+        autoplay counterpart of key_pressed and joy_capture.
         
-        :param joy: XInputjoystick object
         :return: None
         """
+        self.do_action(self.bot(self.state))
 
-        @joy.event
-        def on_button(button, pressed):
-            if pressed:
-                self.joy_btn_pressed(button)
-                self.list_pressed_btn[button] = 0
-            else:
-                if button in self.list_pressed_btn:
-                    self.list_pressed_btn.pop(button)
-
-        @joy.event
-        def on_axis(axis, value):
-            self.joy_btn_pressed(axis, value)
+    def joy_event(self, time, kind, code, value):
+        """
+        The joy_event function handles one event of the joystick queue.
+        The buttons of JOY_ACTIONS are pressed and released like keys,
+        the axes are not used.
         
+        :param time: When the poller read the event, in seconds
+        :param kind: joypoll.BUTTON or joypoll.AXIS
+        :param code: The button number or the axis name
+        :param value: Whether the button is pressed, or the axis value
+        :return: None
+        """
+        if kind != joypoll.BUTTON or code not in self.JOY_ACTIONS:
+            return
+        if value:
+            self.input_pressed(self.JOY_ACTIONS[code], time)
+        else:
+            self.repeat.release(self.JOY_ACTIONS[code])
+
+    def joy_capture(self, poller):
+        """
+        The joy_capture function handles the events of xbox joysticks.
+        It requires as an argument the JoystickPoller reading the joystick:
+        the events it queued since the last tick are handled in order
+        by joy_event().
         
-        joy.dispatch_events()
+        :param poller: JoystickPoller object
+        :return: None
+        """
+        poller.drain(self.joy_event)
 
-        # Enables turbo action performed by the joystick when holding down a button.
-        if self.list_pressed_btn != {}:
-            print(self.list_pressed_btn)
-            for btn in self.list_pressed_btn:
-                if self.list_pressed_btn[btn] >= 10:
-                    self.joy_btn_pressed(btn)
-                    self.list_pressed_btn[btn] = 10 - self.JOY_TURBO
-                else:
-                    self.list_pressed_btn[btn] += 1
+    def joy_lost(self, error):
+        """
+        The joy_lost function reports why the joystick poller stopped
+        (e.g. the joystick was disconnected) and goes back to the
+        keyboard: the buttons held are released and the poller dropped.
+        
+        :param error: The exception that stopped the poller
+        :return: None
+        """
+        print("joystick lost (%s), use the keyboard" % error, file=sys.stderr)
+        for action in self.JOY_ACTIONS.values():
+            self.repeat.release(action)
+        self.joy_poller.stop()
+        self.joy_poller = None
 
     def joy_detect(self):
         """
-        The joy_detect function detects the connection of xbox joysticks connected and returns an XInputJoystick object
-        if there is any
+        The joy_detect function detects the connection of xbox joysticks connected and returns a joydev
+        device (XInputJoystick on Windows, LinuxJoystick on Linux) if there is any, or the JOYSTICK
+        given to the class
         
         :return: Joystick object or False
         """
-        joysticks = joy.XInputJoystick.enumerate_devices()
-        device_numbers = list(map(joy.attrgetter('device_number'), joysticks))
+        if self.JOYSTICK is not None:
+            return self.JOYSTICK
+        joysticks = joydev.enumerate_devices()
 
         if not joysticks:
             return False
 
         return joysticks[0]
 
+    def poll_input(self):
+        """
+        The poll_input function runs once per tick and reads the polled
+        inputs: joy_capture() and ai_capture(), or joy_lost() once the
+        joystick poller has stopped. The keyboard calls key_pressed by
+        itself, its releases are applied here. Then the held keys and
+        buttons repeat.
+        
+        :return: None
+        """
+        if self.key_releases:
+            for key in self.key_releases:
+                self.repeat.release(self.KEY_ACTIONS[key])
+            self.key_releases.clear()
+
+        if self.joy_poller is not None:
+            self.joy_capture(self.joy_poller)
+            if self.joy_poller.error is not None:
+                self.joy_lost(self.joy_poller.error)
+
+        self.repeat.update(engine.FRAME_RATE / self.loop.tick_rate, self.do_action)
+
+        if self.autoplay:
+            self.ai_capture()
+
+    def render(self):
+        """
+        The render function draws everything that changed since the
+        last frame at once.
+        
+        :return: None
+        """
+        if self.renderer is not None:
+            self.renderer.flush()
+        self.board.canvas.commit()
+        if self.tracer is not None:
+            self.tracer.flush()
+
     def event_switcher(self):
         """
         The event_switcher function is a subloop within the mainloop,
-        it allows events to be triggered such as animate_shape() and 
-        joy_capture()
+        it runs the ticks of the game loop that are due, which trigger
+        poll_input(), animate_shape() and render(), then waits for the
+        next tick
         
         :return: None
         """
-        if self.joystick != False:
-            self.joy_capture(self.joystick)
+        self.loop.advance()
+        self.win.after(self.loop.delay(), self.event_switcher)
+
+
+############################################################
+# REPLAYTETRIS CLASS
+############################################################
+
+class ReplayTetris(Tetris):
+    """
+    ReplayTetris class:
+    Shows a recorded game at its real speed. The game is built from the
+    settings of the replay and the recorded actions are applied on their
+    ticks instead of reading the keyboard, the joystick or the AI.
+    
+    :attr player: type: Player - reads the replay
+    :attr ticks: type: int - gravity ticks applied so far
+    """
+
+    def __init__(self, win, path):
+        self.player = replay.Player(open(path, 'rb'))
+        header = self.player.header
+        self.BOARD_WIDTH = header.width
+        self.BOARD_HEIGHT = header.height
+        self.START_LEVEL = header.level
+        self.RANDOMIZER = engine.RANDOMIZERS[header.randomizer]
+        self.SEED = header.seed
+        self.WALL_KICKS = header.kicks
+        self.TICK_RATE = header.tick_rate
+        self.REPLAY_FILE = None
+
+        self.records = iter(self.player)
+        self.next_record = next(self.records, None)
+        self.ticks = 0
+        Tetris.__init__(self, win)
+
+    def joy_detect(self):
+        """
+        The joy_detect function finds no joystick, the replay plays alone.
+        
+        :return: False
+        """
+        return False
+
+    def key_pressed(self, event):
+        """
+        The key_pressed function ignores the keyboard, the replay plays alone.
+        
+        :param event: Get the key that was pressed
+        :return: None
+        """
+        pass
+
+    def poll_input(self):
+        """
+        The poll_input function applies the recorded actions of the
+        current tick.
         
-        if self.count >= 100 * self.level_speed: 
-            self.animate_shape()
-            self.count = 0
-        else: self.count += 1
+        :return: None
+        """
+        record = self.next_record
+        while record is not None and record[0] <= self.ticks:
+            self.do_action(record[1])
+            record = next(self.records, None)
+        self.next_record = record
 
-        self.win.after(10, self.event_switcher)
+    def animate_shape(self):
+        """
+        The animate_shape function applies the gravity of one tick and
+        counts it.
+        
+        :return: None
+        """
+        Tetris.animate_shape(self)
+        self.ticks += 1
 
 
 ################################################################
@@ -689,7 +1010,24 @@ class Tetris():
 ################################################################
 
 
-win = Window("Tetris")
-game = Tetris(win)
-win.mainloop()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play Tetris.")
+    # python tetris.py game.replay - watch a recorded game
+    parser.add_argument('replay', nargs='?', help="watch this recorded game")
+    parser.add_argument('--record', metavar='FILE', help="record the game to this file")
+    parser.add_argument('--latency', action='store_true',
+                        help="print the input latency on exit")
+    args = parser.parse_args()
+
+    Tetris.REPLAY_FILE = args.record
+    Tetris.LATENCY_TRACE = args.latency
+    win = Window("Tetris")
+    if args.replay:
+        game = ReplayTetris(win, args.replay)
+    else:
+        game = Tetris(win)
+    win.mainloop()
+    game.close()
+    if game.tracer is not None:
+        print(game.tracer.format_report())
 
@@ -0,0 +1,163 @@
+# Gym-style environments for training agents on the headless engine.
+#
+# Actions are the engine ones, with the same meaning as the keys in
+# Tetris.key_pressed:
+#     engine.NOOP    do nothing
+#     engine.LEFT    'Left'  - do_move(MOVES[LEFT])
+#     engine.RIGHT   'Right' - do_move(MOVES[RIGHT])
+#     engine.DOWN    'Down'  - do_move(MOVES[DOWN]), locks the piece when blocked
+#     engine.ROTATE  'Up'    - do_rotate
+#     engine.DROP    'space' - hard drop until the piece is added to the board
+#
+# Observations are (height, width) uint8 arrays holding EMPTY, LOCKED or
+# PIECE for each square. The reward is the number of rows cleared.
+#
+# Game i of a VecTetrisEnv seeded with s gets the pieces of a TetrisEnv
+# seeded with s + i, so a batch of games can be replayed one at a time.
+
+import random
+
+import numpy as np
+
+import engine
+from batch_tetris import BatchTetris
+
+EMPTY = 0
+LOCKED = 1
+PIECE = 2
+
+
+############################################################
+# TETRISENV CLASS
+############################################################
+
+class TetrisEnv():
+    """
+    TetrisEnv class:
+    One game with a reset()/step(action) interface
+
+    :attr width: type: int - width of the board in squares
+    :attr height: type: int - height of the board in squares
+    :attr kicks: type: Boolean - whether rotations may kick the piece sideways
+    :attr state: type: GameState - the current game, on a BitPlayfield
+                 that observe() reads the rows of
+    :attr num_actions: type: int - number of valid actions
+    """
+
+    num_actions = len(engine.ACTIONS)
+
+    def __init__(self, width=10, height=20, seed=None, kicks=False):
+        self.width = width
+        self.height = height
+        self.kicks = kicks
+        self.rng = random.Random(seed)
+        self.state = None
+        self.columns = np.arange(width)
+
+    def reset(self, seed=None):
+        """
+        The reset function starts a new game.
+
+        :param seed: Reseeds the piece generator if given
+        :return: The first observation
+        """
+        if seed is not None:
+            self.rng.seed(seed)
+        self.state = engine.GameState(self.width, self.height, rng=self.rng,
+                                      field_class=engine.BitPlayfield, kicks=self.kicks)
+        return self.observe()
+
+    def step(self, action):
+        """
+        The step function applies one action to the game.
+
+        :param action: One of engine.ACTIONS
+        :return: (observation, reward, done, info)
+        """
+        state = self.state
+        lines = state.lines
+        state.step(action)
+        info = {'lines': state.lines, 'pieces': state.pieces}
+        return self.observe(), state.lines - lines, state.over, info
+
+    def observe(self):
+        """
+        The observe function draws the board and the falling piece into an
+        array. It reads the row bitmasks, so the board is a BitPlayfield.
+
+        :return: A (height, width) uint8 array
+        """
+        board = self.state.board
+        assert isinstance(board, engine.BitPlayfield), "observe() needs a BitPlayfield"
+        rows = np.array(board.rows, dtype=np.int64)
+        obs = ((rows[:, None] >> self.columns) & 1).astype(np.uint8)
+        for x, y in self.state.piece.cells:
+            obs[y, x] = PIECE
+        return obs
+
+
+############################################################
+# VECTETRISENV CLASS
+############################################################
+
+class VecTetrisEnv():
+    """
+    VecTetrisEnv class:
+    K games stepped together, each one reset as soon as it is over
+
+    :attr num_envs: type: int - number of games
+    :attr batch: type: BatchTetris - the games
+    :attr num_actions: type: int - number of valid actions
+    """
+
+    num_actions = len(engine.ACTIONS)
+
+    def __init__(self, num_envs, width=10, height=20, seed=None, kicks=False):
+        self.num_envs = num_envs
+        self.batch = BatchTetris(num_envs, width, height, seed=seed, kicks=kicks)
+        # from reset() on, each game draws its pieces like TetrisEnv(seed=seed + i)
+        self.batch.randomizers = [
+            engine.UniformRandomizer(rng=random.Random(None if seed is None else seed + i))
+            for i in range(num_envs)]
+        self.games = np.arange(num_envs)
+
+    def reset(self):
+        """
+        The reset function starts a new game in every environment.
+
+        :return: A (K, height, width) array with the first observations
+        """
+        self.batch.reset()
+        return self.observe()
+
+    def step(self, actions):
+        """
+        The step function applies one action to every game and resets
+        the games that ended.
+
+        :param actions: A (K,) array of engine.ACTIONS
+        :return: (observations, rewards, dones, info) where info holds the
+                 'lines' and 'pieces' of each game before any reset and,
+                 when a game ended, 'final_observation' with the
+                 observations taken before the reset
+        """
+        batch = self.batch
+        rewards = batch.step(actions)[1]
+        dones = batch.over.copy()
+        info = {'lines': batch.lines.copy(), 'pieces': batch.pieces.copy()}
+        if dones.any():
+            info['final_observation'] = self.observe()
+            batch.reset(dones)
+        return self.observe(), rewards, dones, info
+
+    def observe(self):
+        """
+        The observe function draws every board and falling piece into an array.
+
+        :return: A (K, height, width) uint8 array
+        """
+        batch = self.batch
+        obs = batch.boards.astype(np.uint8)
+        cells = batch.cells()
+        obs[self.games[:, None], cells[..., 1], cells[..., 0]] = PIECE
+        return obs
@@ -9,6 +9,8 @@ under the MIT licence terms
 
 Upgraded to Python 3
 Modified to add deadzones, reduce noise, and support vibration
+Split into Gamepad, the event model, and XInputJoystick, so that the
+backends in joydev (Linux, scripted) dispatch the same events
 Only req is Pyglet 1.2alpha1 or higher:
 pip install --upgrade http://pyglet.googlecode.com/archive/tip.zip 
 """
@@ -16,8 +18,7 @@ pip install --upgrade http://pyglet.googlecode.com/archive/tip.zip
 import ctypes
 import sys
 import time
-from operator import itemgetter, attrgetter
-from itertools import count, starmap
+from operator import attrgetter
 from pyglet import event
 
 # structs according to
@@ -36,6 +37,15 @@ class XINPUT_GAMEPAD(ctypes.Structure):
     ]
 
 
+# (name, data size, is a trigger) of every axis of the gamepad: the fields
+# but the buttons, in their order. Built once rather than for every packet.
+AXES = tuple((name, ctypes.sizeof(type), name in ('left_trigger', 'right_trigger'))
+             for name, type in XINPUT_GAMEPAD._fields_ if name != 'buttons')
+
+# full scale of the unsigned values of each data size, 2 ** bits - 1
+FULL_SCALE = dict((size, float(2 ** (8 * size) - 1)) for name, size, trigger in AXES)
+
+
 class XINPUT_STATE(ctypes.Structure):
     _fields_ = [
         ('packet_number', ctypes.c_ulong),  # dwPacketNumber
@@ -51,7 +61,12 @@ class XINPUT_BATTERY_INFORMATION(ctypes.Structure):
     _fields_ = [("BatteryType", ctypes.c_ubyte),
                 ("BatteryLevel", ctypes.c_ubyte)]
 
-xinput = ctypes.windll.xinput1_4
+try:
+    xinput = ctypes.windll.xinput1_4
+except AttributeError:
+    # not Windows: there is no XInput, but the structs and the Gamepad
+    # class are still used by the other backends, see joydev
+    xinput = None
 #xinput = ctypes.windll.xinput9_1_0  # this is the Win 8 version ?
 # xinput1_2, xinput1_1 (32-bit Vista SP1)
 # xinput1_3 (64-bit Vista SP1)
@@ -111,25 +126,24 @@ ERROR_DEVICE_NOT_CONNECTED = 1167
 ERROR_SUCCESS = 0
 
 
-class XInputJoystick(event.EventDispatcher):
+class Gamepad(event.EventDispatcher):
 
     """
-    XInputJoystick
+    Gamepad
 
-    A stateful wrapper, using pyglet event model, that binds to one
-    XInput device and dispatches events when states change.
-
-    Example:
-    controller_one = XInputJoystick(0)
+    The state-change event model shared by every joystick backend: a
+    subclass returns XINPUT_STATE structures from get_state, and
+    dispatch_events compares each new state with the last one and
+    dispatches on_button and on_axis events for what changed. See
+    XInputJoystick below and joydev for the other backends.
     """
-    max_devices = 4
 
     def __init__(self, device_number, normalize_axes=True):
         values = vars()
         del values['self']
         self.__dict__.update(values)
 
-        super(XInputJoystick, self).__init__()
+        super(Gamepad, self).__init__()
 
         self._last_state = self.get_state()
         self.received_packets = 0
@@ -143,69 +157,18 @@ class XInputJoystick(event.EventDispatcher):
     def translate_using_data_size(self, value, data_size):
         # normalizes analog data to [0,1] for unsigned data
         #  and [-0.5,0.5] for signed data
-        data_bits = 8 * data_size
-        return float(value) / (2 ** data_bits - 1)
+        return value / FULL_SCALE[data_size]
 
     def translate_identity(self, value, data_size=None):
         return value
 
     def get_state(self):
-        "Get the state of the controller represented by this object"
-        state = XINPUT_STATE()
-        res = xinput.XInputGetState(self.device_number, ctypes.byref(state))
-        if res == ERROR_SUCCESS:
-            return state
-        if res != ERROR_DEVICE_NOT_CONNECTED:
-            raise RuntimeError(
-                "Unknown error %d attempting to get state of device %d" % (res, self.device_number))
-        # else return None (device is not connected)
+        "Get the state of the controller, None if it is not connected"
+        pass # must override in subclass
 
     def is_connected(self):
         return self._last_state is not None
 
-    @staticmethod
-    def enumerate_devices():
-        "Returns the devices that are connected"
-        devices = list(
-            map(XInputJoystick, list(range(XInputJoystick.max_devices))))
-        return [d for d in devices if d.is_connected()]
-
-    def set_vibration(self, left_motor, right_motor):
-        "Control the speed of both motors seperately"
-        # Set up function argument types and return type
-        XInputSetState = xinput.XInputSetState
-        XInputSetState.argtypes = [ctypes.c_uint, ctypes.POINTER(XINPUT_VIBRATION)]
-        XInputSetState.restype = ctypes.c_uint
-
-        vibration = XINPUT_VIBRATION(
-            int(left_motor * 65535), int(right_motor * 65535))
-        XInputSetState(self.device_number, ctypes.byref(vibration))
-
-    def get_battery_information(self):
-        "Get battery type & charge level"
-        BATTERY_DEVTYPE_GAMEPAD = 0x00
-        BATTERY_DEVTYPE_HEADSET = 0x01
-        # Set up function argument types and return type
-        XInputGetBatteryInformation = xinput.XInputGetBatteryInformation
-        XInputGetBatteryInformation.argtypes = [ctypes.c_uint, ctypes.c_ubyte, ctypes.POINTER(XINPUT_BATTERY_INFORMATION)]
-        XInputGetBatteryInformation.restype = ctypes.c_uint 
-
-        battery = XINPUT_BATTERY_INFORMATION(0,0)
-        XInputGetBatteryInformation(self.device_number, BATTERY_DEVTYPE_GAMEPAD, ctypes.byref(battery))
-
-        #define BATTERY_TYPE_DISCONNECTED       0x00
-        #define BATTERY_TYPE_WIRED              0x01
-        #define BATTERY_TYPE_ALKALINE           0x02
-        #define BATTERY_TYPE_NIMH               0x03
-        #define BATTERY_TYPE_UNKNOWN            0xFF
-        #define BATTERY_LEVEL_EMPTY             0x00
-        #define BATTERY_LEVEL_LOW               0x01
-        #define BATTERY_LEVEL_MEDIUM            0x02
-        #define BATTERY_LEVEL_FULL              0x03
-        batt_type = "Unknown" if battery.BatteryType == 0xFF else ["Disconnected", "Wired", "Alkaline","Nimh"][battery.BatteryType]
-        level = ["Empty", "Low", "Medium", "Full"][battery.BatteryLevel]
-        return batt_type, level
-
     def dispatch_events(self):
         "The main event loop for a joystick"
         state = self.get_state()
@@ -234,33 +197,34 @@ class XInputJoystick(event.EventDispatcher):
         self.dispatch_button_events(state)
 
     def dispatch_axis_events(self, state):
-        # axis fields are everything but the buttons
-        axis_fields = dict(XINPUT_GAMEPAD._fields_)
-        axis_fields.pop('buttons')
-        for axis, type in list(axis_fields.items()):
-            old_val = getattr(self._last_state.gamepad, axis)
-            new_val = getattr(state.gamepad, axis)
-            data_size = ctypes.sizeof(type)
-            old_val = self.translate(old_val, data_size)
-            new_val = self.translate(new_val, data_size)
+        old_gamepad = self._last_state.gamepad
+        new_gamepad = state.gamepad
+        translate = self.translate
+        for axis, data_size, trigger in AXES:
+            old_val = getattr(old_gamepad, axis)
+            new_val = getattr(new_gamepad, axis)
+            if old_val == new_val:
+                # no event for an axis that did not move
+                continue
+            old_val = translate(old_val, data_size)
+            new_val = translate(new_val, data_size)
 
             # an attempt to add deadzones and dampen noise
             # done by feel rather than following http://msdn.microsoft.com/en-gb/library/windows/desktop/ee417001%28v=vs.85%29.aspx#dead_zone
             # ags, 2014-07-01
             if ((old_val != new_val and (new_val > 0.08000000000000000 or new_val < -0.08000000000000000) and abs(old_val - new_val) > 0.00000000500000000) or
-               (axis == 'right_trigger' or axis == 'left_trigger') and new_val == 0 and abs(old_val - new_val) > 0.00000000500000000):
+               trigger and new_val == 0 and abs(old_val - new_val) > 0.00000000500000000):
                 self.dispatch_event('on_axis', axis, new_val)
 
     def dispatch_button_events(self, state):
-        changed = state.gamepad.buttons ^ self._last_state.gamepad.buttons
-        changed = get_bit_values(changed, 16)
-        buttons_state = get_bit_values(state.gamepad.buttons, 16)
-        changed.reverse()
-        buttons_state.reverse()
-        button_numbers = count(1)
-        changed_buttons = list(
-            filter(itemgetter(0), list(zip(changed, button_numbers, buttons_state))))
-        tuple(starmap(self.dispatch_button_event, changed_buttons))
+        # button n is bit n - 1; walk the changed bits from the lowest,
+        # x & -x isolating the lowest set bit of x
+        buttons = state.gamepad.buttons
+        changed = buttons ^ self._last_state.gamepad.buttons
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            self.dispatch_button_event(1, bit.bit_length(), 1 if buttons & bit else 0)
 
     def dispatch_button_event(self, changed, number, pressed):
         self.dispatch_event('on_button', number, pressed)
@@ -278,7 +242,7 @@ class XInputJoystick(event.EventDispatcher):
     def on_missed_packet(self, number):
         pass
 
-list(map(XInputJoystick.register_event_type, [
+list(map(Gamepad.register_event_type, [
     'on_state_changed',
     'on_axis',
     'on_button',
@@ -286,6 +250,77 @@ list(map(XInputJoystick.register_event_type, [
 ]))
 
 
+class XInputJoystick(Gamepad):
+
+    """
+    XInputJoystick
+
+    A stateful wrapper, using pyglet event model, that binds to one
+    XInput device and dispatches events when states change.
+
+    Example:
+    controller_one = XInputJoystick(0)
+    """
+    max_devices = 4
+
+    def get_state(self):
+        "Get the state of the controller represented by this object"
+        state = XINPUT_STATE()
+        res = xinput.XInputGetState(self.device_number, ctypes.byref(state))
+        if res == ERROR_SUCCESS:
+            return state
+        if res != ERROR_DEVICE_NOT_CONNECTED:
+            raise RuntimeError(
+                "Unknown error %d attempting to get state of device %d" % (res, self.device_number))
+        # else return None (device is not connected)
+
+    @staticmethod
+    def enumerate_devices():
+        "Returns the devices that are connected"
+        if xinput is None:
+            return []
+        devices = list(
+            map(XInputJoystick, list(range(XInputJoystick.max_devices))))
+        return [d for d in devices if d.is_connected()]
+
+    def set_vibration(self, left_motor, right_motor):
+        "Control the speed of both motors seperately"
+        # Set up function argument types and return type
+        XInputSetState = xinput.XInputSetState
+        XInputSetState.argtypes = [ctypes.c_uint, ctypes.POINTER(XINPUT_VIBRATION)]
+        XInputSetState.restype = ctypes.c_uint
+
+        vibration = XINPUT_VIBRATION(
+            int(left_motor * 65535), int(right_motor * 65535))
+        XInputSetState(self.device_number, ctypes.byref(vibration))
+
+    def get_battery_information(self):
+        "Get battery type & charge level"
+        BATTERY_DEVTYPE_GAMEPAD = 0x00
+        BATTERY_DEVTYPE_HEADSET = 0x01
+        # Set up function argument types and return type
+        XInputGetBatteryInformation = xinput.XInputGetBatteryInformation
+        XInputGetBatteryInformation.argtypes = [ctypes.c_uint, ctypes.c_ubyte, ctypes.POINTER(XINPUT_BATTERY_INFORMATION)]
+        XInputGetBatteryInformation.restype = ctypes.c_uint 
+
+        battery = XINPUT_BATTERY_INFORMATION(0,0)
+        XInputGetBatteryInformation(self.device_number, BATTERY_DEVTYPE_GAMEPAD, ctypes.byref(battery))
+
+        #define BATTERY_TYPE_DISCONNECTED       0x00
+        #define BATTERY_TYPE_WIRED              0x01
+        #define BATTERY_TYPE_ALKALINE           0x02
+        #define BATTERY_TYPE_NIMH               0x03
+        #define BATTERY_TYPE_UNKNOWN            0xFF
+        #define BATTERY_LEVEL_EMPTY             0x00
+        #define BATTERY_LEVEL_LOW               0x01
+        #define BATTERY_LEVEL_MEDIUM            0x02
+        #define BATTERY_LEVEL_FULL              0x03
+        batt_type = "Unknown" if battery.BatteryType == 0xFF else ["Disconnected", "Wired", "Alkaline","Nimh"][battery.BatteryType]
+        level = ["Empty", "Low", "Medium", "Full"][battery.BatteryLevel]
+        return batt_type, level
+
+
+
 def determine_optimal_sample_rate(joystick=None):
     """
     Poll the joystick slowly (beginning at 1 sample per second)